@@ -0,0 +1,468 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import soundfile as sf
+import numpy as np
+import rich
+from loudness import measure
+from decoder import decode
+
+# --------------------------
+# Settings
+# --------------------------
+STREAM_SR = 48000
+CHANNELS = 2
+CACHE_PATH = os.path.join("sounds", "cache")
+LOUDNESS_TARGET = -16.0  # LUFS, applied as a gain at load time (see loudness.normalize_gain)
+TRUE_PEAK_LIMIT = -1.5  # dBTP
+CACHE_MAX_BYTES = 4 * 1024 ** 3  # LRU eviction kicks in above this
+
+# "flac": compressed, decoded into RAM on load
+# "npy":  raw float32, memory-mapped on load (instant, paged in on play, ~2-3x the disk space)
+CACHE_FORMATS = ("flac", "npy")
+CACHE_FORMAT = "flac"
+
+INDEX_NAME = "index.sqlite"
+TMP_GRACE = 3600  # seconds before a .tmp file counts as a crashed write (another process may be writing it)
+
+stats = {"hits": 0, "misses": 0, "evicted": 0}
+_stats_lock = threading.Lock()
+_prompt_lock = threading.Lock()  # one "invalidate?" prompt at a time during warmup
+
+# --------------------------
+# Cache index
+# --------------------------
+def hash_file(path, chunk_size=1 << 20):
+    """Content hash of a file (blake2b, hex)."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+class CacheIndex:
+    """
+    SQLite index of the processed-audio cache in `cache_path`.
+
+    Entries are keyed on the *content* of the source file plus every
+    processing parameter (sample rate, channels, format),
+    so two files with the same basename never collide and editing a file
+    gives it a new entry. Source content hashes are memoized by
+    path + mtime + size so unchanged files aren't re-read on every start.
+    Loudness measurements are stored per entry, so re-targeting loudness
+    is a gain change instead of a re-transcode.
+
+    Thread-safe, warm_cache() uses one index from many workers.
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        os.makedirs(cache_path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._db = sqlite3.connect(os.path.join(cache_path, INDEX_NAME), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                mtime REAL,
+                size INTEGER,
+                hash TEXT
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                hash TEXT,
+                params TEXT,
+                file TEXT,
+                bytes INTEGER,
+                created REAL,
+                last_used REAL
+            );
+            CREATE TABLE IF NOT EXISTS loudness (
+                key TEXT PRIMARY KEY,
+                integrated REAL,
+                true_peak REAL
+            );
+        """)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ---- sources ----
+    def source_hash(self, path):
+        """
+        Content hash of `path`, rehashed only when its mtime/size changed.
+        When a file changes, entries for its old content are dropped unless
+        another known file still has that content.
+        """
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        with self._lock:
+            row = self._db.execute("SELECT mtime, size, hash FROM sources WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == st.st_mtime and row[1] == st.st_size:
+            return row[2]
+
+        new_hash = hash_file(path)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                             (path, st.st_mtime, st.st_size, new_hash))
+            self._db.commit()
+
+        if row and row[2] != new_hash:
+            self._drop_stale(row[2])
+        return new_hash
+
+    def _drop_stale(self, old_hash):
+        with self._lock:
+            still_used = self._db.execute("SELECT 1 FROM sources WHERE hash = ? LIMIT 1", (old_hash,)).fetchone()
+            if still_used:
+                return
+            rows = self._db.execute("SELECT key, file FROM entries WHERE hash = ?", (old_hash,)).fetchall()
+            self._db.execute("DELETE FROM entries WHERE hash = ?", (old_hash,))
+            self._db.execute("DELETE FROM loudness WHERE key LIKE ?", (old_hash + ":%",))
+            self._db.commit()
+        for key, file in rows:
+            self._remove_file(file)
+            rich.print(f"[Audio Cache] [yellow]STALE[/yellow] dropped {file}")
+
+    # ---- entries ----
+    @staticmethod
+    def make_key(content_hash, params):
+        blob = content_hash + json.dumps(params, sort_keys=True)
+        return hashlib.blake2b(blob.encode(), digest_size=16).hexdigest()
+
+    def key_lock(self, key):
+        """Per-entry lock, so two workers never build the same entry twice."""
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def lookup(self, key):
+        """Path of the cached file for `key`, or None. Marks it as used."""
+        with self._lock:
+            row = self._db.execute("SELECT file FROM entries WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            path = os.path.join(self.cache_path, row[0])
+            if not os.path.exists(path):
+                # deleted behind our back
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return path
+
+    def add(self, key, content_hash, params, file):
+        now = time.time()
+        size = os.path.getsize(os.path.join(self.cache_path, file))
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (key, content_hash, json.dumps(params, sort_keys=True), file, size, now, now))
+            self._db.commit()
+
+    def remove(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT file FROM entries WHERE key = ?", (key,)).fetchone()
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db.commit()
+        if row:
+            self._remove_file(row[0])
+
+    # ---- loudness ----
+    @staticmethod
+    def loudness_key(content_hash, params):
+        # measurements only depend on the audio, not on the cache format
+        return f"{content_hash}:{params['sr']}:{params['channels']}"
+
+    def get_loudness(self, key):
+        """(integrated LUFS, true peak dBTP) stored for `key`, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT integrated, true_peak FROM loudness WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        # sqlite has no infinities, silence is stored as NULL
+        return tuple(float("-inf") if v is None else v for v in row)
+
+    def set_loudness(self, key, measurement):
+        integrated, peak = (None if not np.isfinite(v) else v for v in measurement)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?)", (key, integrated, peak))
+            self._db.commit()
+
+    def total_bytes(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+
+    def evict(self, max_bytes, keep=()):
+        """
+        Delete least-recently-used entries until the cache is at most
+        `max_bytes`. Keys in `keep` (in use right now) are never evicted.
+        """
+        total = self.total_bytes()
+        if total <= max_bytes:
+            return 0
+
+        with self._lock:
+            rows = self._db.execute("SELECT key, bytes FROM entries ORDER BY last_used ASC").fetchall()
+        evicted = 0
+        for key, size in rows:
+            if total <= max_bytes:
+                break
+            if key in keep:
+                continue
+            self.remove(key)
+            total -= size
+            evicted += 1
+
+        with _stats_lock:
+            stats["evicted"] += evicted
+        if evicted:
+            rich.print(f"[Audio Cache] Evicted {evicted} entries, cache now {total / 1024 ** 2:.0f} MiB")
+        return evicted
+
+    def prune_orphans(self):
+        """
+        Remove cache files the index doesn't know about (old naming scheme,
+        crashed writes). Temp files younger than TMP_GRACE are left alone,
+        another process sharing the cache may still be writing them.
+        """
+        with self._lock:
+            known = {row[0] for row in self._db.execute("SELECT file FROM entries")}
+        ours = re.compile(r"^([0-9a-f]{32}(\.tmp)?\.\w+|.+_\d+hz_(norm|raw)\.flac)$")
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.cache_path):
+            match = ours.match(name)
+            if name in known or not match:
+                continue
+            if match.group(2):
+                try:
+                    if now - os.path.getmtime(os.path.join(self.cache_path, name)) < TMP_GRACE:
+                        continue
+                except FileNotFoundError:
+                    continue  # finished and renamed meanwhile
+            if self._remove_file(name):
+                removed += 1
+        if removed:
+            rich.print(f"[Audio Cache] Removed {removed} orphaned cache files")
+        return removed
+
+    def _remove_file(self, file):
+        """
+        Delete a cache file. One that can't go yet (still memory-mapped on
+        Windows) stays as an orphan for the next prune. Returns whether it's gone.
+        """
+        try:
+            os.remove(os.path.join(self.cache_path, file))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            rich.print(f"[Audio Cache] [yellow]Can't remove {file} yet[/yellow] ({e}), pruning it later")
+            return False
+        return True
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(cache_path=CACHE_PATH):
+    """Shared CacheIndex for `cache_path`."""
+    key = os.path.realpath(cache_path)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = CacheIndex(cache_path)
+        return _indexes[key]
+
+def clear_cache(cache_path=CACHE_PATH):
+    """Delete every file in the cache dir, including the index."""
+    key = os.path.realpath(cache_path)
+    with _indexes_lock:
+        index = _indexes.pop(key, None)
+    if index:
+        index.close()
+    if os.path.isdir(cache_path):
+        for file in os.listdir(cache_path):
+            os.remove(os.path.join(cache_path, file))
+
+# --------------------------
+# Audio file preprocessing
+# --------------------------
+def cache_params(stream_sr=STREAM_SR, cache_format=CACHE_FORMAT):
+    """
+    Everything that affects the processed output; part of the cache key.
+    Loudness isn't: it's measured once and applied as a gain at load time.
+    """
+    if cache_format not in CACHE_FORMATS:
+        raise ValueError(f"Unknown cache format: {cache_format}")
+    return {
+        "sr": stream_sr,
+        "channels": CHANNELS,
+        "format": cache_format,
+    }
+
+def _transcode(file, out_path, params):
+    """Decode/resample `file` (in-process when possible) and write it as FLAC."""
+    data = decode(file, params["sr"], params["channels"])
+    sf.write(out_path, data, params["sr"], format="FLAC", subtype="PCM_24")
+
+def _build_npy(index, key, file, content_hash, params, out_path):
+    """
+    Write the raw float32 .npy for an entry. Reuses the FLAC entry for the
+    same content/settings if there is one, otherwise decodes the source.
+    """
+    flac_params = dict(params, format="flac")
+    flac_file = index.lookup(index.make_key(content_hash, flac_params))
+
+    if flac_file is not None:
+        data, _ = sf.read(flac_file, dtype="float32", always_2d=True)
+        if data.shape[1] == 1:
+            data = np.column_stack([data, data])
+    else:
+        data = decode(file, params["sr"], params["channels"])
+
+    tmp_npy = os.path.join(index.cache_path, f"{key}.tmp.npy")
+    np.save(tmp_npy, np.ascontiguousarray(data))
+    os.replace(tmp_npy, out_path)
+
+def load_audio_cached(file, normalize=True, recurse=False, stream_sr=STREAM_SR, cache_path=CACHE_PATH,
+                      cache_format=CACHE_FORMAT):
+    """
+    Load any audio file with resampling and cache the processed result for
+    fast future loads.
+
+    cache_format "flac" decodes the cached file into RAM, "npy" returns a
+    read-only np.memmap of raw float32 frames, which opens in microseconds
+    and only touches RAM for the parts that are actually played.
+
+    With `normalize`, the loudness of the processed audio is measured once
+    (integrated LUFS + true peak) and stored in the cache index; turn it
+    into a gain with loudness.normalize_gain(). The audio itself is never
+    altered, so changing the loudness target needs no re-transcode.
+
+    Returns (data, sr, key, loudness), key being the cache index entry and
+    loudness (integrated, true_peak), or None without `normalize`.
+    """
+    index = get_index(cache_path)
+    params = cache_params(stream_sr, cache_format)
+    content_hash = index.source_hash(file)
+    key = index.make_key(content_hash, params)
+
+    with index.key_lock(key):
+        cached_file = index.lookup(key)
+
+        if cached_file is None:
+            name = f"{key}.{cache_format}"
+            cached_file = os.path.join(cache_path, name)
+
+            rich.print(f"[Audio Cache] Creating cached {cache_format.upper()}: {cached_file}")
+            if cache_format == "npy":
+                _build_npy(index, key, file, content_hash, params, cached_file)
+            else:
+                tmp_file = os.path.join(cache_path, f"{key}.tmp.flac")
+                _transcode(file, tmp_file, params)
+                os.replace(tmp_file, cached_file)
+            index.add(key, content_hash, params, name)
+
+            rich.print(f"[Audio Cache] Cache {'[red]MISS' if recurse == False else '[cyan]RELOAD'} [blue]{file}")
+            with _stats_lock:
+                stats["misses"] += 1
+        else:
+            rich.print(f"[Audio Cache] Cache [green]HIT [blue]{file}")
+            with _stats_lock:
+                stats["hits"] += 1
+
+    # Load cached file (very fast, or no read at all for npy)
+    try:
+        if cache_format == "npy":
+            data, sr = np.load(cached_file, mmap_mode="r"), stream_sr
+        else:
+            data, sr = sf.read(cached_file, dtype="float32")
+    except (RuntimeError, ValueError, OSError):
+        with _prompt_lock:
+            rich.print(f"[Audio Cache] Cached file {cached_file} [yellow]READ FAILURE")
+            invalidate = input("Invalidate cache and reload? (y/n) ").lower() in {"y", "yes"}
+            if invalidate:
+                index.remove(key)
+        if invalidate:
+            return load_audio_cached(file, normalize, True, stream_sr, cache_path, cache_format)
+        else:
+            raise
+
+    # Ensure stereo
+    if data.ndim == 1:
+        data = np.column_stack([data, data])
+
+    if sr != stream_sr:
+        raise RuntimeError(
+            f"Sample rate mismatch in {file}: {sr} Hz"
+        )
+
+    loudness = None
+    if normalize:
+        loud_key = index.loudness_key(content_hash, params)
+        loudness = index.get_loudness(loud_key)
+        if loudness is None:
+            # analysis pass, only ever runs once per file content
+            loudness = measure(data, sr)
+            index.set_loudness(loud_key, loudness)
+            rich.print(f"[Audio Cache] Measured {loudness[0]:.1f} LUFS, {loudness[1]:.1f} dBTP [blue]{file}")
+
+    return data, sr, key, loudness
+
+# --------------------------
+# Parallel warmup
+# --------------------------
+def warm_cache(files, normalize=True, stream_sr=STREAM_SR, cache_path=CACHE_PATH, workers=None,
+               max_bytes=CACHE_MAX_BYTES, cache_format=CACHE_FORMAT, keep=()):
+    """
+    Load many files at once, transcoding cache misses in parallel.
+
+    Runs at most `workers` (default: one per core) loads at a time, so at
+    most that many decodes (or ffmpeg processes) run at once. Paths that
+    point at the same file are only loaded once. Afterwards the cache is trimmed to
+    `max_bytes`, least recently used first, never touching what was just
+    loaded or the entries in `keep` (keys of sounds still loaded elsewhere,
+    whose npy files may be memory-mapped). Returns
+    {realpath: (data, sr, loudness, key)}; files that failed to load are
+    left out.
+    """
+    unique = list(dict.fromkeys(os.path.realpath(f) for f in files))
+    if not unique:
+        return {}
+
+    index = get_index(cache_path)
+    index.prune_orphans()
+
+    workers = workers or os.cpu_count() or 1
+    total = len(unique)
+    rich.print(f"[Audio Cache] Warming {total} files with {workers} workers")
+
+    loaded = {}
+    used_keys = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(load_audio_cached, f, normalize, False, stream_sr, cache_path, cache_format): f
+            for f in unique
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            file = futures[future]
+            try:
+                data, sr, key, loudness = future.result()
+                loaded[file] = (data, sr, loudness, key)
+                used_keys.add(key)
+            except Exception as e:
+                rich.print(f"[Audio Cache] [red]FAILED[/red] {file}: {e}")
+            rich.print(f"[Audio Cache] Warmup {done}/{total}")
+
+    index.evict(max_bytes, keep=used_keys | set(keep))
+    rich.print(f"[Audio Cache] Warmup done ({stats['hits']} hits, {stats['misses']} misses, "
+               f"{index.total_bytes() / 1024 ** 2:.0f} MiB cached)")
+    return loaded
@@ -0,0 +1,219 @@
+import os
+import subprocess
+import threading
+from math import gcd
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+from ringbuffer import RingBuffer
+
+# --------------------------
+# Settings
+# --------------------------
+# Decoded in-process by libsndfile; anything else (or anything libsndfile
+# chokes on) goes through ffmpeg.
+SNDFILE_EXTS = {".wav", ".flac", ".ogg", ".oga", ".opus", ".aif", ".aiff", ".mp3"}
+
+stats = {"sndfile": 0, "ffmpeg": 0}
+
+# --------------------------
+# Decoding
+# --------------------------
+def resample(data, sr_in, sr_out):
+    """Polyphase resample a (frames, channels) float32 array."""
+    if sr_in == sr_out:
+        return data
+    g = gcd(sr_in, sr_out)
+    return resample_poly(data, sr_out // g, sr_in // g, axis=0).astype(np.float32, copy=False)
+
+def _to_channels(data, channels):
+    if data.shape[1] == channels:
+        return data
+    if data.shape[1] == 1:
+        return np.repeat(data, channels, axis=1)
+    return None  # real downmixing is left to ffmpeg
+
+def decode_sndfile(file, sr, channels=2):
+    """
+    Decode with libsndfile in-process. Returns a (frames, channels) float32
+    array at `sr`, or None if the file needs ffmpeg.
+    """
+    if os.path.splitext(file)[1].lower() not in SNDFILE_EXTS:
+        return None
+    try:
+        data, file_sr = sf.read(file, dtype="float32", always_2d=True)
+    except (RuntimeError, TypeError):
+        # unsupported codec inside a known container, let ffmpeg try
+        return None
+
+    data = _to_channels(data, channels)
+    if data is None:
+        return None
+    return np.ascontiguousarray(resample(data, file_sr, sr))
+
+def decode_ffmpeg(file, sr, channels=2):
+    """Decode anything ffmpeg understands. Returns a (frames, channels) float32 array at `sr`."""
+    cmd = [
+        "ffmpeg",
+        "-nostdin",  # never read the console, decodes run while the keyboard is in use
+        "-i", file,
+        "-ar", str(sr),
+        "-ac", str(channels),
+        "-f", "f32le",
+        "pipe:1"
+    ]
+
+    proc = subprocess.run(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True
+    )
+
+    data = np.frombuffer(proc.stdout, dtype=np.float32)
+    if data.size % channels != 0:
+        raise RuntimeError(f"Audio stream is not {channels}-channel aligned")
+    # frombuffer is read-only over the pipe bytes; callers expect a writable array
+    return data.reshape(-1, channels).copy()
+
+def decode(file, sr, channels=2):
+    """
+    Decode `file` to a (frames, channels) float32 array at `sr`.
+    Uses libsndfile + a polyphase resampler when it can, which avoids a
+    process spawn and a pipe copy per file, and ffmpeg otherwise.
+    """
+    data = decode_sndfile(file, sr, channels)
+    if data is not None:
+        stats["sndfile"] += 1
+        return data
+    stats["ffmpeg"] += 1
+    return decode_ffmpeg(file, sr, channels)
+
+def probe_frames(file, sr):
+    """Track length in frames at `sr`, from the file header. 0 if unknown."""
+    try:
+        info = sf.info(file)
+        return int(info.frames * sr // info.samplerate)
+    except (RuntimeError, TypeError):
+        pass
+    try:
+        # only the players need this, the sound board runs without mutagen installed
+        from mutagen import File as MutagenFile
+        return int(MutagenFile(file).info.length * sr)
+    except Exception:
+        return 0
+
+# --------------------------
+# Streaming
+# --------------------------
+class StreamDecoder:
+    """
+    Decodes one track incrementally through ffmpeg into a bounded RingBuffer.
+
+    A feeder thread reads ffmpeg's f32le output in small chunks and waits
+    whenever the ring is full, so memory use is the ring size regardless of
+    track length and playback can start as soon as the first block is in.
+    Seeking means starting a new StreamDecoder at `start` (in frames).
+
+    Seeks are sample accurate: ffmpeg seeks to the whole second before
+    `start`, which lands on an exact sample at any input rate, and the
+    feeder drops the frames up to `start`.
+
+    `filters` is passed to ffmpeg as -af (e.g. loudnorm for WAVs), `gain`
+    scales the decoded audio. `frames` is the track length if already
+    known, otherwise it's read from the file header.
+    """
+
+    def __init__(self, file, sr, channels=2, start=0, ring_frames=1 << 17,
+                 chunk_frames=4096, filters=None, gain=1.0, frames=None):
+        self.file = file
+        self.sr = sr
+        self.channels = channels
+        self.frames = frames if frames is not None else probe_frames(file, sr)
+        self.gain = gain
+        self.pos = start  # frame of the track returned by the next read
+        self.ring = RingBuffer(ring_frames, channels)
+        self.done = False  # feeder finished (end of track, error or close)
+        self.error = None
+        self._chunk_frames = min(chunk_frames, self.ring.capacity)
+        self._stop = threading.Event()
+
+        seconds, self._skip = divmod(start, sr)
+        cmd = ["ffmpeg", "-nostdin"]
+        if seconds > 0:
+            cmd += ["-ss", str(seconds)]
+        cmd += ["-i", file, "-ar", str(sr), "-ac", str(channels)]
+        if filters:
+            cmd += ["-af", filters]
+        cmd += ["-f", "f32le", "pipe:1"]
+
+        self._proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0
+        )
+        self._thread = threading.Thread(target=self._feed, daemon=True)
+        self._thread.start()
+
+    def _feed(self):
+        frame_bytes = 4 * self.channels
+        raw = bytearray(self._chunk_frames * frame_bytes)
+        view = memoryview(raw)
+        block = np.frombuffer(raw, dtype=np.float32).reshape(-1, self.channels)
+        filled = 0  # bytes in raw, may end mid-frame
+
+        try:
+            while not self._stop.is_set():
+                n = self._proc.stdout.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+                frames = filled // frame_bytes
+
+                skip = min(self._skip, frames)
+                self._skip -= skip
+                if self.gain != 1.0:
+                    block[skip:frames] *= self.gain
+                # wait for the player to make room, never drop decoded audio
+                while self.ring.free() < frames - skip:
+                    if self._stop.wait(0.01):
+                        return
+                self.ring.write(block[skip:frames])
+
+                # keep a partial frame for the next read
+                rest = filled - frames * frame_bytes
+                raw[:rest] = raw[frames * frame_bytes:filled]
+                filled = rest
+
+            code = self._proc.wait()
+            if code and not self._stop.is_set():
+                self.error = f"ffmpeg exited with code {code}"
+        except OSError as e:
+            if not self._stop.is_set():
+                self.error = str(e)
+        finally:
+            self._proc.stdout.close()
+            self.done = True
+
+    def ready(self, frames):
+        """True once `frames` frames are buffered, or the track has ended."""
+        return self.done or self.ring.available() >= frames
+
+    @property
+    def eof(self):
+        """Every decoded frame has been read."""
+        return self.done and self.ring.available() == 0
+
+    def read_into(self, out, frames=None):
+        """Fill `out[:frames]` with the next frames, zero padded. Returns frames read."""
+        n = self.ring.read_into(out, frames)
+        self.pos += n
+        return n
+
+    def close(self):
+        """Stop decoding. Safe to call from any thread, more than once."""
+        self._stop.set()
+        if self._proc.poll() is None:
+            # unblocks the feeder, which then closes the pipe
+            self._proc.kill()
@@ -1,7 +1,78 @@
+import os
+import threading
+from functools import partial
 import numpy as np
-from numba import njit
 
-EFFECT_PARAMS = {
+# ---------------- Kernel compilation ----------------
+# numba is only imported when the first effect is created (or on warmup()),
+# so scripts importing this module for its names and parameters don't pay
+# for it. Compiled kernels are cached on disk by numba, so later starts
+# load them instead of compiling again.
+_KERNELS = []
+_compiled = False
+_compile_lock = threading.Lock()
+
+# options for kernels written as flat loops over whole blocks: fastmath lets
+# LLVM reorder float math into SIMD lanes, and numpy's error model drops the
+# division-by-zero check that would otherwise keep every such loop scalar
+VECTORIZE = {"fastmath": True, "error_model": "numpy"}
+
+def kernel(fn=None, **options):
+    """Mark `fn` as a numba kernel, compiled by _jit() on first use. `options` go to njit."""
+    if fn is None:
+        return partial(kernel, **options)
+    _KERNELS.append((fn.__name__, options))
+    return fn
+
+def _jit():
+    global _compiled
+    if _compiled:
+        return
+    with _compile_lock:
+        if _compiled:
+            return
+        from numba import njit
+        # kernels calling each other resolve these globals when compiling
+        g = globals()
+        for name, options in _KERNELS:
+            g[name] = njit(cache=True, **options)(g[name])
+        _compiled = True
+
+def seed(value):
+    """Seed the random generator kernels draw from (granular jitter), for reproducible renders."""
+    _jit()
+    _seed_kernels(value)
+
+class ParamBlock:
+    """
+    Effect parameters by name, stored in one preallocated float array
+    (`values`) that the kernels read directly. Setting one is a single
+    store, so the control thread can change parameters while the audio
+    thread is processing without any lock. Kernels ramp continuous
+    parameters across the block so live tweaks don't zipper.
+    """
+
+    def __init__(self, defaults):
+        self.names = tuple(defaults)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.values = np.array([defaults[n] for n in self.names], dtype=np.float64)
+
+    def __getitem__(self, name):
+        return float(self.values[self.ids[name]])
+
+    def __setitem__(self, name, value):
+        self.values[self.ids[name]] = value
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def keys(self):
+        return self.names
+
+    def items(self):
+        return [(n, self[n]) for n in self.names]
+
+EFFECT_PARAMS = ParamBlock({
     # ECHO
     "ECHO_ROOM_SIZE": 4800,   # samples (~0.1s at 48kHz)
     "ECHO_WET": 0.25,         # echo volume
@@ -24,6 +95,10 @@ EFFECT_PARAMS = {
     "REV_D1": 1200,
     "REV_D2": 1700,
     "REV_D3": 900,
+    "REV_SPREAD": 23,         # extra delay per channel (stereo width)
+
+    # Convolution reverb
+    "CONV_MIX": 0.3,          # blend dry+convolved
 
     # Pitch shift
     "PITCH_SEMITONES": 0.0,
@@ -34,159 +109,373 @@ EFFECT_PARAMS = {
     "GRAN_GRAIN": 800,
     "GRAN_JITTER": 0.3,
     "GRAN_MIX": 0.25,
-}
+})
+PARAMS = EFFECT_PARAMS.values
+
+# parameter ids, compile-time constants in the kernels
+P_BITCRUSH_BITS = EFFECT_PARAMS.ids["BITCRUSH_BITS"]
+P_BITCRUSH_DOWNSAMPLE = EFFECT_PARAMS.ids["BITCRUSH_DOWNSAMPLE"]
+P_SAT_DRIVE = EFFECT_PARAMS.ids["SAT_DRIVE"]
+P_SAT_EXCITE = EFFECT_PARAMS.ids["SAT_EXCITE"]
+P_REV_WET = EFFECT_PARAMS.ids["REV_WET"]
+P_REV_FEEDBACK = EFFECT_PARAMS.ids["REV_FEEDBACK"]
+P_REV_D1 = EFFECT_PARAMS.ids["REV_D1"]
+P_REV_D2 = EFFECT_PARAMS.ids["REV_D2"]
+P_REV_D3 = EFFECT_PARAMS.ids["REV_D3"]
+P_REV_SPREAD = EFFECT_PARAMS.ids["REV_SPREAD"]
+P_CONV_MIX = EFFECT_PARAMS.ids["CONV_MIX"]
+P_PITCH_SEMITONES = EFFECT_PARAMS.ids["PITCH_SEMITONES"]
+P_FORMANT_SEMITONES = EFFECT_PARAMS.ids["FORMANT_SEMITONES"]
+P_GRANP_GRAIN = EFFECT_PARAMS.ids["GRANP_GRAIN"]
+P_GRAN_GRAIN = EFFECT_PARAMS.ids["GRAN_GRAIN"]
+P_GRAN_JITTER = EFFECT_PARAMS.ids["GRAN_JITTER"]
+P_GRAN_MIX = EFFECT_PARAMS.ids["GRAN_MIX"]
 
 # ---------------- Effect Implementations ----------------
-
-def effect_none(chunk):
-    return chunk
+# Every effect is a class whose instances own their state, so the same
+# effect can run on several streams at once (mic and sound board, ...).
+# process(block, out) reads a (frames, channels) `block` and writes the
+# result into `out` (same shape, may be the same array) and returns `out`.
+# Kernels never allocate, buffers are created in __init__ for `channels`
+# channels, and each channel keeps its own filter state and delay line.
+# Parameters come from PARAMS; `smooth` holds the values a kernel ramped
+# to at the end of the previous block.
+
+@kernel
+def _ramp(smooth, slot, target, frames):
+    """Start value and per-frame step taking smooth[slot] to `target` over `frames`."""
+    start = smooth[slot]
+    smooth[slot] = target
+    return start, (target - start) / max(frames, 1)
+
+class Effect:
+    latency = 0  # frames until an input sample shows up in the output (longest delay line)
+    tail = 0     # frames it keeps sounding after that, feedback aside (impulse response length)
+
+    def __new__(cls, *args, **kwargs):
+        _jit()
+        return super().__new__(cls)
+
+    def process(self, block, out):
+        out[:] = block
+        return out
+
+    def reset(self):
+        """Forget the audio seen so far (tails, delay lines)."""
+        pass
+
+    @staticmethod
+    def _smoothing(*names):
+        return np.array([EFFECT_PARAMS[n] for n in names], dtype=np.float64)
+
+class Bypass(Effect):
+    def __init__(self, channels=1):
+        pass
 
 # HPF
-hpf_prev_in = 0.0
-hpf_prev_out = 0.0
-hpf_alpha = 0.0
-
-def init_hpf(sample_rate, cutoff=100.0):
-    global hpf_alpha
-    rc = 1.0 / (2 * np.pi * cutoff)
-    dt = 1.0 / sample_rate
-    hpf_alpha = rc / (rc + dt)
-
-init_hpf(48000, cutoff=120.0)
-
-@njit
-def hpf_loop(chunk, prev_in, prev_out, alpha):
-    out = np.empty_like(chunk)
-
-    for i in range(len(chunk)):
-        x = chunk[i]
-        y = alpha * (prev_out + x - prev_in)
-
-        out[i] = y
-        prev_in = x
-        prev_out = y
-
-    return out, prev_in, prev_out
+@kernel
+def hpf_loop(chunk, out, prev_in, prev_out, alpha):
+    for c in range(chunk.shape[1]):
+        p_in = prev_in[c]
+        p_out = prev_out[c]
+        for i in range(chunk.shape[0]):
+            x = chunk[i, c]
+            y = alpha * (p_out + x - p_in)
+
+            out[i, c] = y
+            p_in = x
+            p_out = y
+        prev_in[c] = p_in
+        prev_out[c] = p_out
+
+class HighPass(Effect):
+    def __init__(self, channels=1, sample_rate=48000, cutoff=120.0):
+        rc = 1.0 / (2 * np.pi * cutoff)
+        dt = 1.0 / sample_rate
+        self.alpha = rc / (rc + dt)
+        self.prev_in = np.zeros(channels, dtype=np.float32)
+        self.prev_out = np.zeros(channels, dtype=np.float32)
+
+    def reset(self):
+        self.prev_in[:] = 0.0
+        self.prev_out[:] = 0.0
+
+    def process(self, block, out):
+        hpf_loop(block, out, self.prev_in, self.prev_out, self.alpha)
+        return out
 
 # ---------------- Bitcrusher ----------------
-@njit
-def __bitcrush_loop(chunk, levels, downsample, counter, last):
-    out = np.empty_like(chunk)
-    for i in range(len(chunk)):
-        if counter == 0:
-            last = np.round(chunk[i] * levels) / levels
-        out[i] = last
-        counter += 1
-        if counter >= downsample:
-            counter = 0
-    return out, counter, last
-
-bitcrush_counter = 0
-bitcrush_last = 0.0
-
-def effect_bitcrush(chunk):
-    global bitcrush_counter, bitcrush_last
-    levels = 2 ** EFFECT_PARAMS["BITCRUSH_BITS"]
-    out, bitcrush_counter, bitcrush_last = __bitcrush_loop(
-        chunk.ravel(), levels, EFFECT_PARAMS["BITCRUSH_DOWNSAMPLE"], bitcrush_counter, bitcrush_last
-    )
-    return out.reshape(chunk.shape)
+@kernel(**VECTORIZE)
+def _bitcrush_loop(chunk, out, params, counter, last):
+    # the sample-and-hold clock is shared so channels stay aligned; each
+    # channel runs it from the same start with its held value in a register,
+    # only quantizing once per hold
+    levels = 2.0 ** params[P_BITCRUSH_BITS]
+    downsample = max(1, int(params[P_BITCRUSH_DOWNSAMPLE]))
+    count = counter
+    for c in range(chunk.shape[1]):
+        count = counter
+        held = last[c]
+        for i in range(chunk.shape[0]):
+            if count == 0:
+                held = np.float32(np.rint(chunk[i, c] * levels) / levels)
+            out[i, c] = held
+            count += 1
+            if count >= downsample:
+                count = 0
+        last[c] = held
+    return count
+
+class Bitcrush(Effect):
+    def __init__(self, channels=1):
+        self.last = np.zeros(channels, dtype=np.float32)
+        self.counter = 0
+
+    def reset(self):
+        self.counter = 0
+        self.last[:] = 0.0
+
+    def process(self, block, out):
+        self.counter = _bitcrush_loop(block, out, PARAMS, self.counter, self.last)
+        return out
 
 # ---------------- SAT/EXCITE ----------------
-@njit
-def _saturation_loop(chunk, drive, excite):
-    out = np.empty_like(chunk)
-    prev = 0.0
-    for i in range(len(chunk)):
-        boosted = chunk[i] + excite * (chunk[i] - prev)
-        out[i] = np.tanh(boosted * drive)
-        prev = chunk[i]
-    return out
-
-def effect_saturation(chunk):
-    return _saturation_loop(
-        chunk.ravel(),
-        EFFECT_PARAMS["SAT_DRIVE"],
-        EFFECT_PARAMS["SAT_EXCITE"]
-    ).reshape(chunk.shape)
+SAT_OVERSAMPLE_TAPS = 16  # off-centre taps of the 2x halfband filter (a 31-tap FIR)
+
+@kernel(inline="always", **VECTORIZE)
+def _tanh(x):
+    """float32 tanh as a clamped 13/6 rational (within ~3e-7), unlike np.tanh it vectorizes."""
+    x = min(max(x, np.float32(-7.90531110763549805)), np.float32(7.90531110763549805))
+    x2 = x * x
+    p = x2 * np.float32(-2.76076847742355e-16) + np.float32(2.00018790482477e-13)
+    p = p * x2 + np.float32(-8.60467152213735e-11)
+    p = p * x2 + np.float32(5.12229709037114e-08)
+    p = p * x2 + np.float32(1.48572235717979e-05)
+    p = p * x2 + np.float32(6.37261928875436e-04)
+    p = p * x2 + np.float32(4.89352455891786e-03)
+    q = x2 * np.float32(1.19825839466702e-06) + np.float32(1.18534705686654e-04)
+    q = q * x2 + np.float32(2.26843463243900e-03)
+    q = q * x2 + np.float32(4.89352518554385e-03)
+    return x * p / q
+
+@kernel(**VECTORIZE)
+def _saturation_loop(chunk, out, params, smooth, prev, boosted):
+    # C-contiguous blocks only (see Saturation.process): flattened, the
+    # steady-state passes below are plain loops over contiguous floats that
+    # LLVM turns into SIMD. Only the last input sample per channel is carried
+    frames, channels = chunk.shape
+    if frames == 0:
+        return
+    x = chunk.reshape(-1)
+    y = out.reshape(-1)
+    n = x.shape[0]
+    drive0, drive_step = _ramp(smooth, 0, params[P_SAT_DRIVE], frames)
+    excite0, excite_step = _ramp(smooth, 1, params[P_SAT_EXCITE], frames)
+
+    if drive_step != 0.0 or excite_step != 0.0:
+        # parameters moving: frame by frame
+        for c in range(channels):
+            p = prev[c]
+            for i in range(frames):
+                drive = drive0 + drive_step * (i + 1)
+                excite = excite0 + excite_step * (i + 1)
+                k = i * channels + c
+                v = x[k]
+                y[k] = _tanh(np.float32((v + excite * (v - p)) * drive))
+                p = v
+            prev[c] = p
+        return
+
+    # the emphasis goes through `boosted` so the shaping pass never reads
+    # what it writes, even when y is x
+    drive = np.float32(drive0)
+    excite = np.float32(excite0)
+    for c in range(channels):
+        boosted[c] = x[c] + excite * (x[c] - prev[c])
+        prev[c] = x[n - channels + c]
+    for k in range(channels, n):
+        boosted[k] = x[k] + excite * (x[k] - x[k - channels])
+    for k in range(n):
+        y[k] = _tanh(boosted[k] * drive)
+
+@kernel(**VECTORIZE)
+def _saturation_2x_loop(chunk, out, params, smooth, prev, taps, hist, scratch):
+    # upsample 2x with a halfband filter, shape, filter and decimate. Of a
+    # halfband's taps every other one is zero, so each phase is a
+    # `taps`-long dot product or a plain delay. hist keeps the last
+    # emphasized input (0) and shaped even (1) / odd (2) samples per channel
+    frames, channels = chunk.shape
+    size = taps.shape[0]
+    half = size // 2
+    drive0, drive_step = _ramp(smooth, 0, params[P_SAT_DRIVE], frames)
+    excite0, excite_step = _ramp(smooth, 1, params[P_SAT_EXCITE], frames)
+    b = scratch[0]
+    even = scratch[1]
+    odd = scratch[2]
+    for c in range(channels):
+        for j in range(size):
+            b[j] = hist[c, 0, j]
+            even[j] = hist[c, 1, j]
+            odd[j] = hist[c, 2, j]
+        p = prev[c]
+        for i in range(frames):
+            drive = drive0 + drive_step * (i + 1)
+            excite = excite0 + excite_step * (i + 1)
+            x = chunk[i, c]
+            k = size + i
+            b[k] = x + excite * (x - p)
+            p = x
+
+            acc = np.float32(0.0)
+            for j in range(size):
+                acc += taps[j] * b[k - j]
+            even[k] = _tanh(np.float32(2.0 * acc * drive))
+            odd[k] = _tanh(np.float32(b[k - half + 1] * drive))
+
+            acc = np.float32(0.0)
+            for j in range(size):
+                acc += taps[j] * even[k - j]
+            out[i, c] = acc + np.float32(0.5) * odd[k - half]
+        prev[c] = p
+        for j in range(size):
+            hist[c, 0, j] = b[frames + j]
+            hist[c, 1, j] = even[frames + j]
+            hist[c, 2, j] = odd[frames + j]
+
+def _halfband(size=SAT_OVERSAMPLE_TAPS, beta=8.0):
+    """The nonzero off-centre taps of a (2 * size - 1)-tap Kaiser halfband lowpass, unity DC gain."""
+    length = 2 * size - 1
+    distance = (length // 2) - 2 * np.arange(size)  # odd distances from the 0.5 centre tap
+    taps = np.sinc(distance / 2) * np.kaiser(length, beta)[::2]
+    return (taps * 0.5 / taps.sum()).astype(np.float32)
+
+class Saturation(Effect):
+    """
+    tanh waveshaper after a first-difference "excite" boost. Steady blocks
+    run as flat loops over the whole block, carrying only the last input
+    sample per channel. oversample=2 shapes at twice the rate between
+    halfband filters so the added harmonics don't alias back down, at
+    SAT_OVERSAMPLE_TAPS - 1 samples of latency.
+    """
+
+    def __init__(self, channels=1, oversample=1):
+        if oversample not in (1, 2):
+            raise ValueError(f"Unsupported oversampling: {oversample}")
+        self.oversample = oversample
+        self.prev = np.zeros(channels, dtype=np.float32)
+        self.smooth = self._smoothing("SAT_DRIVE", "SAT_EXCITE")
+        if oversample == 2:
+            self.taps = _halfband()
+            self.hist = np.zeros((channels, 3, len(self.taps)), dtype=np.float32)
+            self.latency = SAT_OVERSAMPLE_TAPS - 1
+        self._alloc(1024, channels)
+
+    def _alloc(self, frames, channels):
+        # grows once if the host sends bigger blocks than expected
+        self.boosted = np.zeros(frames * channels, dtype=np.float32)
+        if self.oversample == 2:
+            self.scratch = np.zeros((3, len(self.taps) + frames), dtype=np.float32)
+
+    def reset(self):
+        self.prev[:] = 0.0
+        if self.oversample == 2:
+            self.hist[:] = 0.0
+
+    def process(self, block, out):
+        frames, channels = block.shape
+        if frames * channels > self.boosted.size:
+            self._alloc(frames, channels)
+        if self.oversample == 2:
+            _saturation_2x_loop(block, out, PARAMS, self.smooth, self.prev, self.taps, self.hist, self.scratch)
+        elif block.flags.c_contiguous and out.flags.c_contiguous:
+            _saturation_loop(block, out, PARAMS, self.smooth, self.prev, self.boosted)
+        else:
+            # strided views never come from the callbacks, run those on a copy
+            out[:] = self.process(np.ascontiguousarray(block), np.empty(block.shape, dtype=np.float32))
+        return out
 
 
 # ---------------- REVERB ----------------
-reverb_buf = np.zeros(48000, dtype=np.float32)
-reverb_idx = 0
-
-@njit
-def _reverb_loop(chunk, buf, idx, wet, fb, delays):
-    out = np.empty_like(chunk)
-    buf_len = len(buf)
-    for i in range(len(chunk)):
-        dry = chunk[i]
-        acc = 0.0
-        for d in delays:
-            acc += buf[(idx - d) % buf_len]
-        acc /= len(delays)
-        buf[idx] = dry + acc * fb
-        out[i] = dry * (1 - wet) + acc * wet
+@kernel
+def _reverb_loop(chunk, out, buf, idx, params, smooth):
+    # one delay line per channel, each channel's taps `spread` samples
+    # longer than the previous one's so stereo tails decorrelate
+    buf_len = buf.shape[1]
+    frames = chunk.shape[0]
+    d1 = int(params[P_REV_D1])
+    d2 = int(params[P_REV_D2])
+    d3 = int(params[P_REV_D3])
+    spread = int(params[P_REV_SPREAD])
+    wet0, wet_step = _ramp(smooth, 0, params[P_REV_WET], frames)
+    fb0, fb_step = _ramp(smooth, 1, params[P_REV_FEEDBACK], frames)
+    for i in range(frames):
+        wet = wet0 + wet_step * (i + 1)
+        fb = fb0 + fb_step * (i + 1)
+        for c in range(chunk.shape[1]):
+            dry = chunk[i, c]
+            base = idx - c * spread
+            acc = (buf[c, (base - d1) % buf_len]
+                   + buf[c, (base - d2) % buf_len]
+                   + buf[c, (base - d3) % buf_len]) / 3.0
+            buf[c, idx] = dry + acc * fb
+            out[i, c] = dry * (1 - wet) + acc * wet
         idx = (idx + 1) % buf_len
-    return out, buf, idx
-
-def effect_reverb(chunk):
-    global reverb_buf, reverb_idx
-    delays = [
-        int(EFFECT_PARAMS["REV_D1"]),
-        int(EFFECT_PARAMS["REV_D2"]),
-        int(EFFECT_PARAMS["REV_D3"])
-    ]
-    out, reverb_buf, reverb_idx = _reverb_loop(
-        chunk.ravel(),
-        reverb_buf,
-        reverb_idx,
-        EFFECT_PARAMS["REV_WET"],
-        EFFECT_PARAMS["REV_FEEDBACK"],
-        np.array(delays, dtype=np.int32)
-    )
-    return out.reshape(chunk.shape)
+    return idx
 
+class Reverb(Effect):
+    def __init__(self, channels=1, size=48000):
+        self.buf = np.zeros((channels, size), dtype=np.float32)
+        self.smooth = self._smoothing("REV_WET", "REV_FEEDBACK")
+        self.idx = 0
 
-# ---------------- PITCH SHIFT ----------------
-GRANP_GRAIN = 480  # 10ms @ 48kHz default
-GRANP_NUM = 4
+    @property
+    def latency(self):
+        # the longest tap, which is also how far apart the feedback echoes are
+        longest = max(PARAMS[P_REV_D1], PARAMS[P_REV_D2], PARAMS[P_REV_D3])
+        return min(int(longest + PARAMS[P_REV_SPREAD] * (self.buf.shape[0] - 1)), self.buf.shape[1])
 
-granp_buf = np.zeros(96000, dtype=np.float32)
-granp_write = 0
+    def reset(self):
+        self.buf[:] = 0.0
+        self.idx = 0
 
-granp_reads = np.zeros(GRANP_NUM, dtype=np.float32)
-granp_phase = np.zeros(GRANP_NUM, dtype=np.int32)
+    def process(self, block, out):
+        self.idx = _reverb_loop(block, out, self.buf, self.idx, PARAMS, self.smooth)
+        return out
 
-granp_window = np.hanning(GRANP_GRAIN).astype(np.float32)
 
-from numba import njit
-import numpy as np
+# ---------------- PITCH SHIFT ----------------
+GRANP_GRAIN = 480  # 10ms @ 48kHz default
+GRANP_NUM = 4
 
-@njit
+@kernel
 def _granular4_loop(
     chunk,
+    out,
     buf,
     write_idx,
     reads,
     phases,
     grain,
     window,
-    ratio
+    params,
+    smooth
 ):
-    out = np.zeros_like(chunk)
-    buf_len = len(buf)
+    # grains are shared by all channels, only the samples differ
+    buf_len = buf.shape[1]
+    channels = chunk.shape[1]
     num = len(reads)
-    spacing = grain // num
+    frames = chunk.shape[0]
+    ratio0, ratio_step = _ramp(smooth, 0, 2.0 ** (params[P_PITCH_SEMITONES] / 12), frames)
 
-    for i in range(len(chunk)):
+    for i in range(frames):
+        ratio = ratio0 + ratio_step * (i + 1)
 
         # write incoming audio
-        buf[write_idx] = chunk[i]
+        for c in range(channels):
+            buf[c, write_idx] = chunk[i, c]
+            out[i, c] = 0.0
         write_idx = (write_idx + 1) % buf_len
 
-        sample_out = 0.0
-
         for g in range(num):
 
             # reset grain if finished
@@ -197,105 +486,85 @@ def _granular4_loop(
             # read with linear interpolation
             base = int(reads[g])
             frac = reads[g] - base
+            w = window[phases[g]]
+            i0 = base % buf_len
+            i1 = (base + 1) % buf_len
 
-            s0 = buf[base % buf_len]
-            s1 = buf[(base + 1) % buf_len]
-            sample = s0 * (1 - frac) + s1 * frac
-
-            # apply window
-            sample *= window[phases[g]]
+            for c in range(channels):
+                sample = buf[c, i0] * (1 - frac) + buf[c, i1] * frac
 
-            sample_out += sample
+                # apply window
+                out[i, c] += sample * w
 
             # advance
             reads[g] += ratio
             phases[g] += 1
 
-        out[i] = sample_out
+    return write_idx
 
-    return out, write_idx, reads, phases
+class GranularPitch(Effect):
+    """High-pass, 4-grain pitch shift, then optional LPC formant shift."""
 
-def effect_granular_pitch(chunk):
-    global granp_buf
-    global granp_write
-    global granp_reads
-    global granp_phase
-    global granp_window
-    global GRANP_GRAIN
+    def __init__(self, channels=1, sample_rate=48000):
+        self.hpf = HighPass(channels, sample_rate, cutoff=120.0)
+        self.buf = np.zeros((channels, 96000), dtype=np.float32)
+        self.reads = np.zeros(GRANP_NUM, dtype=np.float32)
+        self.phases = np.zeros(GRANP_NUM, dtype=np.int32)
+        self._set_grain(GRANP_GRAIN)
+        self.smooth = np.array([2 ** (EFFECT_PARAMS["PITCH_SEMITONES"] / 12)])
+        self.formant = FormantShift(channels)
+        self.reset()
 
-    global hpf_prev_in
-    global hpf_prev_out
-    global hpf_alpha
+    def _set_grain(self, grain):
+        self.grain = grain
+        self.window = np.hanning(grain).astype(np.float32)
 
-    semitones = EFFECT_PARAMS["PITCH_SEMITONES"]
-    ratio = 2 ** (semitones / 12)
+    @property
+    def latency(self):
+        # grains start a grain behind the input and fall up to another one behind when shifting down
+        return 2 * int(PARAMS[P_GRANP_GRAIN]) + self.formant.latency
 
-    desired_grain = int(EFFECT_PARAMS["GRANP_GRAIN"])
-    if desired_grain != GRANP_GRAIN:
-        GRANP_GRAIN = desired_grain
-        granp_window = np.hanning(GRANP_GRAIN).astype(np.float32)
+    def reset(self):
+        self.hpf.reset()
+        self.buf[:] = 0.0
+        self.reads[:] = 0.0
+        self.phases[:] = 0
+        self.write = 0
+        self.formant.reset()
 
-    # 🔥 HIGH-PASS FIRST
-    filtered, hpf_prev_in, hpf_prev_out = hpf_loop(
-        chunk.ravel(),
-        hpf_prev_in,
-        hpf_prev_out,
-        hpf_alpha
-    )
+    def process(self, block, out):
+        desired_grain = int(PARAMS[P_GRANP_GRAIN])
+        if desired_grain != self.grain:
+            self._set_grain(desired_grain)
 
-    # THEN granular
-    out, granp_write, granp_reads, granp_phase = _granular4_loop(
-        filtered,
-        granp_buf,
-        granp_write,
-        granp_reads,
-        granp_phase,
-        GRANP_GRAIN,
-        granp_window,
-        ratio
-    )
+        # 🔥 HIGH-PASS FIRST
+        self.hpf.process(block, out)
 
-    out *= 0.5
+        # THEN granular (in place)
+        self.write = _granular4_loop(
+            out, out, self.buf, self.write, self.reads, self.phases,
+            self.grain, self.window, PARAMS, self.smooth
+        )
 
-    formant_shift = EFFECT_PARAMS["FORMANT_SEMITONES"]
+        out *= 0.5
 
-    if formant_shift != 0.0:
-        global lpc_buffer, lpc_write
+        # formant stage (passes through while FORMANT_SEMITONES is 0)
+        self.formant.process(out, out)
 
-        for i in range(len(out)):
-            lpc_buffer[lpc_write] = out[i]
-            lpc_write += 1
-
-            if lpc_write >= LPC_FRAME:
-                processed = process_lpc_frame(lpc_buffer.copy(), formant_shift)
-
-                out[i - LPC_FRAME + 1 : i + 1] = processed
-                lpc_write = LPC_FRAME - LPC_HOP
-                lpc_buffer[:LPC_HOP] = lpc_buffer[LPC_HOP:]
-
-
-    return out.reshape(chunk.shape)
+        return out
 
 # ----------------- FORMANT SHIFT ----------------
 LPC_FRAME = 960
 LPC_HOP = 480
 LPC_ORDER = 16
 
-lpc_buffer = np.zeros(LPC_FRAME, dtype=np.float32)
-lpc_out_buffer = np.zeros(LPC_FRAME, dtype=np.float32)
-
-lpc_write = 0
-lpc_out_read = 0
-
-from numba import njit
-import numpy as np
-
-@njit
-def levinson_durbin(r, order):
-    a = np.zeros(order + 1, dtype=np.float32)
-    e = r[0]
-
+@kernel
+def levinson_durbin(r, a, tmp):
+    """LPC coefficients of autocorrelation `r` into `a` (a[0] = 1)."""
+    order = len(a) - 1
+    a[:] = 0.0
     a[0] = 1.0
+    e = r[0]
 
     for i in range(1, order + 1):
         acc = 0.0
@@ -304,40 +573,30 @@ def levinson_durbin(r, order):
 
         k = -(r[i] + acc) / (e + 1e-9)
 
-        a_new = a.copy()
         for j in range(1, i):
-            a_new[j] = a[j] + k * a[i - j]
-
-        a_new[i] = k
-        a = a_new
+            tmp[j] = a[j] + k * a[i - j]
+        for j in range(1, i):
+            a[j] = tmp[j]
+        a[i] = k
 
         e *= (1.0 - k * k)
 
-    return a
-
-@njit
-def autocorr(x, order):
-    r = np.zeros(order + 1, dtype=np.float32)
-
-    for lag in range(order + 1):
+@kernel
+def autocorr(x, r):
+    for lag in range(len(r)):
         acc = 0.0
         for i in range(len(x) - lag):
             acc += x[i] * x[i + lag]
         r[lag] = acc
 
-    return r
-
-@njit
-def warped_lpc_filter(x, a, alpha):
+@kernel
+def warped_lpc_filter(x, y, a, alpha, state):
+    """All-pole synthesis through 1/A(z) with warped delays, from zero state."""
     order = len(a) - 1
-    y = np.zeros_like(x)
-
-    # state buffer
-    state = np.zeros(order, dtype=np.float32)
+    state[:] = 0.0
 
     for n in range(len(x)):
-        xn = x[n]
-        acc = xn
+        acc = x[n]
 
         for k in range(order):
             acc -= a[k + 1] * state[k]
@@ -351,53 +610,149 @@ def warped_lpc_filter(x, a, alpha):
 
         y[n] = acc
 
-    return y
-
-@njit
-def lpc_filter(x, a):
-    y = np.zeros_like(x)
+@kernel
+def lpc_residual(x, y, a):
+    """Inverse filter A(z): the excitation left after removing the formants."""
     order = len(a) - 1
-
     for n in range(len(x)):
-        y[n] = x[n]
+        acc = x[n]
         for k in range(1, order + 1):
             if n - k >= 0:
-                y[n] -= a[k] * y[n - k]
-
-    return y
-
-@njit
-def process_lpc_frame(frame, formant_semitones):
-    # convert semitones to warp coefficient
-    # small range is important
-    alpha = 0.6 * (formant_semitones / 12.0)
-
-    if alpha > 0.8:
-        alpha = 0.8
-    if alpha < -0.8:
-        alpha = -0.8
-
-    r = autocorr(frame, LPC_ORDER)
-    a = levinson_durbin(r, LPC_ORDER)
+                acc += a[k] * x[n - k]
+        y[n] = acc
 
-    return warped_lpc_filter(frame, a, alpha)
+@kernel
+def process_lpc_frame(frame, out, window, scratch, r, a, tmp, state, alpha):
+    """
+    Formant-shift one frame into `out`: estimate the envelope on the
+    windowed frame, whiten with it, resynthesize through the warped
+    envelope and match the frame's energy. With alpha = 0 this gives the
+    frame back unchanged.
+    """
+    n = len(frame)
+    for i in range(n):
+        scratch[i] = frame[i] * window[i]
+    autocorr(scratch, r)
+    levinson_durbin(r, a, tmp)
+
+    lpc_residual(frame, scratch, a)
+    warped_lpc_filter(scratch, out, a, alpha, state)
+
+    e_in = 0.0
+    e_out = 0.0
+    for i in range(n):
+        e_in += frame[i] * frame[i] * window[i]
+        e_out += out[i] * out[i] * window[i]
+    if not np.isfinite(e_out):
+        # envelope went unstable, keep the frame dry
+        out[:] = frame
+    elif e_out > 1e-12:
+        g = np.sqrt(e_in / e_out)
+        for i in range(n):
+            out[i] *= g
+
+@kernel
+def _formant_loop(chunk, out, fifo, out_fifo, acc, rover, frame_out,
+                  window, scratch, r, a, tmp, state, hop, alpha):
+    # FIFOs are (channels, frame) so every channel's frame is contiguous
+    n = fifo.shape[1]
+    latency = n - hop
+    channels = chunk.shape[1]
+
+    for i in range(chunk.shape[0]):
+        for c in range(channels):
+            fifo[c, rover] = chunk[i, c]
+            out[i, c] = out_fifo[c, rover - latency]
+        rover += 1
+
+        if rover >= n:
+            rover = latency
+            for c in range(channels):
+                process_lpc_frame(fifo[c], frame_out, window, scratch, r, a, tmp, state, alpha)
+
+                # overlap-add, the synthesis window sums to 1 at 50% overlap
+                ola = acc[c]
+                for j in range(n):
+                    ola[j] += frame_out[j] * window[j]
+                for j in range(hop):
+                    out_fifo[c, j] = ola[j]
+                for j in range(n - hop):
+                    ola[j] = ola[j + hop]
+                for j in range(n - hop, n):
+                    ola[j] = 0.0
+
+                for j in range(latency):
+                    fifo[c, j] = fifo[c, j + hop]
+
+    return rover
+
+class FormantShift(Effect):
+    """
+    Block-based LPC formant shifter (FORMANT_SEMITONES), overlap-adding
+    Hann-windowed frames of LPC_FRAME every LPC_HOP samples. Adds
+    LPC_FRAME samples of latency while active.
+    """
+
+    def __init__(self, channels=1, frame=LPC_FRAME, hop=LPC_HOP, order=LPC_ORDER):
+        self.hop = hop
+        self.latency = frame
+        # periodic Hann, used for analysis and synthesis
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)).astype(np.float32)
+        self.fifo = np.zeros((channels, frame), dtype=np.float32)
+        self.out_fifo = np.zeros((channels, hop), dtype=np.float32)
+        self.acc = np.zeros((channels, frame), dtype=np.float32)
+        self.frame_out = np.zeros(frame, dtype=np.float32)
+        self.scratch = np.zeros(frame, dtype=np.float32)
+        self.r = np.zeros(order + 1, dtype=np.float32)
+        self.a = np.zeros(order + 1, dtype=np.float32)
+        self.tmp = np.zeros(order + 1, dtype=np.float32)
+        self.state = np.zeros(order, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self.fifo[:] = 0.0
+        self.out_fifo[:] = 0.0
+        self.acc[:] = 0.0
+        self.rover = self.fifo.shape[1] - self.hop
+        self.active = False
+
+    def process(self, block, out):
+        semitones = PARAMS[P_FORMANT_SEMITONES]
+        if semitones == 0.0:
+            if self.active:
+                self.reset()
+            out[:] = block
+            return out
+        self.active = True
+
+        # convert semitones to warp coefficient
+        # small range is important
+        return self._run(block, out, min(0.8, max(-0.8, 0.6 * (semitones / 12.0))))
+
+    def _run(self, block, out, alpha):
+        self.rover = _formant_loop(
+            block, out, self.fifo, self.out_fifo, self.acc,
+            self.rover, self.frame_out, self.window, self.scratch,
+            self.r, self.a, self.tmp, self.state, self.hop, alpha
+        )
+        return out
 
 
 # ---------------- GRANULAR DELAY ----------------
-gran_buf = np.zeros(96000, dtype=np.float32)
-gran_write = 0
-gran_read = 0
-gran_pos = 0
-
-@njit
-def _granular_loop(chunk, buf, write_idx, read_idx, pos, grain, jitter, mix):
-    out = np.empty_like(chunk)
-    buf_len = len(buf)
-    for i in range(len(chunk)):
-        dry = chunk[i]
-
+@kernel
+def _granular_loop(chunk, out, buf, write_idx, read_idx, pos, params, smooth):
+    # grain timing is shared so the stereo image stays put
+    buf_len = buf.shape[1]
+    channels = chunk.shape[1]
+    frames = chunk.shape[0]
+    grain = max(1, int(params[P_GRAN_GRAIN]))
+    jitter = params[P_GRAN_JITTER]
+    mix0, mix_step = _ramp(smooth, 0, params[P_GRAN_MIX], frames)
+    for i in range(frames):
+        mix = mix0 + mix_step * (i + 1)
         # write incoming sample
-        buf[write_idx] = dry
+        for c in range(channels):
+            buf[c, write_idx] = chunk[i, c]
         write_idx = (write_idx + 1) % buf_len
 
         # if starting a new grain, pick new jittered offset
@@ -407,7 +762,8 @@ def _granular_loop(chunk, buf, write_idx, read_idx, pos, grain, jitter, mix):
             read_idx = (write_idx - offset) % buf_len
 
         # read from buffer
-        wet = buf[read_idx]
+        for c in range(channels):
+            out[i, c] = chunk[i, c] * (1 - mix) + buf[c, read_idx] * mix
         read_idx = (read_idx + 1) % buf_len
 
         # advance grain position
@@ -415,34 +771,647 @@ def _granular_loop(chunk, buf, write_idx, read_idx, pos, grain, jitter, mix):
         if pos >= grain:
             pos = 0
 
-        out[i] = dry * (1 - mix) + wet * mix
-
-    return out, buf, write_idx, read_idx, pos
-
-def effect_granular(chunk):
-    global gran_buf, gran_write, gran_read, gran_pos
-    grain = int(EFFECT_PARAMS["GRAN_GRAIN"])
-    jitter = EFFECT_PARAMS["GRAN_JITTER"]
-    mix = EFFECT_PARAMS["GRAN_MIX"]
-
-    out, gran_buf, gran_write, gran_read, gran_pos = _granular_loop(
-        chunk.ravel(),
-        gran_buf,
-        gran_write,
-        gran_read,
-        gran_pos,
-        grain,
-        jitter,
-        mix
-    )
-    return out.reshape(chunk.shape)
+    return write_idx, read_idx, pos
+
+@kernel
+def _seed_kernels(value):
+    # numba keeps its own generator state, np.random.seed() from Python doesn't reach it
+    np.random.seed(value)
+
+class GranularDelay(Effect):
+    def __init__(self, channels=1):
+        self.buf = np.zeros((channels, 96000), dtype=np.float32)
+        self.smooth = self._smoothing("GRAN_MIX")
+        self.reset()
+
+    @property
+    def latency(self):
+        grain = max(1, int(PARAMS[P_GRAN_GRAIN]))
+        return grain + int(grain * PARAMS[P_GRAN_JITTER]) + 1
+
+    def reset(self):
+        self.buf[:] = 0.0
+        self.write = 0
+        self.read = 0
+        self.pos = 0
+
+    def process(self, block, out):
+        self.write, self.read, self.pos = _granular_loop(
+            block, out, self.buf,
+            self.write, self.read, self.pos, PARAMS, self.smooth
+        )
+        return out
+
+# ---------------- CONVOLUTION REVERB ----------------
+CONVOLUTION_IR = os.path.join("irs", "room.wav")  # impulse response file (`effect ir <file>`)
+CONV_PARTITION = 256  # samples per partition, also the added latency
+
+_ir_cache = {}  # (path, mtime, size, sr, channels, partition) -> partition spectra
+_ir_lock = threading.Lock()
+
+def _synthetic_ir(sr, channels, seconds=1.2):
+    """Exponentially decaying noise, a plain room when no IR file is around."""
+    n = int(sr * seconds)
+    rng = np.random.default_rng(0)
+    decay = np.exp(-6.9 * np.arange(n) / n)  # -60 dB over `seconds`
+    return (rng.standard_normal((n, channels)) * decay[:, None]).astype(np.float32)
+
+def load_ir(path, sr=48000, channels=1, partition=CONV_PARTITION):
+    """
+    Partition spectra of the impulse response in `path`, shape
+    (partitions, channels, partition + 1), complex64. The file is decoded
+    and resampled to `sr` once; the spectra are cached and shared by every
+    instance using the same file and settings.
+    """
+    if path and os.path.isfile(path):
+        st = os.stat(path)
+        key = (os.path.realpath(path), st.st_mtime, st.st_size, sr, channels, partition)
+    else:
+        if path:
+            print(f"[EFFECTS] Impulse response {path} not found, using a synthetic room")
+        key = (None, 0, 0, sr, channels, partition)
+
+    with _ir_lock:
+        spectra = _ir_cache.get(key)
+        if spectra is not None:
+            return spectra
+
+        if key[0]:
+            from decoder import decode
+            ir = decode(path, sr, channels)
+        else:
+            ir = _synthetic_ir(sr, channels)
+        # unit energy per channel so the wet level doesn't depend on the file
+        ir = ir / max(1e-9, float(np.sqrt((ir ** 2).sum(axis=0)).max()))
+
+        parts = max(1, -(-len(ir) // partition))
+        padded = np.zeros((parts * partition, channels), dtype=np.float32)
+        padded[:len(ir)] = ir
+        blocks = padded.reshape(parts, partition, channels).transpose(0, 2, 1)
+        # each partition zero-padded to 2 * partition for overlap-save
+        spectra = np.fft.rfft(blocks, n=2 * partition, axis=-1).astype(np.complex64)
+        spectra.setflags(write=False)
+        _ir_cache[key] = spectra
+        return spectra
+
+@kernel
+def _fdl_mac(fdl, spectra, start, acc):
+    """acc = sum over k of fdl[start + k] * spectra[k] (newest input first)."""
+    parts, channels, bins = spectra.shape
+    for c in range(channels):
+        for b in range(bins):
+            acc[c, b] = 0.0
+    for k in range(parts):
+        x = fdl[start + k]
+        h = spectra[k]
+        for c in range(channels):
+            for b in range(bins):
+                acc[c, b] += x[c, b] * h[c, b]
+
+@kernel
+def _conv_io(chunk, out, fifo, wet, pos, params, smooth):
+    """Move samples into the input FIFO and mix out the convolved ones. Returns frames taken."""
+    partition = wet.shape[1]
+    n = min(chunk.shape[0], partition - pos)
+    mix0, mix_step = _ramp(smooth, 0, params[P_CONV_MIX], n)
+    for i in range(n):
+        mix = mix0 + mix_step * (i + 1)
+        for c in range(chunk.shape[1]):
+            x = chunk[i, c]
+            fifo[c, partition + pos + i] = x
+            out[i, c] = x * (1 - mix) + wet[c, pos + i] * mix
+    return n
+
+class ConvolutionReverb(Effect):
+    """
+    Uniformly partitioned FFT convolution (overlap-save) with the impulse
+    response in CONVOLUTION_IR. Every CONV_PARTITION input samples cost one
+    forward FFT, one multiply-accumulate over the frequency-domain delay
+    line and one inverse FFT per channel, however long the IR is.
+    Adds CONV_PARTITION samples of latency.
+    """
+
+    def __init__(self, channels=1, sample_rate=48000, ir=None, partition=CONV_PARTITION):
+        self.partition = partition
+        self.spectra = load_ir(CONVOLUTION_IR if ir is None else ir, sample_rate, channels, partition)
+        parts, _, bins = self.spectra.shape
+        self.latency = partition
+        self.tail = parts * partition
+        # frequency-domain delay line, written twice so the newest `parts`
+        # spectra are always one contiguous slice
+        self.fdl = np.zeros((2 * parts, channels, bins), dtype=np.complex64)
+        self.fifo = np.zeros((channels, 2 * partition), dtype=np.float32)
+        self.wet = np.zeros((channels, partition), dtype=np.float32)
+        # FFT buffers are double precision: numpy's float32 FFTs allocate
+        # work arrays on every call even with out=
+        self.block = np.zeros((channels, 2 * partition), dtype=np.float64)
+        self.spectrum = np.zeros((channels, bins), dtype=np.complex128)
+        self.acc = np.zeros((channels, bins), dtype=np.complex64)
+        self.smooth = self._smoothing("CONV_MIX")
+        self.reset()
+
+    def reset(self):
+        self.fdl[:] = 0.0
+        self.fifo[:] = 0.0
+        self.wet[:] = 0.0
+        self.slot = 0
+        self.pos = 0
+
+    def _partition(self):
+        parts = self.spectra.shape[0]
+        self.slot = (self.slot - 1) % parts
+        # FFTs write into preallocated buffers, nothing is allocated per partition
+        np.copyto(self.block, self.fifo)
+        np.fft.rfft(self.block, axis=-1, out=self.spectrum)
+        self.fdl[self.slot] = self.spectrum
+        self.fdl[self.slot + parts] = self.spectrum
+        _fdl_mac(self.fdl, self.spectra, self.slot, self.acc)
+        np.copyto(self.spectrum, self.acc)
+        np.fft.irfft(self.spectrum, axis=-1, out=self.block)
+        # overlap-save: only the second half is free of wrap-around
+        self.wet[:] = self.block[:, self.partition:]
+        self.fifo[:, :self.partition] = self.fifo[:, self.partition:]
+
+    def process(self, block, out):
+        done = 0
+        frames = block.shape[0]
+        while done < frames:
+            n = _conv_io(block[done:], out[done:], self.fifo, self.wet, self.pos, PARAMS, self.smooth)
+            done += n
+            self.pos += n
+            if self.pos == self.partition:
+                self._partition()
+                self.pos = 0
+        return out
+
+# ---------------- PHASE VOCODER PITCH SHIFT ----------------
+# name -> (fft size, overlap, keep formants); latency is one fft size
+PV_PRESETS = {
+    "fast": (512, 4, False),      # ~11 ms
+    "balanced": (1024, 4, True),  # ~21 ms
+    "hq": (2048, 8, True),        # ~43 ms
+}
+PV_LIFTER_MS = 1.5  # cepstral cutoff of the formant envelope, below the shortest pitch period
+
+@kernel
+def _stft_io(chunk, out, fifo, out_fifo, rover):
+    """Move samples into the analysis FIFO and out of the output FIFO. Returns frames taken."""
+    size = fifo.shape[1]
+    start = size - out_fifo.shape[1]
+    n = min(chunk.shape[0], size - rover)
+    for i in range(n):
+        for c in range(chunk.shape[1]):
+            fifo[c, rover + i] = chunk[i, c]
+            out[i, c] = out_fifo[c, rover - start + i]
+    return n
+
+@kernel(**VECTORIZE)
+def _fft(z, twiddle, inverse):
+    """
+    In-place FFT of `z` (power-of-two length n), unscaled: bit reversal,
+    one radix-2 pass if log2(n) is odd, then radix-4 passes (two radix-2
+    stages at once). `twiddle` is exp(-2*pi*i*j/n) for j < n/2.
+    """
+    n = z.shape[0]
+    j = 0
+    for i in range(1, n):
+        bit = n >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j |= bit
+        if i < j:
+            z[i], z[j] = z[j], z[i]
+    bits = 0
+    while (1 << bits) < n:
+        bits += 1
+    half = 1
+    if bits % 2:
+        for s in range(0, n, 2):
+            t = z[s + 1]
+            z[s + 1] = z[s] - t
+            z[s] += t
+        half = 2
+    while half < n:
+        step = n // (4 * half)
+        for k in range(half):
+            # twiddles of the stage over 2*half points and the two halves of the one over 4*half
+            w1 = twiddle[2 * k * step]
+            w2 = twiddle[k * step]
+            w3 = twiddle[(k + half) * step]
+            if inverse:
+                w1 = w1.conjugate()
+                w2 = w2.conjugate()
+                w3 = w3.conjugate()
+            for s in range(k, n, 4 * half):
+                b = z[s + half] * w1
+                d = z[s + 3 * half] * w1
+                a0 = z[s] + b
+                a1 = z[s] - b
+                c0 = (z[s + 2 * half] + d) * w2
+                c1 = (z[s + 2 * half] - d) * w3
+                z[s] = a0 + c0
+                z[s + 2 * half] = a0 - c0
+                z[s + half] = a1 + c1
+                z[s + 3 * half] = a1 - c1
+        half *= 4
+
+@kernel(**VECTORIZE)
+def _rfft(x, spec, work, twiddle, rtwiddle):
+    """
+    rfft of the real `x` (n) into `spec` (n/2 + 1), as one complex FFT of
+    n/2 points (even samples real, odd ones imaginary) split afterwards.
+    `rtwiddle` is exp(-2*pi*i*k/n) for k <= n/2.
+    """
+    m = work.shape[0]
+    for i in range(m):
+        work[i] = complex(x[2 * i], x[2 * i + 1])
+    _fft(work, twiddle, False)
+    spec[0] = work[0].real + work[0].imag
+    spec[m] = work[0].real - work[0].imag
+    for k in range(1, m):
+        a = work[k]
+        b = work[m - k].conjugate()
+        spec[k] = 0.5 * (a + b) - 0.5j * (a - b) * rtwiddle[k]
+
+@kernel(**VECTORIZE)
+def _irfft(spec, x, work, twiddle, rtwiddle):
+    """Inverse of _rfft, scaled like np.fft.irfft (the DC and Nyquist bins' imaginary parts are ignored)."""
+    m = work.shape[0]
+    work[0] = complex(0.5 * (spec[0].real + spec[m].real), 0.5 * (spec[0].real - spec[m].real))
+    for k in range(1, m):
+        a = spec[k]
+        b = spec[m - k].conjugate()
+        work[k] = 0.5 * (a + b) + 0.5j * (a - b) * rtwiddle[k].conjugate()
+    _fft(work, twiddle, True)
+    for i in range(m):
+        x[2 * i] = work[i].real / m
+        x[2 * i + 1] = work[i].imag / m
+
+@kernel(**VECTORIZE)
+def _dct1(f, out, y, spec, work, twiddle, rtwiddle, angle):
+    """
+    DCT-I of `f` (n + 1 points) into `out`: (f[0] + (-1)**k * f[n]) / 2 plus
+    the sum of f[j] * cos(pi*j*k/n) over the inner points, by one rfft of
+    n points (`y`, `spec`, `work` and the twiddles sized for it) and O(n)
+    folding around it. `angle` is exp(-i*pi*j/n) for j <= n/2.
+    """
+    n = y.shape[0]
+    odd = 0.5 * (f[0] - f[n])
+    y[0] = 0.5 * (f[0] + f[n])
+    for j in range(1, n // 2 + 1):
+        a = 0.5 * (f[j] + f[n - j])
+        b = f[j] - f[n - j]
+        y[j] = a + angle[j].imag * b
+        y[n - j] = a - angle[j].imag * b
+        odd += angle[j].real * b
+    _rfft(y, spec, work, twiddle, rtwiddle)
+    # even outputs are the spectrum, odd ones a running sum of it
+    out[0] = spec[0].real
+    out[1] = odd
+    for k in range(1, n // 2):
+        out[2 * k] = spec[k].real
+        odd -= spec[k].imag
+        out[2 * k + 1] = odd
+    out[n] = spec[n // 2].real
+
+@kernel(**VECTORIZE)
+def _envelope(spec, env, log_mag, cep, y, y_spec, work, twiddle, rtwiddle, angle, lifter):
+    """
+    Formant envelope of `spec` into `env`, by cepstral smoothing of its log
+    magnitude. The log magnitude is real and even, so both transforms of
+    the cepstrum are DCT-Is of half the FFT size.
+    """
+    n = log_mag.shape[0] - 1
+    for k in range(n + 1):
+        z = spec[k]
+        log_mag[k] = np.log(np.sqrt(z.real * z.real + z.imag * z.imag) + 1e-9)
+    _dct1(log_mag, cep, y, y_spec, work, twiddle, rtwiddle, angle)
+    # keep the low quefrencies (the real cepstrum is cep / n, doubled for
+    # its mirrored half), what's left is the envelope
+    for m in range(lifter):
+        log_mag[m] = 2 * cep[m] / n
+    log_mag[lifter] = cep[lifter] / n
+    for m in range(lifter + 1, n + 1):
+        log_mag[m] = 0.0
+    _dct1(log_mag, env, y, y_spec, work, twiddle, rtwiddle, angle)
+    for k in range(n + 1):
+        env[k] = np.exp(env[k]) + 1e-9
+
+@kernel(inline="always", **VECTORIZE)
+def _unit(z):
+    """z / |z|, 1 for 0 (like np.angle(0) == 0)."""
+    m = np.sqrt(z.real * z.real + z.imag * z.imag)
+    return z / m if m > 0.0 else 1.0 + 0j
+
+@kernel(**VECTORIZE)
+def _pv_shift(spec, out, env, last_spec, last_out, power, ratio, formant_ratio, overlap, keep_env):
+    """
+    Pitch-shift `spec` (channels, bins) into `out` by `ratio`, moving each
+    spectral peak together with the bins around it and keeping their
+    phases locked to the peak (Laroche/Dolson), so partials keep their
+    shape and measured frequency. With keep_env the spectral envelope
+    `env` stays put (or moves by `formant_ratio`) and only the harmonic
+    fine structure is shifted.
+
+    Phases are only measured at peaks: every bin of a region is its input
+    bin rotated like its peak, so the per-bin work is a complex multiply.
+    `last_spec`/`last_out` keep the previous hop's spectra for the peaks'
+    phase advance.
+    """
+    channels, bins = spec.shape
+    expect = 2 * np.pi / overlap
+    for c in range(channels):
+        for k in range(bins):
+            z = spec[c, k]
+            power[k] = z.real * z.real + z.imag * z.imag
+            out[c, k] = 0.0
+
+        # regions of influence: from the valley before a peak to the one after it
+        lo = 0
+        while lo < bins:
+            k = lo + 1
+            while k < bins and power[k] >= power[k - 1]:
+                k += 1
+            p = k - 1
+            while k < bins and power[k] < power[k - 1]:
+                k += 1
+            hi = k
+
+            # true frequency of the peak from its phase advance
+            target = int(p * ratio + 0.5)
+            if target >= bins:
+                break
+            shift = target - p
+            z = spec[c, p]
+            d = np.angle(z * _unit(last_spec[c, p]).conjugate()) - p * expect
+            d -= 2 * np.pi * np.round(d / (2 * np.pi))
+            # new phase: the target's last output phase advanced by the
+            # shifted frequency, as a rotation of the peak's own phase
+            rotate = np.exp(1j * (p * expect + d) * ratio) * _unit(last_out[c, target]) * _unit(z).conjugate()
+
+            for k in range(lo, hi):
+                j = k + shift
+                if j < 0 or j >= bins:
+                    continue
+                z = spec[c, k] * rotate
+                if keep_env:
+                    src = j / formant_ratio
+                    e = int(src)
+                    if e >= bins - 1:
+                        z *= env[c, bins - 1] / env[c, k]
+                    else:
+                        frac = src - e
+                        z *= (env[c, e] * (1 - frac) + env[c, e + 1] * frac) / env[c, k]
+                out[c, j] += z
+            lo = hi
+
+        for k in range(bins):
+            last_spec[c, k] = spec[c, k]
+            last_out[c, k] = out[c, k]
+
+@kernel(**VECTORIZE)
+def _ola(frame, synth_window, acc, out_fifo, fifo):
+    """Overlap-add a synthesized frame, hand out the finished hop and advance the FIFOs."""
+    channels, size = acc.shape
+    hop = out_fifo.shape[1]
+    for c in range(channels):
+        for i in range(size):
+            acc[c, i] += frame[c, i] * synth_window[i]
+        for i in range(hop):
+            out_fifo[c, i] = acc[c, i]
+        for i in range(size - hop):
+            acc[c, i] = acc[c, i + hop]
+            fifo[c, i] = fifo[c, i + hop]
+        for i in range(size - hop, size):
+            acc[c, i] = 0.0
+
+@kernel(**VECTORIZE)
+def _pv_hop(fifo, window, synth_window, frame, spec, shifted, env, last_spec, last_out, power, acc, out_fifo,
+            work, twiddle, rtwiddle, log_mag, cep, dct, dct_spec, half_twiddle, half_rtwiddle,
+            ratio, formant_ratio, overlap, keep_env, lifter):
+    """One vocoder hop: analyse the FIFO, shift, and overlap-add the result into out_fifo."""
+    channels, size = fifo.shape
+    for c in range(channels):
+        for i in range(size):
+            frame[c, i] = fifo[c, i] * window[i]
+        _rfft(frame[c], spec[c], work, twiddle, rtwiddle)
+        if keep_env:
+            _envelope(spec[c], env[c], log_mag, cep, dct, dct_spec, work[:dct_spec.shape[0] - 1],
+                      half_twiddle, half_rtwiddle, rtwiddle, lifter)
+    _pv_shift(spec, shifted, env, last_spec, last_out, power, ratio, formant_ratio, overlap, keep_env)
+    for c in range(channels):
+        _irfft(shifted[c], frame[c], work, twiddle, rtwiddle)
+    _ola(frame, synth_window, acc, out_fifo, fifo)
+
+@kernel
+def _pv_loop(block, out, params, rover, fifo, window, synth_window, frame, spec, shifted, env,
+             last_spec, last_out, power, acc, out_fifo, work, twiddle, rtwiddle, log_mag, cep, dct,
+             dct_spec, half_twiddle, half_rtwiddle, overlap, keep_env, lifter):
+    """Stream `block` through the vocoder FIFOs, running a hop whenever one is full. Returns the new rover."""
+    ratio = 2.0 ** (params[P_PITCH_SEMITONES] / 12)
+    formant_ratio = 2.0 ** (params[P_FORMANT_SEMITONES] / 12)
+    size = fifo.shape[1]
+    done = 0
+    while done < block.shape[0]:
+        n = _stft_io(block[done:], out[done:], fifo, out_fifo, rover)
+        done += n
+        rover += n
+        if rover == size:
+            _pv_hop(fifo, window, synth_window, frame, spec, shifted, env, last_spec, last_out, power, acc,
+                    out_fifo, work, twiddle, rtwiddle, log_mag, cep, dct, dct_spec, half_twiddle,
+                    half_rtwiddle, ratio, formant_ratio, overlap, keep_env, lifter)
+            rover = size - out_fifo.shape[1]
+    return rover
+
+class PhaseVocoderPitch(Effect):
+    """
+    Block-based phase vocoder pitch shift (PITCH_SEMITONES). Each hop is one
+    compiled kernel (FFTs included); partials keep their measured frequency
+    and phase coherence, so there is none of the grain-reset phasing of the
+    granular shifter. Presets in PV_PRESETS trade latency for quality;
+    "balanced" and "hq" keep the formants where they are (voices don't go
+    chipmunk) and move them by FORMANT_SEMITONES. "balanced" costs about
+    what the granular shifter does on 128-frame mic blocks.
+    """
+
+    def __init__(self, channels=1, sample_rate=48000, preset="balanced"):
+        size, overlap, keep_env = PV_PRESETS[preset]
+        self.size = size
+        self.latency = size
+        self.hop = size // overlap
+        self.overlap = overlap
+        self.keep_env = keep_env
+        self.lifter = max(1, int(sample_rate * PV_LIFTER_MS / 1000))
+
+        # periodic Hann for analysis, scaled for synthesis so overlapped windows sum to 1
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(size) / size)).astype(np.float32)
+        self.synth_window = (self.window / ((self.window ** 2).sum() / self.hop)).astype(np.float32)
+
+        bins = size // 2 + 1
+        self.fifo = np.zeros((channels, size), dtype=np.float32)
+        self.out_fifo = np.zeros((channels, self.hop), dtype=np.float32)
+        self.acc = np.zeros((channels, size), dtype=np.float32)
+        # FFT and envelope work buffers, so a hop allocates nothing
+        half = size // 2
+        self.twiddle = np.exp(-2j * np.pi * np.arange(half // 2) / half)
+        self.rtwiddle = np.exp(-2j * np.pi * np.arange(bins) / size)
+        self.work = np.zeros(half, dtype=np.complex128)
+        self.frame = np.zeros((channels, size), dtype=np.float64)
+        self.spec = np.zeros((channels, bins), dtype=np.complex128)
+        self.shifted = np.zeros((channels, bins), dtype=np.complex128)
+        # the envelope's DCTs run on half-size rffts
+        self.half_twiddle = self.twiddle[::2].copy()
+        self.half_rtwiddle = self.rtwiddle[::2].copy()
+        self.log_mag = np.zeros(bins, dtype=np.float64)
+        self.cep = np.zeros(bins, dtype=np.float64)
+        self.dct = np.zeros(half, dtype=np.float64)
+        self.dct_spec = np.zeros(half // 2 + 1, dtype=np.complex128)
+        self.env = np.ones((channels, bins), dtype=np.float64)
+        self.last_spec = np.zeros((channels, bins), dtype=np.complex128)
+        self.last_out = np.zeros((channels, bins), dtype=np.complex128)
+        self.power = np.zeros(bins, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        self.fifo[:] = 0.0
+        self.out_fifo[:] = 0.0
+        self.acc[:] = 0.0
+        self.last_spec[:] = 0.0
+        self.last_out[:] = 0.0
+        self.rover = self.size - self.hop
+
+    def process(self, block, out):
+        if self.rover + block.shape[0] < self.size:
+            # no hop due in this block, skip the big call
+            self.rover += _stft_io(block, out, self.fifo, self.out_fifo, self.rover)
+            return out
+        self.rover = _pv_loop(
+            block, out, PARAMS, self.rover, self.fifo, self.window, self.synth_window, self.frame,
+            self.spec, self.shifted, self.env, self.last_spec, self.last_out, self.power, self.acc,
+            self.out_fifo, self.work, self.twiddle, self.rtwiddle, self.log_mag, self.cep, self.dct,
+            self.dct_spec, self.half_twiddle, self.half_rtwiddle, self.overlap, self.keep_env, self.lifter,
+        )
+        return out
 
 # ---------------- Dictionary ----------------
 EFFECTS = {
-    "none": effect_none,
-    "bitcrush": effect_bitcrush,
-    "saturation": effect_saturation,
-    "reverb": effect_reverb,
-    "pitch": effect_granular_pitch,
-    "granular": effect_granular
+    "none": Bypass,
+    "bitcrush": Bitcrush,
+    "saturation": Saturation,
+    "saturation_hq": partial(Saturation, oversample=2),
+    "reverb": Reverb,
+    "pitch": GranularPitch,
+    "granular": GranularDelay,
+    "convolution": ConvolutionReverb,
+    "vocoder": PhaseVocoderPitch,
+    "vocoder_fast": partial(PhaseVocoderPitch, preset="fast"),
+    "vocoder_hq": partial(PhaseVocoderPitch, preset="hq"),
 }
+
+# ---------------- Chains ----------------
+class EffectChain:
+    """
+    Effect instances run one after another, each stream gets its own chain.
+    Build one from names with EffectChain.from_names("pitch,reverb", channels).
+    """
+
+    def __init__(self, effects=()):
+        # a tuple, a chain never changes once it is running
+        self.effects = tuple(effects)
+
+    @classmethod
+    def from_names(cls, names, channels=1):
+        return cls(EFFECTS[n](channels) for n in cls.parse_names(names))
+
+    @staticmethod
+    def parse_names(names):
+        """"pitch,reverb" (or a list) as a list of names, KeyError for unknown ones. Builds nothing."""
+        if isinstance(names, str):
+            names = [n.strip() for n in names.split(",") if n.strip()]
+        unknown = [n for n in names if n not in EFFECTS]
+        if unknown:
+            raise KeyError(f"Unknown effect: {', '.join(unknown)}")
+        return list(names)
+
+    def __bool__(self):
+        return bool(self.effects)
+
+    @property
+    def latency(self):
+        return sum(fx.latency for fx in self.effects)
+
+    @property
+    def tail(self):
+        return sum(fx.tail for fx in self.effects)
+
+    def reset(self):
+        for fx in self.effects:
+            fx.reset()
+
+    def process(self, block, out):
+        # the first effect reads `block`, the rest work in place on `out`
+        if not self.effects:
+            out[:] = block
+            return out
+        src = block
+        for fx in self.effects:
+            fx.process(src, out)
+            src = out
+        return out
+
+class LiveChain:
+    """
+    The chain a stream is running, swappable from another thread without
+    locking the audio path.
+
+    set() publishes a fully built chain with a single reference assignment;
+    the audio thread picks it up at its next block. The chain it replaces
+    is kept until the following set(), so its buffers are freed on the
+    control thread and never inside the callback.
+    """
+
+    def __init__(self, chain=None):
+        self.chain = chain or EffectChain()
+        self._retired = None
+
+    def set(self, chain):
+        old = self.chain
+        self.chain = chain or EffectChain()
+        self._retired = old
+
+    def process(self, block):
+        """Run the current chain over `block` in place."""
+        chain = self.chain
+        if not chain:
+            return block
+        return chain.process(block, block)
+
+# ---------------- Warmup ----------------
+def warmup(blocksize=128, channels=(1, 2)):
+    """
+    Compile (or load from numba's cache) every kernel with the dtypes and
+    array layouts the audio callbacks use, by running each effect over a
+    few silent blocks. Call at startup so the first block after enabling an
+    effect doesn't stall the callback. Blocks while another thread is
+    warming up; returns right away once done.
+    """
+    global _warm
+    with _warm_lock:
+        if _warm:
+            return
+        for ch in channels:
+            block = np.zeros((blocksize, ch), dtype=np.float32)
+            # enough blocks to reach every FFT/LPC frame boundary
+            blocks = -(-max(4096, 2 * LPC_FRAME) // blocksize)
+            units = [factory(ch) for name, factory in EFFECTS.items() if name != "convolution"]
+            units.append(ConvolutionReverb(ch, ir=""))
+            formant = FormantShift(ch)
+            for _ in range(blocks):
+                for fx in units:
+                    fx.process(block, block)
+                formant._run(block, block, 0.0)
+        _warm = True
+
+_warm = False
+_warm_lock = threading.Lock()
@@ -0,0 +1,220 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+import effects
+from effects import EFFECT_PARAMS, EffectChain
+
+# --------------------------
+# Settings
+# --------------------------
+SAMPLE_RATE = 48000
+SECONDS = 10.0
+
+# (label, blocksize, channels) as the real callbacks run them
+SETUPS = [
+    ("mic", 128, 1),
+    ("sound_board", 1024, 2),
+]
+
+# chains that get used together, besides every single effect
+CHAINS = [
+    "saturation,bitcrush",
+    "pitch,reverb",
+    "vocoder,convolution",
+]
+
+# parameters that keep every stage busy (formant shift on, pitch moved)
+BENCH_PARAMS = {
+    "PITCH_SEMITONES": 4.0,
+    "FORMANT_SEMITONES": 2.0,
+}
+
+ALLOC_BLOCKS = 50  # blocks traced for allocations (tracing slows processing down)
+REGRESSION = 0.10  # --compare flags anything this much slower
+
+# --------------------------
+# Test signal
+# --------------------------
+def synthetic(seconds, channels, sr=SAMPLE_RATE):
+    """Voice-like test signal: a gliding harmonic series over quiet noise."""
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    f0 = 140 + 40 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voice = sum(np.sin(k * phase) / k for k in range(1, 25))
+    rng = np.random.default_rng(0)
+    mono = 0.15 * voice + 0.02 * rng.standard_normal(n)
+    out = np.repeat(mono[:, None], channels, axis=1)
+    # slightly different channels, so stereo effects can't shortcut anything
+    out[:, 1:] += 0.01 * rng.standard_normal((n, channels - 1))
+    return out.astype(np.float32)
+
+def load_input(path, seconds, channels, sr=SAMPLE_RATE):
+    from decoder import decode
+    audio = decode(path, sr, channels)
+    n = int(seconds * sr)
+    if len(audio) < n:
+        audio = np.resize(audio, (n, channels))
+    return np.ascontiguousarray(audio[:n], dtype=np.float32)
+
+# --------------------------
+# Measuring
+# --------------------------
+def measure(chain, audio, blocksize, sr=SAMPLE_RATE):
+    """Time `chain` over `audio` block by block, like a callback would run it."""
+    blocks = len(audio) // blocksize
+    times = np.empty(blocks, dtype=np.float64)
+    block = np.empty((blocksize, audio.shape[1]), dtype=np.float32)
+
+    for b in range(blocks):
+        block[:] = audio[b * blocksize:(b + 1) * blocksize]
+        start = time.perf_counter_ns()
+        chain.process(block, block)
+        times[b] = time.perf_counter_ns() - start
+
+    budget_us = blocksize / sr * 1e6
+    times /= 1000.0  # us
+    return {
+        "blocks": blocks,
+        "mean_us": float(times.mean()),
+        "p99_us": float(np.percentile(times, 99)),
+        "max_us": float(times.max()),
+        "budget_us": budget_us,
+        # processing time per second of audio, < 1 keeps up with real time
+        "rtf": float(times.sum() / (blocks * budget_us)),
+    }
+
+def allocations(chain, audio, blocksize, blocks=ALLOC_BLOCKS):
+    """
+    Memory the chain allocates over `blocks` blocks, as (bytes allocated and
+    still held per block, largest temporary rise within one block). The
+    first is 0 for allocation-free effects: it comes from comparing
+    snapshots around the run. The second also sees temporaries freed within
+    the block, but includes Python's own small objects (a few hundred bytes).
+    """
+    block = np.empty((blocksize, audio.shape[1]), dtype=np.float32)
+    count = min(blocks, len(audio) // blocksize)
+    peak = 0
+    tracemalloc.start()
+    try:
+        # one block first, so caches Python and numpy fill once don't count
+        block[:] = audio[:blocksize]
+        chain.process(block, block)
+        start = tracemalloc.take_snapshot()
+        for b in range(count):
+            block[:] = audio[b * blocksize:(b + 1) * blocksize]
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            chain.process(block, block)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        end = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    # filtered once tracing stopped, the filters' own regex caches don't count either
+    ours = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    diff = end.filter_traces(ours).compare_to(start.filter_traces(ours), "lineno")
+    held = sum(stat.size_diff for stat in diff if stat.size_diff > 0)
+    return held / max(1, count), peak
+
+def run(names=None, setups=SETUPS, seconds=SECONDS, input_file=None):
+    names = names or list(effects.EFFECTS) + CHAINS
+    for name, value in BENCH_PARAMS.items():
+        EFFECT_PARAMS[name] = value
+    effects.warmup(min(b for _, b, _ in setups), sorted({c for _, _, c in setups}))
+
+    results = []
+    for label, blocksize, channels in setups:
+        if input_file:
+            audio = load_input(input_file, seconds, channels)
+        else:
+            audio = synthetic(seconds, channels)
+
+        for name in names:
+            chain = EffectChain.from_names(name, channels)
+            # fill delay lines and FIFOs so steady state is measured
+            measure(chain, audio[:SAMPLE_RATE // 2], blocksize)
+            result = {"name": name, "setup": label, "blocksize": blocksize, "channels": channels}
+            result.update(measure(chain, audio, blocksize))
+            result["alloc_bytes"], result["alloc_peak"] = allocations(chain, audio, blocksize)
+            results.append(result)
+            print(f"{label:<12} {name:<22} mean {result['mean_us']:8.1f} us  p99 {result['p99_us']:8.1f} us  "
+                  f"rtf {result['rtf']:6.3f}  alloc {result['alloc_bytes'] / 1024:6.1f} KiB/block  "
+                  f"peak {result['alloc_peak'] / 1024:6.1f} KiB")
+    return results
+
+def environment():
+    import numba
+    return {
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "numba": numba.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor() or platform.machine(),
+        "system": platform.platform(),
+    }
+
+# --------------------------
+# Comparing runs
+# --------------------------
+def compare(old, new, threshold=REGRESSION):
+    """Print mean/p99 changes against an earlier JSON report. Returns the regressions."""
+    before = {(r["setup"], r["name"]): r for r in old["results"]}
+    regressions = []
+    for r in new["results"]:
+        o = before.get((r["setup"], r["name"]))
+        if o is None:
+            continue
+        d_mean = r["mean_us"] / o["mean_us"] - 1 if o["mean_us"] else 0.0
+        d_p99 = r["p99_us"] / o["p99_us"] - 1 if o["p99_us"] else 0.0
+        flag = ""
+        if d_mean > threshold or d_p99 > threshold:
+            flag = "  <-- slower"
+            regressions.append(r)
+        print(f"{r['setup']:<12} {r['name']:<22} mean {d_mean:+7.1%}  p99 {d_p99:+7.1%}{flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark effects.py effects and chains per audio block")
+    parser.add_argument("names", nargs="*", help="effects or comma-separated chains (default: all effects and common chains)")
+    parser.add_argument("--seconds", type=float, default=SECONDS, help="audio length per measurement")
+    parser.add_argument("--input", help="audio file to process instead of the synthetic voice")
+    parser.add_argument("--setup", action="append", metavar="BLOCKSIZE:CHANNELS",
+                        help="block size and channel count to run at (default: 128:1 and 1024:2)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE", help="set an EFFECT_PARAMS value")
+    parser.add_argument("--json", "-o", help="write results to this JSON file")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    setups = SETUPS
+    if args.setup:
+        setups = []
+        for s in args.setup:
+            blocksize, channels = (int(v) for v in s.split(":"))
+            setups.append((f"{blocksize}x{channels}", blocksize, channels))
+    for p in args.param:
+        name, value = p.split("=", 1)
+        BENCH_PARAMS[name] = float(value)
+
+    report = {
+        "environment": environment(),
+        "sample_rate": SAMPLE_RATE,
+        "seconds": args.seconds,
+        "input": args.input or "synthetic",
+        "params": dict(EFFECT_PARAMS.items()) | BENCH_PARAMS,
+        "results": run(args.names, setups, args.seconds, args.input),
+    }
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old, report):
+            sys.exit(1)
@@ -0,0 +1,301 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import soundfile as sf
+import effects
+from effects import EFFECT_PARAMS, EffectChain
+from audio_cache import INDEX_NAME
+
+# --------------------------
+# Settings
+# --------------------------
+SAMPLE_RATE = 48000
+CHANNELS = 2        # sound board clips are stereo
+BLOCKSIZE = 1024    # same blocks as sound_board.py, so renders match what it plays live
+TAIL = 5.0          # max seconds rendered after the input ends, unless the chain needs longer
+SILENCE = 1e-5      # tail stops once this quiet for SILENCE_FRAMES
+SILENCE_FRAMES = 8192  # at least, longer when an effect's delay is
+SEED = 0
+TOLERANCE = 1e-5    # --compare: max sample difference still counted as equal
+
+AUDIO_EXTS = (".wav", ".flac", ".mp3", ".m4a", ".ogg", ".opus", ".aif", ".aiff")
+OUTPUT_FORMATS = ("wav", "flac", "npy")
+
+# --------------------------
+# Reading in blocks
+# --------------------------
+def read_blocks(path, blocksize=BLOCKSIZE, channels=CHANNELS, sr=SAMPLE_RATE):
+    """
+    Yield (frames, channels) float32 blocks of `path` at `sr`, the last one
+    shorter. Files libsndfile reads at `sr` are read in place; anything that
+    needs resampling or downmixing is streamed through ffmpeg. The yielded
+    array is reused, copy it to keep it.
+    """
+    block = np.zeros((blocksize, channels), dtype=np.float32)
+    try:
+        f = sf.SoundFile(path)
+    except (RuntimeError, TypeError):
+        f = None
+
+    if f is not None and f.samplerate == sr and f.channels in (1, channels):
+        with f:
+            mono = np.zeros((blocksize, 1), dtype=np.float32) if f.channels == 1 else None
+            while True:
+                if mono is None:
+                    n = len(f.read(blocksize, dtype="float32", always_2d=True, out=block))
+                else:
+                    n = len(f.read(blocksize, dtype="float32", always_2d=True, out=mono))
+                    block[:n] = mono[:n]
+                if n == 0:
+                    return
+                yield block[:n]
+        return
+    if f is not None:
+        f.close()
+
+    from decoder import StreamDecoder
+    stream = StreamDecoder(path, sr, channels, frames=0)
+    try:
+        while not stream.eof:
+            if not stream.ready(blocksize):
+                time.sleep(0.001)
+                continue
+            n = stream.read_into(block, blocksize)
+            if n:
+                yield block[:n]
+        if stream.error:
+            raise RuntimeError(f"Can't decode {path}: {stream.error}")
+    finally:
+        stream.close()
+
+# --------------------------
+# Rendering
+# --------------------------
+class _NpyWriter:
+    """
+    Streams blocks into a .npy file. The header is written with 0 frames and
+    rewritten on close; numpy pads it so the frame count can grow in place.
+    """
+
+    def __init__(self, path, channels):
+        self.channels = channels
+        self.frames = 0
+        self.file = open(path, "wb")
+        self._header()
+
+    def _header(self):
+        header = {"descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                  "fortran_order": False, "shape": (self.frames, self.channels)}
+        np.lib.format.write_array_header_1_0(self.file, header)
+
+    def write(self, block):
+        self.file.write(np.ascontiguousarray(block, dtype=np.float32))
+        self.frames += len(block)
+
+    def close(self):
+        end = self.file.tell()
+        self.file.seek(0)
+        self._header()
+        self.file.seek(end)
+        self.file.close()
+
+def _writer(path, sr, channels):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        return _NpyWriter(path, channels)
+    # float WAV keeps renders bit exact for comparing, FLAC tops out at 24 bit
+    subtype = "FLOAT" if ext == ".wav" else None
+    return sf.SoundFile(path, "w", sr, channels, subtype=subtype)
+
+def render_file(src, dst, names, params=None, blocksize=BLOCKSIZE, channels=CHANNELS,
+                sr=SAMPLE_RATE, tail=TAIL, ir=None, seed=SEED):
+    """
+    Run `src` through the effect chain `names` ("pitch,reverb" or a list)
+    block by block, as the sound board would live, and write the result to
+    `dst` (.wav as float, .flac or .npy). `params` overrides EFFECT_PARAMS
+    values, `ir` the convolution impulse response.
+
+    The chain keeps running on silence after the input for at least its
+    latency plus impulse response length, then until the output is quiet,
+    at most `tail` seconds (or the chain's minimum, if longer). Output only
+    depends on the input and the arguments, so renders can be compared bit
+    for bit.
+    Returns a dict with frames written and timing.
+    """
+    for name, value in (params or {}).items():
+        EFFECT_PARAMS[name] = value
+    if ir is not None:
+        effects.CONVOLUTION_IR = ir
+    effects.seed(seed)
+    chain = EffectChain.from_names(names, channels)
+
+    start = time.perf_counter()
+    frames = 0
+    out = np.empty((blocksize, channels), dtype=np.float32)
+    tmp = dst + ".tmp" + os.path.splitext(dst)[1]
+    writer = _writer(tmp, sr, channels)
+    try:
+        for block in read_blocks(src, blocksize, channels, sr):
+            n = len(block)
+            writer.write(chain.process(block, out[:n]))
+            frames += n
+
+        # quiet stretches shorter than the longest delay can sit between echoes
+        needed = chain.latency + chain.tail
+        quiet_frames = max([SILENCE_FRAMES] + [fx.latency for fx in chain.effects])
+        silence = np.zeros((blocksize, channels), dtype=np.float32)
+        quiet = 0
+        for b in range(-(-max(int(tail * sr), needed) // blocksize)):
+            if b * blocksize >= needed and quiet >= quiet_frames:
+                break
+            chain.process(silence, out)
+            writer.write(out)
+            frames += blocksize
+            quiet = quiet + blocksize if np.abs(out).max() < SILENCE else 0
+    except BaseException:
+        writer.close()
+        os.remove(tmp)
+        raise
+    writer.close()
+    os.replace(tmp, dst)
+
+    elapsed = time.perf_counter() - start
+    return {"src": src, "dst": dst, "frames": frames, "seconds": elapsed,
+            "speed": frames / sr / max(elapsed, 1e-9)}
+
+def _skipped(folder, exclude):
+    # the sound board's cache holds transcoded copies of the sounds next to it
+    return (exclude and os.path.realpath(folder) == exclude) or os.path.isfile(os.path.join(folder, INDEX_NAME))
+
+def find_inputs(paths, exclude=None):
+    """
+    Audio files in `paths` (files as given, folders recursively) as (path,
+    path relative to its root). Audio cache folders and `exclude` are skipped.
+    """
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append((path, os.path.basename(path)))
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if not _skipped(os.path.join(root, d), exclude)]
+            for name in sorted(files):
+                if name.lower().endswith(AUDIO_EXTS):
+                    full = os.path.join(root, name)
+                    found.append((full, os.path.relpath(full, path)))
+    return found
+
+def render(paths, out_dir, names, params=None, workers=None, fmt="wav", **options):
+    """
+    Render every audio file in `paths` (files or folders) through `names`
+    into `out_dir`, keeping folder structure, one file per worker process.
+    `options` go to render_file(). Returns the results of the files that
+    rendered, failures are printed.
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {fmt}")
+    EffectChain.parse_names(names)  # unknown names fail here, not in every worker
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = []
+    for src, rel in find_inputs(paths, exclude=os.path.realpath(out_dir)):
+        dst = os.path.join(out_dir, os.path.splitext(rel)[0] + "." + fmt)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        jobs.append((src, dst))
+
+    # compile once here so numba's disk cache has the kernels; every worker then
+    # loads them before its first file (spawned workers start from a fresh import,
+    # forked ones inherit the compiled kernels and return right away)
+    warm = (options.get("blocksize", BLOCKSIZE), (options.get("channels", CHANNELS),))
+    effects.warmup(*warm)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             initializer=effects.warmup, initargs=warm) as pool:
+        futures = {pool.submit(render_file, src, dst, names, params, **options): src for src, dst in jobs}
+        for fut in as_completed(futures):
+            try:
+                result = fut.result()
+            except Exception as e:
+                print(f"[RENDER] {futures[fut]} failed: {e}")
+                continue
+            results.append(result)
+            print(f"[RENDER] {result['dst']} ({result['frames'] / SAMPLE_RATE:.1f} s audio, "
+                  f"{result['speed']:.0f}x real time)")
+    results.sort(key=lambda r: r["dst"])
+    return results
+
+# --------------------------
+# Regression check
+# --------------------------
+def _load(path):
+    if path.endswith(".npy"):
+        return np.load(path)
+    data, _ = sf.read(path, dtype="float32", always_2d=True)
+    return data
+
+def compare(results, out_dir, ref_dir, tolerance=TOLERANCE):
+    """
+    Compare every rendered file against the file at the same place in
+    `ref_dir` (an earlier render). Returns the files that differ by more
+    than `tolerance` or are missing from the reference.
+    """
+    failed = []
+    for r in results:
+        rel = os.path.relpath(r["dst"], out_dir)
+        ref = os.path.join(ref_dir, rel)
+        if not os.path.exists(ref):
+            print(f"[COMPARE] {rel}: no reference")
+            failed.append(rel)
+            continue
+        new, old = _load(r["dst"]), _load(ref)
+        if new.shape != old.shape:
+            print(f"[COMPARE] {rel}: length {len(new)} frames, reference has {len(old)}")
+            failed.append(rel)
+            continue
+        diff = float(np.abs(new - old).max()) if new.size else 0.0
+        if diff > tolerance:
+            print(f"[COMPARE] {rel}: max difference {diff:.2e}  <-- changed")
+            failed.append(rel)
+        else:
+            print(f"[COMPARE] {rel}: ok ({diff:.1e})")
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render audio files through effects.py chains offline")
+    parser.add_argument("chain", help="effect or comma-separated chain, e.g. pitch,reverb")
+    parser.add_argument("inputs", nargs="+", help="audio files or folders")
+    parser.add_argument("-o", "--output", default="rendered", help="output folder")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="wav", help="output format (wav is 32 bit float)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE", help="set an EFFECT_PARAMS value")
+    parser.add_argument("--ir", help="impulse response for the convolution reverb")
+    parser.add_argument("--blocksize", type=int, default=BLOCKSIZE)
+    parser.add_argument("--channels", type=int, default=CHANNELS)
+    parser.add_argument("--tail", type=float, default=TAIL, help="max seconds rendered past the end of the input (the chain may need longer)")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed for randomized effects (granular)")
+    parser.add_argument("--workers", type=int, help="processes (default: one per core)")
+    parser.add_argument("--compare", metavar="DIR", help="earlier render to compare the output against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    params = {}
+    for p in args.param:
+        name, value = p.split("=", 1)
+        if name not in EFFECT_PARAMS:
+            parser.error(f"Unknown parameter: {name}")
+        params[name] = float(value)
+
+    try:
+        results = render(args.inputs, args.output, args.chain, params, args.workers, args.format,
+                         blocksize=args.blocksize, channels=args.channels, tail=args.tail,
+                         ir=args.ir, seed=args.seed)
+    except (KeyError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    print(f"[RENDER] {len(results)} files rendered to {args.output}")
+
+    if args.compare:
+        if compare(results, args.output, args.compare, args.tolerance):
+            sys.exit(1)
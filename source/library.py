@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from mutagen import File as MutagenFile
+from loudness import measure_file
+
+# --------------------------
+# Settings
+# --------------------------
+LIBRARY_PATH = "library.sqlite"
+AUDIO_EXTS = (".wav", ".flac", ".mp3", ".m4a")
+MEASURE_SR = 48000
+REPLAYGAIN_REFERENCE = -18.0  # LUFS, ReplayGain 2.0
+
+# --------------------------
+# Tag reading
+# --------------------------
+def _replaygain(audio):
+    """(integrated, peak) from ReplayGain track tags, or None."""
+    try:
+        gain = float(audio["replaygain_track_gain"][0].split()[0])
+    except (KeyError, IndexError, ValueError):
+        return None
+    peak = None
+    try:
+        # sample peak rather than true peak, close enough for a limit
+        linear = float(audio["replaygain_track_peak"][0])
+        peak = 20 * np.log10(linear) if linear > 0 else float("-inf")
+    except (KeyError, IndexError, ValueError):
+        pass
+    return REPLAYGAIN_REFERENCE - gain, peak
+
+def read_tags(path):
+    """
+    Duration, title, artist and loudness of one file from its header and
+    tags. Loudness comes from ReplayGain tags when present, else None.
+    """
+    audio = MutagenFile(path, easy=True)
+    if audio is None:
+        return {"duration": None, "title": None, "artist": None, "loudness": None}
+
+    def first(key):
+        # 'title' and 'artist' are standardized in EasyID3/EasyTags
+        try:
+            return audio[key][0] if audio[key] else None
+        except (KeyError, ValueError):
+            return None
+
+    return {
+        "duration": getattr(audio.info, "length", None),
+        "title": first("title"),
+        "artist": first("artist"),
+        "loudness": _replaygain(audio),
+    }
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+# --------------------------
+# Library index
+# --------------------------
+class Library:
+    """
+    Persistent SQLite index of the tracks the players know about.
+
+    Per track it keeps path, mtime, size, duration, title, artist and
+    loudness (integrated LUFS + true peak). Tags are only parsed again when
+    a file's mtime or size changes. Folders remember their mtime, which
+    changes whenever a file is added, removed or renamed in them, so an
+    unchanged folder is listed from the index without touching the disk.
+
+    Thread-safe.
+    """
+
+    def __init__(self, path=LIBRARY_PATH, workers=None):
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS tracks (
+                path TEXT PRIMARY KEY,
+                folder TEXT,
+                mtime REAL,
+                size INTEGER,
+                duration REAL,
+                title TEXT,
+                artist TEXT,
+                integrated REAL,
+                true_peak REAL
+            );
+            CREATE INDEX IF NOT EXISTS tracks_folder ON tracks (folder);
+            CREATE TABLE IF NOT EXISTS folders (
+                path TEXT PRIMARY KEY,
+                mtime REAL
+            );
+        """)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ---- scanning ----
+    def scan(self, paths, folder=None, verify=True):
+        """
+        Index `paths`, reading tags in parallel for new or changed files
+        only. Returns the paths that exist, in order.
+        With verify=False, already indexed paths are trusted without a stat.
+        """
+        if folder is not None:
+            with self._lock:
+                known = {row[0]: row[1:] for row in self._db.execute(
+                    "SELECT path, mtime, size FROM tracks WHERE folder = ?", (folder,))}
+        else:
+            known = self._rows(paths)
+
+        existing = []
+        changed = []
+        for path in paths:
+            if not verify and path in known:
+                existing.append(path)
+                continue
+            st = _stat(path)
+            if st is None:
+                continue
+            existing.append(path)
+            if known.get(path) != st:
+                changed.append((path, st))
+
+        if changed:
+            rows = []
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(read_tags, path): (path, st) for path, st in changed}
+                for fut in as_completed(futures):
+                    path, (mtime, size) = futures[fut]
+                    try:
+                        tags = fut.result()
+                    except Exception as e:
+                        print(f"[LIBRARY] Can't read tags of {path}: {e}")
+                        tags = {"duration": None, "title": None, "artist": None, "loudness": None}
+                    integrated, peak = tags["loudness"] or (None, None)
+                    rows.append((path, folder, mtime, size, tags["duration"],
+                                 tags["title"], tags["artist"], integrated, peak))
+            with self._lock:
+                # a file listed by hand keeps the folder it was indexed under
+                self._db.executemany("""
+                    INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (path) DO UPDATE SET
+                        folder = COALESCE(excluded.folder, folder),
+                        mtime = excluded.mtime, size = excluded.size,
+                        duration = excluded.duration, title = excluded.title, artist = excluded.artist,
+                        integrated = excluded.integrated, true_peak = excluded.true_peak
+                """, rows)
+                self._db.commit()
+        return existing
+
+    def _rows(self, paths):
+        known = {}
+        with self._lock:
+            for path in paths:
+                row = self._db.execute("SELECT mtime, size FROM tracks WHERE path = ?", (path,)).fetchone()
+                if row:
+                    known[path] = row
+        return known
+
+    def folder_tracks(self, folder, exts=AUDIO_EXTS, verify=False):
+        """
+        Sorted audio files in `folder`. The folder is only listed (and new
+        files tag-scanned) when its mtime changed since the last call.
+        verify=True also re-checks every file for in-place edits.
+        """
+        st = _stat(folder)
+        if st is None:
+            return []
+        with self._lock:
+            row = self._db.execute("SELECT mtime FROM folders WHERE path = ?", (folder,)).fetchone()
+
+        if row and row[0] == st[0]:
+            with self._lock:
+                paths = [r[0] for r in self._db.execute(
+                    "SELECT path FROM tracks WHERE folder = ? ORDER BY path", (folder,))]
+            if verify:
+                self.scan(paths, folder)
+            return paths
+
+        paths = [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(exts)]
+        paths = self.scan(paths, folder)
+        with self._lock:
+            # forget files that left the folder
+            indexed = [r[0] for r in self._db.execute("SELECT path FROM tracks WHERE folder = ?", (folder,))]
+            gone = set(indexed) - set(paths)
+            self._db.executemany("DELETE FROM tracks WHERE path = ?", [(p,) for p in gone])
+            self._db.execute("INSERT OR REPLACE INTO folders VALUES (?, ?)", (folder, st[0]))
+            self._db.commit()
+        return paths
+
+    # ---- lookups ----
+    def info(self, path):
+        """Indexed {"duration", "title", "artist", "loudness"} of `path`, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT duration, title, artist, integrated, true_peak FROM tracks WHERE path = ?",
+                (path,)).fetchone()
+        if row is None:
+            return None
+        loudness = None
+        if row[3] is not None:
+            loudness = (row[3], row[4] if row[4] is not None else float("-inf"))
+        return {"duration": row[0], "title": row[1], "artist": row[2], "loudness": loudness}
+
+    def set_loudness(self, path, measurement):
+        integrated, peak = measurement
+        with self._lock:
+            self._db.execute("UPDATE tracks SET integrated = ?, true_peak = ? WHERE path = ?",
+                             (integrated, peak, path))
+            self._db.commit()
+
+    def measure_loudness(self, paths, workers=2):
+        """
+        Measure integrated loudness and true peak of every path in `paths`
+        that has none yet. Tracks are streamed in blocks, so memory use
+        doesn't depend on their length.
+        """
+        infos = ((p, self.info(p)) for p in paths)
+        todo = [p for p, info in infos if info is not None and info["loudness"] is None]
+        if not todo:
+            return
+
+        def run(path):
+            self.set_loudness(path, measure_file(path, MEASURE_SR, 2))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run, path): path for path in todo}
+            for fut in as_completed(futures):
+                try:
+                    fut.result()
+                except Exception as e:
+                    print(f"[LIBRARY] Can't measure {futures[fut]}: {e}")
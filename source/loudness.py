@@ -0,0 +1,241 @@
+import time
+import numpy as np
+import soundfile as sf
+from scipy.signal import lfilter, resample_poly
+
+# --------------------------
+# Loudness measurement (ITU-R BS.1770 / EBU R128)
+# --------------------------
+BLOCK_SECONDS = 0.4
+STEP_SECONDS = 0.1
+ABSOLUTE_GATE = -70.0  # LUFS
+RELATIVE_GATE = -10.0  # LU below the abs-gated loudness
+
+def _k_weighting(sr):
+    """K-weighting filter (high shelf + high pass) coefficients for `sr`."""
+    # high shelf
+    G = 3.999843853973347
+    f0 = 1681.974450955533
+    Q = 0.7071752369554196
+    K = np.tan(np.pi * f0 / sr)
+    Vh = 10 ** (G / 20)
+    Vb = Vh ** 0.4996667741545416
+    a0 = 1 + K / Q + K * K
+    b1 = [(Vh + Vb * K / Q + K * K) / a0, 2 * (K * K - Vh) / a0, (Vh - Vb * K / Q + K * K) / a0]
+    a1 = [1.0, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0]
+
+    # high pass
+    f0 = 38.13547087602444
+    Q = 0.5003270373238773
+    K = np.tan(np.pi * f0 / sr)
+    a0 = 1 + K / Q + K * K
+    b2 = [1.0, -2.0, 1.0]
+    a2 = [1.0, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0]
+
+    return (b1, a1), (b2, a2)
+
+def integrated_loudness(data, sr):
+    """Gated integrated loudness of a (frames, channels) array in LUFS, -inf for silence."""
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 1:
+        data = data[:, None]
+
+    (b1, a1), (b2, a2) = _k_weighting(sr)
+    weighted = lfilter(b2, a2, lfilter(b1, a1, data, axis=0), axis=0)
+
+    block = int(round(BLOCK_SECONDS * sr))
+    step = int(round(STEP_SECONDS * sr))
+    frames = weighted.shape[0]
+    if frames == 0:
+        return float("-inf")
+
+    # mean square per block and channel, via a cumulative sum
+    power = np.concatenate([np.zeros((1, weighted.shape[1])), np.cumsum(weighted ** 2, axis=0)])
+    if frames < block:
+        # shorter than one gating block, measure it as a single block
+        z = (power[-1] / frames)[None, :]
+    else:
+        starts = np.arange(0, frames - block + 1, step)
+        z = (power[starts + block] - power[starts]) / block
+
+    # L/R/C weights are 1.0; surround weights don't apply to our stereo material
+    return _gate(z.sum(axis=1))
+
+def _gate(zsum):
+    """Integrated loudness from per-block channel-summed mean squares, -inf for silence."""
+    with np.errstate(divide="ignore"):
+        block_loudness = -0.691 + 10 * np.log10(zsum)
+
+    gated = zsum[block_loudness > ABSOLUTE_GATE]
+    if gated.size == 0:
+        return float("-inf")
+
+    relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = zsum[(block_loudness > ABSOLUTE_GATE) & (block_loudness > relative)]
+    if gated.size == 0:
+        return float("-inf")
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+def true_peak(data, oversample=4, chunk=1 << 18):
+    """True peak of a (frames, channels) array in dBTP (4x oversampled)."""
+    data = np.asarray(data, dtype=np.float32)
+    if data.ndim == 1:
+        data = data[:, None]
+
+    pad = 64  # covers the resampling filter's reach at the chunk edges
+    peak = 0.0
+    for start in range(0, data.shape[0], chunk):
+        lo = max(0, start - pad)
+        seg = resample_poly(data[lo:start + chunk + pad], oversample, 1, axis=0)
+        head = (start - lo) * oversample
+        body = seg[head:head + min(chunk, data.shape[0] - start) * oversample]
+        if body.size:
+            peak = max(peak, float(np.abs(body).max()))
+
+    if peak == 0.0:
+        return float("-inf")
+    return float(20 * np.log10(peak))
+
+def measure(data, sr):
+    """(integrated LUFS, true peak dBTP) of a (frames, channels) array."""
+    return integrated_loudness(data, sr), true_peak(data)
+
+# --------------------------
+# Streaming measurement
+# --------------------------
+class LoudnessMeter:
+    """
+    integrated_loudness() and true_peak() for audio fed block by block, so
+    a track never has to be in memory as a whole.
+
+    The K-weighting filters carry their state across blocks, and only the
+    energy of every 100 ms step is kept (10 floats per second); a 400 ms
+    gating block is four consecutive steps. The true peak is resampled with
+    `pad` frames of context on both sides, so it lags the input by `pad`
+    frames until finish().
+    """
+
+    def __init__(self, sr, channels=2, oversample=4, pad=64):
+        self.sr = sr
+        self.channels = channels
+        self.oversample = oversample
+        self.pad = pad
+        (b1, a1), (b2, a2) = _k_weighting(sr)
+        # zero initial state, like lfilter over the whole array
+        self._filters = [(b1, a1, np.zeros((len(a1) - 1, channels))),
+                         (b2, a2, np.zeros((len(a2) - 1, channels)))]
+        self.step = int(round(STEP_SECONDS * sr))
+        self.block = int(round(BLOCK_SECONDS * sr))
+        self.frames = 0
+        self._steps = []        # channel-summed energy of every complete step
+        self._partial = 0.0     # energy of the step being filled
+        self._partial_frames = 0
+        self._history = np.zeros((2 * pad, channels), dtype=np.float32)
+        self._peak = 0.0
+
+    def feed(self, data):
+        """Add the next (frames, channels) block."""
+        data = np.asarray(data, dtype=np.float32)
+        if data.ndim == 1:
+            data = data[:, None]
+        if not len(data):
+            return
+        self.frames += len(data)
+        self._feed_peak(data)
+
+        weighted = data.astype(np.float64)
+        for i, (b, a, zi) in enumerate(self._filters):
+            weighted, zi = lfilter(b, a, weighted, axis=0, zi=zi)
+            self._filters[i] = (b, a, zi)
+        energy = (weighted ** 2).sum(axis=1)
+
+        pos = 0
+        while pos < len(energy):
+            take = min(self.step - self._partial_frames, len(energy) - pos)
+            self._partial += float(energy[pos:pos + take].sum())
+            self._partial_frames += take
+            pos += take
+            if self._partial_frames == self.step:
+                self._steps.append(self._partial)
+                self._partial = 0.0
+                self._partial_frames = 0
+
+    def _feed_peak(self, data):
+        # frames [pad, pad + n) of x have `pad` frames of context both ways
+        x = np.concatenate([self._history, data])
+        seg = resample_poly(x, self.oversample, 1, axis=0)
+        body = seg[self.pad * self.oversample:(len(x) - self.pad) * self.oversample]
+        if body.size:
+            self._peak = max(self._peak, float(np.abs(body).max()))
+        self._history = x[-2 * self.pad:]
+
+    def finish(self):
+        """(integrated LUFS, true peak dBTP) of everything fed."""
+        # the last `pad` frames, with silence after them
+        self._feed_peak(np.zeros((self.pad, self.channels), dtype=np.float32))
+        peak = float(20 * np.log10(self._peak)) if self._peak > 0.0 else float("-inf")
+
+        if self.frames == 0:
+            return float("-inf"), peak
+        if self.frames < self.block:
+            # shorter than one gating block, measure it as a single block
+            total = sum(self._steps) + self._partial
+            return _gate(np.array([total / self.frames])), peak
+        steps = np.array(self._steps)
+        per_block = self.block // self.step
+        sums = np.convolve(steps, np.ones(per_block), mode="valid")
+        return _gate(sums / self.block), peak
+
+def measure_file(path, sr=48000, channels=2, blocksize=1 << 16):
+    """
+    measure() of an audio file, streamed so memory use doesn't depend on
+    its length. Files libsndfile reads are measured at their own rate;
+    anything else is streamed through ffmpeg at `sr`. Mono is measured as
+    `channels` identical channels, like decode() would return it.
+    """
+    try:
+        info = sf.info(path)
+    except (RuntimeError, TypeError):
+        info = None
+
+    if info is not None and info.channels in (1, channels):
+        meter = LoudnessMeter(info.samplerate, channels)
+        for block in sf.blocks(path, blocksize, dtype="float32", always_2d=True):
+            if block.shape[1] != channels:
+                block = np.repeat(block, channels, axis=1)
+            meter.feed(block)
+        return meter.finish()
+
+    from decoder import StreamDecoder
+    meter = LoudnessMeter(sr, channels)
+    block = np.zeros((blocksize, channels), dtype=np.float32)
+    stream = StreamDecoder(path, sr, channels, frames=0)
+    try:
+        while not stream.eof:
+            if not stream.ready(blocksize):
+                time.sleep(0.005)
+                continue
+            n = stream.read_into(block, blocksize)
+            meter.feed(block[:n])
+        if stream.error:
+            raise RuntimeError(f"Can't decode {path}: {stream.error}")
+    finally:
+        stream.close()
+    return meter.finish()
+
+def normalize_gain(measurement, target=-16.0, peak_limit=-1.5):
+    """
+    Linear gain that brings `measurement` (integrated, true_peak) to
+    `target` LUFS without pushing the true peak above `peak_limit` dBTP.
+    Silence or unmeasured audio gets 1.0.
+    """
+    if measurement is None:
+        return 1.0
+    integrated, peak = measurement
+    if not np.isfinite(integrated):
+        return 1.0
+
+    gain_db = target - integrated
+    if np.isfinite(peak):
+        gain_db = min(gain_db, peak_limit - peak)
+    return float(10 ** (gain_db / 20))
@@ -7,7 +7,8 @@ from PySide6 import QtWidgets, QtCore, QtGui
 import time
 import sys
 from collections import deque
-from effects import EFFECTS, EFFECT_PARAMS
+import effects
+from effects import EFFECTS, EFFECT_PARAMS, EffectChain, LiveChain
 
 
 # ---------------- Globals & Thread-safety ----------------
@@ -23,32 +24,17 @@ mic_lock = threading.Lock()
 stop_event = threading.Event()
 
 # ---------------- Effect System ----------------
-EFFECT_ENABLED = False
-CURRENT_EFFECTS = [] # list of callables 
-effect_lock = threading.Lock()
+live_effects = LiveChain()  # swapped from the CLI, never locked on the audio thread
 
-def set_effect(fns):
+def set_effect(chain):
     """
-    fns: list of effect functions, or None/[] to disable
+    chain: EffectChain, or None/empty to disable
     """
-    global CURRENT_EFFECTS, EFFECT_ENABLED
-    with effect_lock:
-        if not fns:
-            CURRENT_EFFECTS = []
-            EFFECT_ENABLED = False
-        else:
-            CURRENT_EFFECTS = fns
-            EFFECT_ENABLED = True
+    live_effects.set(chain)
 
 def process_effect(chunk):
-    with effect_lock:
-        if not EFFECT_ENABLED or not CURRENT_EFFECTS:
-            return chunk
-
-        out = chunk
-        for fn in CURRENT_EFFECTS:
-            out = fn(out)
-        return out
+    """Run the effect chain over `chunk` in place."""
+    return live_effects.process(chunk)
 
 # ---------------- Signal ----------------
 def handle_sigint(signum, frame):
@@ -175,6 +161,15 @@ def command_loop():
                 print("Invalid gain")
 
         elif cmd.startswith("effect"):
+            if cmd.split()[1] == "ir":
+                parts = cmd.split(maxsplit=2)
+                if len(parts) < 3:
+                    print("Usage: effect ir <file>")
+                    continue
+                effects.CONVOLUTION_IR = parts[2]
+                print(f"Impulse response set to {parts[2]}, used from the next 'effect convolution'")
+                continue
+
             if cmd.split()[1] == "param":
                 if len(cmd.split()) < 4:
                     print("Error! To set a parameter you need at least four terms!")
@@ -205,23 +200,21 @@ def command_loop():
 
             names = [n.strip() for n in arg.split(",") if n.strip()]
 
-            fns = []
-            for n in names:
-                fn = EFFECTS.get(n)
-                if not fn:
-                    print(f"Unknown effect: {n}")
-                    print("Available:", ", ".join(EFFECTS.keys()))
-                    fns = []
-                    break
-                fns.append(fn)
-
-            if fns:
-                set_effect(fns)
+            try:
+                chain = EffectChain.from_names(names)
+            except KeyError as e:
+                print(e.args[0])
+                print("Available:", ", ".join(EFFECTS.keys()))
+                continue
+
+            if chain:
+                set_effect(chain)
                 print("Effect chain:", " -> ".join(names))
 
         elif cmd == "help":
             print("gain <float>")
             print(f"effect <{'|'.join(EFFECTS.keys())}|off>")
+            print("effect ir <file>")
             print("quit")
 
 
@@ -250,6 +243,10 @@ def main():
     samplerate = 48000
     blocksize = 256
 
+    # compile the effect kernels now, not in the callback when one is enabled
+    print("Preparing effects...")
+    effects.warmup(128, (1,))
+
     try:
         stream = sd.Stream(
             samplerate=samplerate,
@@ -0,0 +1,171 @@
+import numpy as np
+from numba import njit, types
+from numba.typed import List
+
+# --------------------------
+# Mix kernel
+# --------------------------
+@njit(cache=True)
+def _mix_voices(sources, src, pos, length, gain, active, out, frames, master_gain):
+    channels = out.shape[1]
+    for i in range(frames):
+        for c in range(channels):
+            out[i, c] = 0.0
+
+    for v in range(active.shape[0]):
+        if not active[v]:
+            continue
+        data = sources[src[v]]
+        p = pos[v]
+        n = min(frames, length[v] - p)
+        g = gain[v] * master_gain
+        for i in range(n):
+            for c in range(channels):
+                out[i, c] += data[p + i, c] * g
+        pos[v] = p + n
+        if pos[v] >= length[v]:
+            active[v] = False
+
+    # final clipping to avoid distortion
+    for i in range(frames):
+        for c in range(channels):
+            if out[i, c] > 1.0:
+                out[i, c] = 1.0
+            elif out[i, c] < -1.0:
+                out[i, c] = -1.0
+
+
+# --------------------------
+# Preallocated mixing engine
+# --------------------------
+STEAL_POLICIES = ("oldest", "quietest", "none")
+
+class Mixer:
+    """
+    Mixes the playing sounds of the sound board into one output block.
+
+    Voices live in a fixed-size voice table (struct of arrays: source id,
+    position, length, gain, active flag, start order) and are all mixed by
+    one compiled kernel call, so callback cost doesn't depend on Python
+    per-voice overhead. All buffers are allocated once up front, nothing is
+    allocated per block in steady state.
+
+    Sounds are registered once with add_source() and played by id.
+    When all `max_voices` are busy, `steal` decides what happens:
+        "oldest"   - replace the voice that started first
+        "quietest" - replace the voice with the lowest gain
+        "none"     - drop the new sound
+    """
+
+    def __init__(self, channels=2, max_frames=1024, max_voices=64, steal="oldest"):
+        if steal not in STEAL_POLICIES:
+            raise ValueError(f"Unknown voice steal policy: {steal}")
+        self.channels = channels
+        self.max_voices = max_voices
+        self.steal = steal
+        self._alloc(max_frames)
+
+        # voice table
+        self.src = np.zeros(max_voices, dtype=np.int32)
+        self.pos = np.zeros(max_voices, dtype=np.int64)
+        self.length = np.zeros(max_voices, dtype=np.int64)
+        self.gain = np.zeros(max_voices, dtype=np.float32)
+        self.active = np.zeros(max_voices, dtype=np.bool_)
+        self.started = np.zeros(max_voices, dtype=np.int64)
+        self._serial = 0
+        self.stolen = 0
+        self.dropped = 0
+
+        self.clear_sources()
+        # compile now rather than on the first audio callback: the mix kernel,
+        # and the typed List's own append/setitem, which play() and
+        # replace_source() would otherwise compile mid-callback
+        silence = np.zeros((1, channels), dtype=np.float32)
+        self.sources.append(silence)
+        self.sources[0] = silence
+        _mix_voices(self.sources, self.src, self.pos, self.length, self.gain,
+                    self.active, self.out, 0, 1.0)
+        self.clear_sources()
+
+    def _alloc(self, max_frames):
+        self.max_frames = max_frames
+        self.out = np.zeros((max_frames, self.channels), dtype=np.float32)
+
+    # ---- sources ----
+    def add_source(self, data):
+        """Register a (frames, channels) float32 array, returns its source id."""
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        if data.ndim != 2 or data.shape[1] != self.channels:
+            raise ValueError(f"Source must have shape (frames, {self.channels}), got {data.shape}")
+        self.sources.append(data)
+        self.lengths.append(data.shape[0])
+        return len(self.lengths) - 1
+
+    def replace_source(self, source, data):
+        """Swap the audio behind an existing source id (stops voices playing it)."""
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        if data.ndim != 2 or data.shape[1] != self.channels:
+            raise ValueError(f"Source must have shape (frames, {self.channels}), got {data.shape}")
+        # a playing voice's length refers to the old data
+        self.active[self.src == source] = False
+        self.sources[source] = data
+        self.lengths[source] = data.shape[0]
+
+    def clear_sources(self):
+        """Forget all sources (and stop every voice using them)."""
+        self.active[:] = False
+        # read-only element type so memory-mapped cache files can be added without copying
+        self.sources = List.empty_list(types.Array(types.float32, 2, "C", readonly=True))
+        # frames per source, so play() never goes through the typed List
+        self.lengths = []
+
+    # ---- voices ----
+    def voice_count(self):
+        return int(np.count_nonzero(self.active))
+
+    def play(self, source, gain=1.0):
+        """Start a voice for `source`. Returns the voice slot, or -1 if dropped."""
+        if not 0 <= source < len(self.lengths):
+            # stale id queued before a reload
+            self.dropped += 1
+            return -1
+
+        free = np.flatnonzero(~self.active)
+        if free.size:
+            v = int(free[0])
+        elif self.steal == "oldest":
+            v = int(np.argmin(self.started))
+            self.stolen += 1
+        elif self.steal == "quietest":
+            v = int(np.argmin(self.gain))
+            self.stolen += 1
+        else:
+            self.dropped += 1
+            return -1
+
+        self.src[v] = source
+        self.pos[v] = 0
+        self.length[v] = self.lengths[source]
+        self.gain[v] = gain
+        self.started[v] = self._serial
+        self._serial += 1
+        self.active[v] = True
+        return v
+
+    def stop_all(self):
+        self.active[:] = False
+
+    def mix(self, frames, master_gain=1.0):
+        """
+        Mix `frames` frames of every active voice and advance their positions.
+        Returns a (frames, channels) view into the internal output buffer,
+        which is overwritten by the next call.
+        """
+        if frames > self.max_frames:
+            # host ignored our blocksize, grow once and keep the new size
+            self._alloc(frames)
+
+        out = self.out[:frames]
+        _mix_voices(self.sources, self.src, self.pos, self.length, self.gain,
+                    self.active, out, frames, master_gain)
+        return out
@@ -3,7 +3,6 @@ import sounddevice as sd
 import soundfile as sf
 import numpy as np
 import threading
-import subprocess
 import time
 import json
 import keyboard
@@ -14,6 +13,14 @@ from PySide6.QtWidgets import (
 )
 from PySide6.QtCore import Qt, QSize, QTimer
 from mutagen import File as MutagenFile
+from decoder import StreamDecoder
+from track_queue import TrackQueue
+from ringbuffer import BroadcastRing
+from resampler import AdaptiveResampler
+from renderer import TrackRenderer
+from library import Library, AUDIO_EXTS
+from loudness import normalize_gain
+from watcher import Watcher
 from rich import print
 import random
 import sys
@@ -45,8 +52,16 @@ stream_channels = 2
 blocksize = 1024
 master_gain = 1.0
 gain_step = 0.05
+prefetch_tracks = 2  # upcoming tracks kept decoding in the background
+ring_frames = 16 * blocksize  # shared output ring, read by both devices
+ahead_frames = 3 * blocksize  # rendered ahead of the device output
+stall_seconds = 0.25  # device 1 silent this long hands the pace to device 2
+fade_ms = 8.0  # crossfade on seek, track change and pause
 
 playlist_json = "playlists.json"  # JSON file with playlists
+library_path = "library.sqlite"  # index of track tags, durations and loudness
+loudness_target = -16.0  # LUFS, WAVs only
+true_peak_limit = -1.5  # dBTP
 shuffle_mode = False
 random_any_mode = False
 status_enabled = False
@@ -55,12 +70,20 @@ status_enabled = False
 # Playback state
 # --------------------------
 paused = False
-playing_song = {"data": None, "pos": 0, "name": "", "preloaded": None}
+playing_song = {"stream": None, "pos": 0, "frames": 0, "path": None, "name": ""}
 playing_lock = threading.Lock()
+resumed = threading.Event()  # set while not paused
+resumed.set()
+space = threading.Event()  # set by the device callbacks after each read
+output_ring = BroadcastRing(ring_frames, stream_channels, readers=2)
 current_playlist = []
 current_playlist_name = None
 current_index = 0
 playlists = {}
+all_tracks = []  # every playlist's tracks, for random-any
+playlist_folders = {}  # name -> folder, for folder playlists
+playlist_lists = {}  # name -> listed files, for list playlists
+library = Library(library_path)
 
 # --------------------------
 # Audio helpers
@@ -73,10 +96,15 @@ def get_track_info(file, default_title="Unknown Track"):
     - default_title: used if the track title is missing
     - artist defaults to "UNKNOWN"
     """
-    audio = MutagenFile(file, easy=True)
     title = default_title
     artist = "UNKNOWN"
 
+    info = library.info(file)
+    if info is not None:
+        return {"title": info["title"] or title, "artist": info["artist"] or artist}
+
+    audio = MutagenFile(file, easy=True)
+
     if audio is not None:
         # 'title' and 'artist' are standardized in EasyID3/EasyTags
         if "title" in audio and audio["title"]:
@@ -86,58 +114,39 @@ def get_track_info(file, default_title="Unknown Track"):
 
     return {"title":title, "artist":artist}
 
-def load_audio_ffmpeg(file):
+def open_stream(file, start=0):
     """
-    Load audio via ffmpeg and return stereo float32 NumPy array.
-    
+    Start decoding `file` from frame `start` as a stereo float32 stream at
+    stream_sr. Only a few seconds are buffered ahead, however long the track.
+
     WAV:
-        - resample to target_sr
-        - loudness normalize
+        - resample to stream_sr
+        - loudness normalize (a gain from the library's measurement,
+          ffmpeg's loudnorm until the track has been measured)
     Non-WAV:
         - resample only (no loudnorm)
     """
+    info = library.info(file)
+    frames = int(info["duration"] * stream_sr) if info and info["duration"] else None
 
-    ext = os.path.splitext(file)[1].lower()
-
-    # Base ffmpeg args
-    cmd = [
-        "ffmpeg",
-        "-i", file,
-        "-ar", str(stream_sr),
-        "-ac", "2",
-    ]
-
+    filters = None
+    gain = 1.0
     # Apply loudness normalization ONLY for WAVs
-    if ext == ".wav":
-        cmd += [
-            "-af", "loudnorm=I=-16:TP=-1.5:LRA=11"
-        ]
-
-    # Output raw float32 PCM to stdout
-    cmd += [
-        "-f", "f32le",
-        "pipe:1"
-    ]
-
-    proc = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL,
-        check=True
-    )
-
-    raw = proc.stdout
-
-    # Convert to NumPy array
-    data = np.frombuffer(raw, dtype=np.float32).copy()
-
-    # Ensure stereo
-    if data.size % 2 != 0:
-        raise RuntimeError("Audio stream is not stereo-aligned")
-
-    data = data.reshape(-1, 2)
-    info = get_track_info(file, os.path.basename(file))
-    return info, data
+    if os.path.splitext(file)[1].lower() == ".wav":
+        if info and info["loudness"]:
+            gain = normalize_gain(info["loudness"], loudness_target, true_peak_limit)
+        else:
+            filters = "loudnorm=I=-16:TP=-1.5:LRA=11"
+    return StreamDecoder(file, stream_sr, stream_channels, start=start,
+                         filters=filters, gain=gain, frames=frames)
+
+def swap_stream(stream, pos=0):
+    """Make `stream` the playing one (call with playing_lock held). Returns the old one to close()."""
+    old = playing_song["stream"]
+    playing_song["stream"] = stream
+    playing_song["pos"] = pos
+    playing_song["frames"] = stream.frames
+    return old
 
 def format_time(seconds):
     m, s = divmod(int(seconds), 60)
@@ -146,7 +155,13 @@ def format_time(seconds):
 # --------------------------
 # Playlist system
 # --------------------------
-def load_playlists_from_json(json_file):
+def load_playlists_from_json(json_file, verify=False, watch=True):
+    """
+    Read playlists from the library index, only listing folders that
+    changed. verify=True re-checks every file for in-place edits.
+    watch=False leaves the watcher alone (the watcher callback returns
+    the new watch set instead).
+    """
     global playlists
     if not os.path.exists(json_file):
         print(f"[ERROR] Playlist JSON '{json_file}' not found.")
@@ -155,18 +170,104 @@ def load_playlists_from_json(json_file):
         raw = json.load(f)
 
     playlists.clear()
+    playlist_folders.clear()
+    playlist_lists.clear()
     for name, content in raw.items():
         if isinstance(content, dict) and "folder" in content:
             folder = content["folder"]
+            playlist_folders[name] = folder
             if os.path.exists(folder):
-                tracks = [os.path.join(folder, f) for f in sorted(os.listdir(folder))
-                          if f.lower().endswith(('.wav', '.flac', '.mp3', '.m4a'))]
+                tracks = library.folder_tracks(folder, verify=verify)
                 if tracks:
                     playlists[name] = tracks
         elif isinstance(content, list):
-            tracks = [f for f in content if os.path.exists(f) and f.lower().endswith(('.wav', '.flac', '.mp3', '.m4a'))]
+            playlist_lists[name] = [f for f in content if f.lower().endswith(AUDIO_EXTS)]
+            tracks = library.scan(playlist_lists[name], verify=verify)
+            if tracks:
+                playlists[name] = tracks
+
+    update_tracks()
+    if watch:
+        watch_playlists(json_file)
+
+def update_tracks():
+    """Rebuild the random-any track list and measure new WAVs in the background."""
+    global all_tracks
+    all_tracks = [t for plist in playlists.values() for t in plist]
+    # WAVs get normalized by their measured loudness
+    wavs = [t for t in all_tracks if t.lower().endswith(".wav")]
+    threading.Thread(target=library.measure_loudness, args=(wavs,), daemon=True).start()
+
+# --------------------------
+# File watching
+# --------------------------
+def watched_paths(json_file):
+    """The playlist JSON, every playlist folder and every listed file."""
+    paths = [json_file]
+    paths += [folder for folder in playlist_folders.values() if os.path.isdir(folder)]
+    for files in playlist_lists.values():
+        paths += files
+    return paths
+
+def watch_playlists(json_file):
+    watcher.watch_only(watched_paths(json_file))
+
+def on_files_changed(paths):
+    """
+    Watcher callback. Updates only the playlists whose files were added,
+    removed or edited, re-reading tags just for those files. Returns the
+    new watch set when the playlist JSON changed.
+    """
+    global current_playlist, current_index
+    paths = {os.path.normpath(p) for p in paths}
+    rewatch = os.path.normpath(playlist_json) in paths
+    if rewatch:
+        # re-watching from in here would race the watcher thread, it takes the returned paths
+        load_playlists_from_json(playlist_json, watch=False)
+        affected = set(playlists)
+    else:
+        affected = set()
+        for name, folder in playlist_folders.items():
+            # a bare folder means the watcher lost track of it, rescan all of it
+            whole = os.path.normpath(folder) in paths
+            hits = [os.path.join(folder, os.path.basename(p)) for p in paths
+                    if os.path.dirname(p) == os.path.normpath(folder)]
+            if not hits and not whole:
+                continue
+            # edits in place don't change the folder's mtime, rescan those files directly
+            library.scan([p for p in hits if p.lower().endswith(AUDIO_EXTS)], folder)
+            tracks = library.folder_tracks(folder, verify=whole)
             if tracks:
                 playlists[name] = tracks
+            else:
+                playlists.pop(name, None)
+            affected.add(name)
+
+        for name, files in playlist_lists.items():
+            if any(os.path.normpath(f) in paths for f in files):
+                tracks = library.scan(files)
+                if tracks:
+                    playlists[name] = tracks
+                else:
+                    playlists.pop(name, None)
+                affected.add(name)
+
+        if not affected:
+            return
+        update_tracks()
+
+    # keep the playing track's position in a changed playlist
+    if current_playlist_name in playlists:
+        current_playlist = playlists[current_playlist_name]
+        if playing_song["path"] in current_playlist:
+            current_index = current_playlist.index(playing_song["path"])
+    if current_playlist_name in affected or random_any_mode:
+        upcoming.reset()
+    print(f"[WATCH] Updated playlists: {', '.join(sorted(affected))}")
+    if rewatch:
+        return watched_paths(playlist_json)
+
+watcher = Watcher(on_files_changed)
 
 def select_playlist(name):
     global current_playlist, current_playlist_name, current_index
@@ -178,52 +279,69 @@ def select_playlist(name):
     current_index = 0
     queue_song(current_index)
 
+# --------------------------
+# Upcoming tracks
+# --------------------------
+def pick_next(last):
+    """Choose the track after `last` (an upcoming entry, None for the playing track)."""
+    if random_any_mode:
+        if not all_tracks:
+            return None
+        return {"path": random.choice(all_tracks), "index": None}
+    if not current_playlist:
+        return None
+    if shuffle_mode:
+        index = random.randint(0, len(current_playlist) - 1)
+    else:
+        prev = last["index"] if last is not None and last["index"] is not None else current_index
+        index = (prev + 1) % len(current_playlist)
+    return {"path": current_playlist[index], "index": index}
+
+def load_entry(entry):
+    entry["info"] = get_track_info(entry["path"], os.path.basename(entry["path"]))
+    entry["stream"] = open_stream(entry["path"])
+
+upcoming = TrackQueue(pick_next, load_entry, depth=prefetch_tracks)
+
+def start_entry(entry):
+    """Make an upcoming entry the playing track (call with playing_lock held). Returns the old stream."""
+    global current_index
+    old = swap_stream(entry["stream"], entry["stream"].pos)
+    playing_song["name"] = entry["info"]["title"]
+    playing_song["path"] = entry["path"]
+    if entry["index"] is not None:
+        current_index = entry["index"]
+    return old
+
+# --------------------------
+# Playback functions
+# --------------------------
 def queue_song(index):
-    global playing_song
     if not current_playlist:
         return
     if shuffle_mode and not random_any_mode:
         index = random.randint(0, len(current_playlist) - 1)
-    info, data = load_audio_ffmpeg(current_playlist[index])
-    with playing_lock:
-        playing_song["data"] = data
-        playing_song["pos"] = 0
-        playing_song["name"] = info["title"]
-        playing_song["path"] = current_playlist[index]
-    preload_next(index)
-
-def preload_next(index):
-    if not current_playlist or random_any_mode:
-        return
-    next_index = (index + 1) % len(current_playlist)
-    info, data = load_audio_ffmpeg(current_playlist[next_index])
+    entry = {"path": current_playlist[index], "index": index}
+    load_entry(entry)
     with playing_lock:
-        playing_song["preloaded"] = {
-            "data": data,
-            "name": info["title"],
-            "path": current_playlist[next_index],
-            "index": next_index
-        }
+        old = start_entry(entry)
+    if old is not None:
+        old.close()
+    # play order continues from here
+    upcoming.reset()
 
 def play_next():
-    global current_index
-    if random_any_mode:
-        all_tracks = [t for plist in playlists.values() for t in plist]
-        if not all_tracks:
+    entry = upcoming.pop()
+    if entry is None:
+        # nothing prefetched yet, open it here
+        entry = pick_next(None)
+        if entry is None:
             return
-        choice = random.choice(all_tracks)
-        info, data = load_audio_ffmpeg(choice)
-        with playing_lock:
-            playing_song["data"] = data
-            playing_song["pos"] = 0
-            playing_song["name"] = info["title"]
-            playing_song["path"] = choice
-        return
-    if shuffle_mode:
-        current_index = random.randint(0, len(current_playlist) - 1)
-    else:
-        current_index = (current_index + 1) % len(current_playlist)
-    queue_song(current_index)
+        load_entry(entry)
+    with playing_lock:
+        old = start_entry(entry)
+    if old is not None:
+        old.close()
 
 def play_prev():
     global current_index
@@ -233,22 +351,37 @@ def play_prev():
 def toggle_pause():
     global paused
     paused = not paused
+    if paused:
+        resumed.clear()
+    else:
+        resumed.set()
+
+def seek_to(new_pos):
+    """Restart decoding of the playing track at frame `new_pos`."""
+    with playing_lock:
+        path = playing_song["path"]
+        frames = playing_song["frames"]
+    if path is None:
+        return
+    if frames and new_pos >= frames:
+        play_next()
+        return
+
+    stream = open_stream(path, max(0, new_pos))
+    with playing_lock:
+        if playing_song["path"] != path:
+            # track changed meanwhile
+            stream.close()
+            return
+        old = swap_stream(stream, max(0, new_pos))
+    old.close()
 
 def seek_seconds(seconds):
-    global playing_song
-    need_next = False
     with playing_lock:
-        if playing_song["data"] is None:
+        if playing_song["stream"] is None:
             return
         new_pos = playing_song["pos"] + int(seconds * stream_sr)
-        if new_pos < 0:
-            playing_song["pos"] = 0
-        elif new_pos >= playing_song["data"].shape[0]:
-            need_next = True
-        else:
-            playing_song["pos"] = new_pos
-    if need_next:
-        play_next()
+    seek_to(new_pos)
 
 def change_volume(delta):
     global master_gain
@@ -259,34 +392,88 @@ def change_volume(delta):
 # --------------------------
 def playback_loop(device1, device2):
     global playing_song, paused
+    renderer = TrackRenderer(blocksize, stream_channels, stream_sr, fade_ms)
+    out1 = output_ring.reader(0)
+    # device 2 runs on its own clock, follow it so its cursor neither runs dry nor piles up
+    out2 = AdaptiveResampler(output_ring.reader(1), ahead_frames, max_frames=blocksize)
+    heard = [0.0, 0.0]  # time of each device's last callback
+
+    def callback1(outdata, frames, time_info, status):
+        # after a stall, drop what piled up rather than play it late
+        excess = out1.available() - ahead_frames - blocksize
+        if excess > 0:
+            out1.skip(excess)
+        out1.read_into(outdata, frames)
+        heard[0] = time.monotonic()
+        space.set()
+
+    def callback2(outdata, frames, time_info, status):
+        out2.read_into(outdata, frames)
+        heard[1] = time.monotonic()
+        space.set()
+
     with sd.OutputStream(device=device1, channels=stream_channels,
-                         samplerate=stream_sr, blocksize=blocksize) as s1, \
+                         samplerate=stream_sr, blocksize=blocksize, callback=callback1), \
          sd.OutputStream(device=device2, channels=stream_channels,
-                         samplerate=stream_sr, blocksize=blocksize) as s2:
+                         samplerate=stream_sr, blocksize=blocksize, callback=callback2):
         while True:
-            if playing_song["data"] is None or paused:
+            stream = playing_song["stream"]
+            if stream is None:
                 time.sleep(0.05)
                 continue
+            if paused:
+                if not renderer.silent:
+                    # fade out instead of stopping mid-waveform
+                    with playing_lock:
+                        renderer.fade_out()
+                        playing_song["pos"] = playing_song["stream"].pos
+                    output_ring.write(renderer.output(master_gain))
+                    continue
+                # callbacks play silence meanwhile
+                resumed.wait()
+                continue
+
+            # device 1 sets the pace; if it stops calling back, device 2 takes over
+            pace = out1 if time.monotonic() - heard[0] < stall_seconds else out2.ring
+            space.clear()
+            if pace.available() >= ahead_frames:
+                space.wait(0.1)
+                continue
+            if not stream.ready(blocksize):
+                held = renderer.stream
+                if held is None or held is stream or held.ring.available() < blocksize or renderer.silent:
+                    # decoder just (re)started, give it a moment
+                    time.sleep(0.002)
+                    continue
+                # seek or track change still starting up, keep playing what we had
+                with playing_lock:
+                    renderer.render(held)
+                output_ring.write(renderer.output(master_gain))
+                continue
 
             need_next = False
+            ended = None
             with playing_lock:
-                pos = playing_song["pos"]
-                data = playing_song["data"]
-                chunk = data[pos:pos+blocksize]
-                chunk_len = chunk.shape[0]
-
-                if chunk_len < blocksize:
-                    pad = np.zeros((blocksize - chunk_len, stream_channels), dtype='float32')
-                    chunk = np.vstack([chunk, pad])
-
-                chunk *= master_gain
-                playing_song["pos"] += chunk_len
-
-                if playing_song["pos"] >= data.shape[0]:
-                    need_next = True
-
-            s1.write(chunk)
-            s2.write(chunk)
+                stream = playing_song["stream"]
+                n = renderer.render(stream)
+
+                if stream.eof:
+                    ended = stream
+                    entry = upcoming.pop()
+                    if entry is not None:
+                        # gapless: the next track starts inside this same block
+                        start_entry(entry)
+                        renderer.follow(entry["stream"], n)
+                    else:
+                        need_next = True
+                playing_song["pos"] = playing_song["stream"].pos
+
+            output_ring.write(renderer.output(master_gain))
+
+            if ended is not None:
+                ended.close()
+                if ended.error:
+                    print(f"[ERROR] {os.path.basename(ended.file)}: {ended.error}")
 
             if need_next:
                 play_next()
@@ -309,10 +496,12 @@ def control_loop():
                 while keyboard.is_pressed('num 9'): time.sleep(0.05)
             elif is_numlock_on() and keyboard.is_pressed('num /'):
                 shuffle_mode = not shuffle_mode
+                upcoming.reset()
                 print("Shuffle mode:", shuffle_mode)
                 while keyboard.is_pressed('num /'): time.sleep(0.05)
             elif is_numlock_on() and keyboard.is_pressed('num *'):
                 random_any_mode = not random_any_mode
+                upcoming.reset()
                 print("Random-anywhere mode:", random_any_mode)
                 while keyboard.is_pressed('num *'): time.sleep(0.05)
             elif is_numlock_on() and keyboard.is_pressed('num 4'):
@@ -535,6 +724,7 @@ class PlayerGUI(QWidget):
         self.shuffle_mode = not self.shuffle_mode
         global shuffle_mode
         shuffle_mode = self.shuffle_mode
+        upcoming.reset()
         self.shuffle_btn.setText(f"Shuffle: {'ON' if self.shuffle_mode else 'OFF'}")
         print("Shuffle toggled", self.shuffle_mode)
 
@@ -542,30 +732,29 @@ class PlayerGUI(QWidget):
         self.random_any_mode = not self.random_any_mode
         global random_any_mode
         random_any_mode = self.random_any_mode
+        upcoming.reset()
         self.random_any_btn.setText(f"Random-any: {'ON' if self.random_any_mode else 'OFF'}")
         print("Random-any toggled", self.random_any_mode)
 
     def update_status(self):
         with playing_lock:
-            if playing_song["data"] is not None:
+            if playing_song["stream"] is not None:
                 pos = playing_song["pos"] / stream_sr
-                total = playing_song["data"].shape[0] / stream_sr
+                total = playing_song["frames"] / stream_sr
                 self.status_label.setText(f"{color['red']['start']}{self.current_playlist_name}{color['red']['end']}/{color['green']['start']}{playing_song['name']}{color['green']['end']} "
                                           f"{format_time(pos)}/{format_time(total)}")
-                self.progress_slider.setEnabled(True)
-                self.progress_slider.setValue(int((pos / total) * 1000))
+                self.progress_slider.setEnabled(total > 0)
+                self.progress_slider.setValue(int((pos / total) * 1000) if total else 0)
             else:
                 self.status_label.setText("Nothing playing")
                 self.progress_slider.setEnabled(False)
                 self.progress_slider.setValue(0)
 
     def slider_released(self):
-        if playing_song["data"] is None:
+        if playing_song["stream"] is None:
             return
         fraction = self.progress_slider.value() / 1000
-        new_pos = int(fraction * playing_song["data"].shape[0])
-        with playing_lock:
-            playing_song["pos"] = new_pos
+        seek_to(int(fraction * playing_song["frames"]))
 
     def change_volume(self, value):
         global master_gain
@@ -575,6 +764,7 @@ class PlayerGUI(QWidget):
 # --------------------------
 if __name__ == "__main__":
     load_playlists_from_json(playlist_json)  # populate global playlists
+    watcher.start()
     if not playlists:
         print("[ERROR] No playlists found. Exiting.")
         sys.exit(1)
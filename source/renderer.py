@@ -0,0 +1,89 @@
+import numpy as np
+
+# --------------------------
+# Click-free track rendering
+# --------------------------
+class TrackRenderer:
+    """
+    Renders blocks from the player's StreamDecoders into its own buffers.
+
+    Any jump in the waveform is audible as a click, so nothing changes
+    abruptly:
+        - switching to another stream (seek, next/prev) crossfades from the
+          old stream's buffered audio over `fade_ms`
+        - fade_out() (pause) ramps down to silence, the first block after
+          it ramps back up
+        - volume changes are ramped across one block
+    A gapless handoff at the end of a track uses follow() instead, which
+    continues the block without a fade.
+
+    Track audio goes into `mix`, the gain is applied from there into `out`,
+    so decoded audio is never scaled in place. All buffers are allocated up
+    front.
+    """
+
+    def __init__(self, blocksize, channels=2, sr=48000, fade_ms=8.0):
+        self.blocksize = blocksize
+        self.mix = np.zeros((blocksize, channels), dtype=np.float32)
+        self.out = np.zeros((blocksize, channels), dtype=np.float32)
+        self._old = np.zeros((blocksize, channels), dtype=np.float32)
+
+        fade = max(1, min(blocksize, int(sr * fade_ms / 1000)))
+        self.fade = fade
+        self._fade_in = (np.arange(1, fade + 1, dtype=np.float32) / fade)[:, None]
+        self._fade_out = 1.0 - self._fade_in
+
+        # per-frame gain for volume ramps
+        self._ramp = (np.arange(1, blocksize + 1, dtype=np.float32) / blocksize)[:, None]
+        self._gains = np.zeros((blocksize, 1), dtype=np.float32)
+        self._gain = None
+
+        self.stream = None  # stream the last block came from
+        self.silent = True  # last block faded out (or nothing played yet)
+
+    def render(self, stream):
+        """Read the next block of `stream` into `mix`. Returns frames read from it."""
+        n = stream.read_into(self.mix)
+        f = self.fade
+        head = self.mix[:f]
+
+        if self.silent:
+            head *= self._fade_in
+        elif stream is not self.stream:
+            # whatever the old stream still had buffered fades under the new one
+            old = self._old[:f]
+            self.stream.read_into(old)
+            old *= self._fade_out
+            head *= self._fade_in
+            head += old
+
+        self.stream = stream
+        self.silent = False
+        return n
+
+    def follow(self, stream, start):
+        """Continue the current block from frame `start` with `stream` (gapless track change)."""
+        self.stream = stream
+        return stream.read_into(self.mix[start:])
+
+    def fade_out(self):
+        """Render a block that fades the current stream out to silence."""
+        f = self.fade
+        if self.stream is not None:
+            self.stream.read_into(self.mix, f)
+        else:
+            self.mix[:f] = 0.0
+        self.mix[:f] *= self._fade_out
+        self.mix[f:] = 0.0
+        self.silent = True
+
+    def output(self, gain):
+        """Apply `gain` (ramped from the previous block's) from `mix` into `out`, returns `out`."""
+        if self._gain is None or gain == self._gain:
+            np.multiply(self.mix, gain, out=self.out)
+        else:
+            np.multiply(self._ramp, gain - self._gain, out=self._gains)
+            self._gains += self._gain
+            np.multiply(self.mix, self._gains, out=self.out)
+        self._gain = gain
+        return self.out
@@ -0,0 +1,146 @@
+import numpy as np
+from numba import njit
+
+# --------------------------
+# Drift-compensating resampler
+# --------------------------
+@njit(cache=True)
+def _interp_linear(src, out, frames, phase, ratio):
+    # out[k] = src at fractional position phase + k * ratio
+    channels = out.shape[1]
+    t = phase
+    for k in range(frames):
+        i = int(t)
+        frac = t - i
+        for c in range(channels):
+            out[k, c] = src[i, c] + (src[i + 1, c] - src[i, c]) * frac
+        t += ratio
+
+
+class AdaptiveResampler:
+    """
+    Reads from a RingBuffer at a slightly variable rate so the ring fill
+    level stays at `target_frames`.
+
+    Two output devices never run on exactly the same clock. Without this the
+    ring slowly overflows (dropping audio) or underflows (silence), both of
+    which click. Here the fill level is measured every callback, smoothed,
+    and fed to a PI controller that nudges the read ratio by a few ppm.
+    The integral term ends up holding the clock difference, exposed as
+    `drift_ppm`.
+
+    On underrun (startup, after clear()) it outputs silence until the ring
+    is back at the target level, so latency returns to target immediately
+    instead of being slewed back over minutes.
+    """
+
+    def __init__(self, ring, target_frames, max_frames=4096,
+                 max_ppm=1000.0, kp=1e-6, ki=2.5e-10, smoothing=0.01):
+        self.ring = ring
+        self.target_frames = target_frames
+        self.max_ratio = max_ppm * 1e-6
+        self.kp = kp  # ratio change per frame of fill error
+        self.ki = ki  # integral gain, per frame of error per callback
+        self.smoothing = smoothing
+
+        # input scratch, carries the tail of the last block for interpolation
+        self._max_in = int(max_frames * (1.0 + self.max_ratio)) + 4
+        self._src = np.zeros((self._max_in, ring.channels), dtype=np.float32)
+        self._carry = 1  # frames at the front of _src already holding input
+        self._phase = 0.0
+
+        self._integral = 0.0
+        self._priming = True
+
+        # counters
+        self.ratio = 1.0
+        self.fill = float(target_frames)
+        self.resyncs = 0
+        self.underruns = 0
+
+    @property
+    def drift_ppm(self):
+        """Estimated clock drift of the secondary device, in ppm."""
+        return self._integral * 1e6
+
+    @property
+    def ratio_ppm(self):
+        """Current read-rate correction, in ppm."""
+        return (self.ratio - 1.0) * 1e6
+
+    def reset(self):
+        self._src[:self._carry] = 0.0
+        self._carry = 1
+        self._phase = 0.0
+        self._priming = True
+
+    def _update_ratio(self, available):
+        # way off target (long stall on the slave device): jump instead of
+        # slewing for minutes at max_ppm
+        if available > self.target_frames + self.ring.capacity // 2:
+            self.ring.skip(available - self.target_frames)
+            self.resyncs += 1
+            available = self.ring.available()
+            self.fill = float(available)
+
+        self.fill += (available - self.fill) * self.smoothing
+        err = self.fill - self.target_frames
+
+        self._integral += err * self.ki
+        if self._integral > self.max_ratio:
+            self._integral = self.max_ratio
+        elif self._integral < -self.max_ratio:
+            self._integral = -self.max_ratio
+
+        corr = self._integral + err * self.kp
+        if corr > self.max_ratio:
+            corr = self.max_ratio
+        elif corr < -self.max_ratio:
+            corr = -self.max_ratio
+        self.ratio = 1.0 + corr
+
+    def read_into(self, out, frames=None):
+        """Fill `out[:frames]` with resampled audio from the ring."""
+        if frames is None:
+            frames = out.shape[0]
+
+        self.ring.sync()
+        available = self.ring.available()
+
+        if self._priming:
+            if available < self.target_frames:
+                out[:frames] = 0.0
+                return
+            self._priming = False
+            self.fill = float(available)
+
+        self._update_ratio(available)
+        ratio = self.ratio
+
+        end = self._phase + frames * ratio
+        needed = int(end) + 2
+
+        if needed - self._carry > self.ring.available():
+            # ran dry, go silent and refill to target
+            self.underruns += 1
+            self.reset()
+            out[:frames] = 0.0
+            return
+
+        if needed > self._max_in:
+            # block larger than planned for, grow once
+            grown = np.zeros((needed, self._src.shape[1]), dtype=np.float32)
+            grown[:self._carry] = self._src[:self._carry]
+            self._src = grown
+            self._max_in = needed
+
+        if needed > self._carry:
+            self.ring.read_into(self._src[self._carry:needed])
+
+        _interp_linear(self._src, out, frames, self._phase, ratio)
+
+        # keep the frames the next block still needs (at most 2)
+        keep_from = int(end)
+        self._carry = needed - keep_from
+        self._src[:self._carry] = self._src[keep_from:needed]
+        self._phase = end - keep_from
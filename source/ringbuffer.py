@@ -0,0 +1,216 @@
+import numpy as np
+
+# --------------------------
+# Lock-free SPSC ring buffer
+# --------------------------
+class RingBuffer:
+    """
+    Fixed-capacity single-producer/single-consumer ring of float32 frames.
+
+    One thread calls write(), another calls read_into(). No locks are used:
+    the producer only ever moves `_write`, the consumer only ever moves
+    `_read`, and each index is a plain int that is published after the data
+    it covers has been copied (an int store is atomic under the GIL).
+
+    Indices count frames forever and are wrapped with a mask, so capacity is
+    rounded up to a power of two.
+    """
+
+    def __init__(self, frames, channels=2):
+        capacity = 1
+        while capacity < frames:
+            capacity <<= 1
+        self.capacity = capacity
+        self.channels = channels
+        self._mask = capacity - 1
+        self._buf = np.zeros((capacity, channels), dtype=np.float32)
+        self._write = 0
+        self._read = 0
+        self._flush = False
+
+        # counters (frames), handy for debugging xruns
+        self.overflows = 0
+        self.underflows = 0
+
+    def available(self):
+        """Frames ready to be read."""
+        return self._write - self._read
+
+    def free(self):
+        """Frames that can be written without overflowing."""
+        return self.capacity - (self._write - self._read)
+
+    def write(self, block):
+        """
+        Producer side. Copies a (frames, channels) block into the ring.
+        Frames that don't fit are dropped (the reader owns the read index,
+        so the writer can't discard old audio). Returns frames written.
+        """
+        frames = block.shape[0]
+        n = min(frames, self.free())
+        if n < frames:
+            self.overflows += frames - n
+        if n <= 0:
+            return 0
+
+        start = self._write & self._mask
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = block[:first]
+        if first < n:
+            self._buf[:n - first] = block[first:n]
+
+        self._write += n
+        return n
+
+    def read_into(self, out, frames=None):
+        """
+        Consumer side. Fills `out[:frames]` from the ring, padding with
+        silence if not enough frames are buffered. Returns frames read.
+        """
+        self.sync()
+
+        if frames is None:
+            frames = out.shape[0]
+        n = min(frames, self.available())
+
+        if n > 0:
+            start = self._read & self._mask
+            first = min(n, self.capacity - start)
+            out[:first] = self._buf[start:start + first]
+            if first < n:
+                out[first:n] = self._buf[:n - first]
+            self._read += n
+
+        if n < frames:
+            self.underflows += frames - n
+            out[n:frames] = 0.0
+        return n
+
+    def sync(self):
+        """Consumer side. Apply a pending clear()."""
+        if self._flush:
+            self._flush = False
+            self._read = self._write
+
+    def skip(self, frames):
+        """Consumer side. Discard up to `frames` buffered frames."""
+        n = min(frames, self.available())
+        self._read += n
+        return n
+
+    def clear(self):
+        """
+        Drop everything buffered. Safe to call from any thread: the consumer
+        performs the actual reset on its next read so indices keep a single
+        owner each.
+        """
+        self._flush = True
+
+
+# --------------------------
+# Single-producer, multi-reader ring
+# --------------------------
+class BroadcastRing:
+    """
+    Fixed-capacity ring of float32 frames written by one thread and read by
+    several, each through its own cursor (see reader()).
+
+    The writer never waits for readers, so a stalled output can't hold up
+    the others. A reader that falls more than `capacity` frames behind has
+    lost that audio and is moved up to the oldest frame still in the ring.
+    """
+
+    def __init__(self, frames, channels=2, readers=2):
+        capacity = 1
+        while capacity < frames:
+            capacity <<= 1
+        self.capacity = capacity
+        self.channels = channels
+        self._mask = capacity - 1
+        self._buf = np.zeros((capacity, channels), dtype=np.float32)
+        self._write = 0
+        self._readers = [RingReader(self) for _ in range(readers)]
+
+    def reader(self, i):
+        return self._readers[i]
+
+    def write(self, block):
+        """Producer side. Copies a (frames, channels) block into the ring. Returns frames written."""
+        n = min(block.shape[0], self.capacity)
+        start = self._write & self._mask
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = block[:first]
+        if first < n:
+            self._buf[:n - first] = block[first:n]
+
+        self._write += n
+        return n
+
+    def clear(self):
+        """Drop everything buffered, for every reader."""
+        for reader in self._readers:
+            reader.clear()
+
+
+class RingReader:
+    """
+    One consumer's cursor into a BroadcastRing. Has the consumer side of the
+    RingBuffer API, so it can be handed to an AdaptiveResampler.
+    """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.capacity = ring.capacity
+        self.channels = ring.channels
+        self._read = 0
+        self._flush = False
+
+        # counters (frames)
+        self.overflows = 0
+        self.underflows = 0
+
+    def available(self):
+        """Frames ready to be read."""
+        return min(self.ring._write - self._read, self.capacity)
+
+    def read_into(self, out, frames=None):
+        """Fill `out[:frames]` from the ring, padding with silence. Returns frames read."""
+        self.sync()
+
+        if frames is None:
+            frames = out.shape[0]
+        n = min(frames, self.available())
+
+        if n > 0:
+            buf = self.ring._buf
+            start = self._read & self.ring._mask
+            first = min(n, self.capacity - start)
+            out[:first] = buf[start:start + first]
+            if first < n:
+                out[first:n] = buf[:n - first]
+            self._read += n
+
+        if n < frames:
+            self.underflows += frames - n
+            out[n:frames] = 0.0
+        return n
+
+    def sync(self):
+        """Apply a pending clear(), and catch up if the writer lapped us."""
+        write = self.ring._write
+        if self._flush:
+            self._flush = False
+            self._read = write
+        elif write - self._read > self.capacity:
+            self.overflows += write - self._read - self.capacity
+            self._read = write - self.capacity
+
+    def skip(self, frames):
+        """Discard up to `frames` buffered frames."""
+        n = min(frames, self.available())
+        self._read += n
+        return n
+
+    def clear(self):
+        """Drop everything buffered for this reader, applied on its next read."""
+        self._flush = True
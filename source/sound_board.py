@@ -1,19 +1,24 @@
 import os
 import threading
 import queue
-import subprocess
 import sounddevice as sd
 import soundfile as sf
 import numpy as np
 import keyboard
-from collections import deque
 import json
 import random
 from keymods import is_numlock_on
 import rich
 from sys import argv
 import argparse
-from effects import EFFECTS, EFFECT_PARAMS
+from mixer import Mixer
+from ringbuffer import RingBuffer
+from resampler import AdaptiveResampler
+from audio_cache import warm_cache, clear_cache
+from loudness import normalize_gain
+from watcher import Watcher
+import effects
+from effects import EFFECTS, EFFECT_PARAMS, EffectChain, LiveChain
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--debug", action="store_true")
@@ -21,6 +26,10 @@ parser.add_argument("--cache", required=False, choices=[
     "delete",
     "DEFAULT OPTION"
 ], default="DEFAULT OPTION")
+parser.add_argument("--cache-format", required=False, choices=[
+    "flac",  # compact, decoded into RAM at startup
+    "npy"    # raw float32, memory-mapped: near-instant startup, low RSS, more disk
+], default="flac")
 
 args = parser.parse_args()
 
@@ -33,39 +42,31 @@ else: debug = False
 stream_sr = 48000
 stream_channels = 2
 blocksize = 1024  # preferred frames per callback
+slave_blocksize = blocksize  # secondary device may use a different block size
+slave_ring_frames = 16 * blocksize  # max audio queued for the secondary device (~340 ms)
+slave_target_frames = 2 * blocksize + slave_blocksize  # latency the drift compensation holds the slave at
 master_gain = 1.0  # default master gain
+max_voices = 64  # max sounds playing at once
+voice_steal = "oldest"  # when all voices are busy: "oldest", "quietest" or "none"
+loudness_target = -16.0  # LUFS every sound is normalized to (change live with `loudness <LUFS>`)
+true_peak_limit = -1.5  # dBTP, normalization never boosts peaks past this
 
 SOUND_DIR = "sounds"
 CACHE_DIR = "cache"
 CACHE_PATH = ""
 
 # EFFECTS!
-EFFECT_ENABLED = False
-CURRENT_EFFECTS = [] # list of callables 
-effect_lock = threading.Lock()
+live_effects = LiveChain()  # swapped from the CLI, never locked on the audio thread
 
-def set_effect(fns):
+def set_effect(chain):
     """
-    fns: list of effect functions, or None/[] to disable
+    chain: EffectChain, or None/empty to disable
     """
-    global CURRENT_EFFECTS, EFFECT_ENABLED
-    with effect_lock:
-        if not fns:
-            CURRENT_EFFECTS = []
-            EFFECT_ENABLED = False
-        else:
-            CURRENT_EFFECTS = fns
-            EFFECT_ENABLED = True
+    live_effects.set(chain)
 
 def process_effect(chunk):
-    with effect_lock:
-        if not EFFECT_ENABLED or not CURRENT_EFFECTS:
-            return chunk
-
-        out = chunk
-        for fn in CURRENT_EFFECTS:
-            out = fn(out)
-        return out
+    """Run the effect chain over `chunk` in place."""
+    return live_effects.process(chunk)
 
 
 # --------------------------
@@ -73,77 +74,6 @@ def process_effect(chunk):
 # --------------------------
 audio_engine_alive = False
 
-# --------------------------
-# Audio file preprocessing (ffmpeg)
-# --------------------------
-def load_audio_cached(file, normalize=True, recurse=False):
-    """
-    Load any audio file with resampling, optional loudness normalization,
-    and cache the processed result in FLAC for fast future loads.
-    """
-    base_name = os.path.splitext(os.path.basename(file))[0]
-
-    # Ensure cache directory exists
-    os.makedirs(os.path.join(SOUND_DIR, CACHE_DIR), exist_ok=True)
-    cache_path = os.path.join(SOUND_DIR, CACHE_DIR)
-    os.makedirs(cache_path, exist_ok=True)
-
-    # Encode normalization into cache key
-    norm_tag = "norm" if normalize else "raw"
-    cached_file = os.path.join(
-        cache_path,
-        f"{base_name}_{stream_sr}hz_{norm_tag}.flac"
-    )
-
-    if not os.path.exists(cached_file):
-        cmd = [
-            "ffmpeg", "-y", "-i", file,
-            "-ar", str(stream_sr),
-            "-ac", "2"
-        ]
-
-        if normalize:
-            cmd += ["-af", "loudnorm=I=-16:TP=-1.5:LRA=11"]
-
-        cmd += ["-c:a", "flac", cached_file]
-
-        rich.print(f"[Audio Cache] Creating cached FLAC: {cached_file}")
-        subprocess.run(
-            cmd,
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-        rich.print(f"[Audio Cache] Cache {'[red]MISS' if recurse == False else '[cyan]RELOAD'} [blue]{file}")
-        if debug:
-            cache_misses += 1
-    else:
-        rich.print(f"[Audio Cache] Cache [green]HIT [blue]{file}")
-
-    # Load cached FLAC (very fast)
-    try:
-        data, sr = sf.read(cached_file, dtype="float32")
-    except RuntimeError:
-        rich.print(f"[Audio Cache] Cached file {cached_file} [yellow]READ FAILURE")
-        invalidate = input("Invalidate cache and reload? (y/n) ").lower() in {"y", "yes"}
-        if invalidate:
-            os.remove(cached_file)
-            return load_audio_cached(file, normalize, True)
-        else:
-            raise
-
-    # Ensure stereo
-    if data.ndim == 1:
-        data = np.column_stack([data, data])
-
-    if sr != stream_sr:
-        raise RuntimeError(
-            f"Sample rate mismatch in {file}: {sr} Hz"
-        )
-
-    return data, sr
-
-
 # --------------------------
 # Your mapping / files
 # --------------------------
@@ -157,6 +87,11 @@ numpad_minus_code = 74
 numpad_enter_code = 28
 numpad_del_code = 83
 manual_files = {}
+SLOTS = [i + 200 for i in range(10)] + list(range(70))
+
+def parse_manual_files(data):
+    return {int(key): value.strip() if isinstance(value, str) else None
+            for key, value in data["manual_files"].items()}
 
 def load():
     global CACHE_PATH
@@ -169,32 +104,56 @@ def load():
     CACHE_PATH = os.path.join(SOUND_DIR, CACHE_DIR)
 
     if args.cache == "delete":
-        for file in os.listdir(CACHE_PATH):
-            os.remove(os.path.join(CACHE_PATH, file))
+        clear_cache(CACHE_PATH)
 
     manual_files.clear()
-
-    for key, value in data["manual_files"].items():
-        manual_files[int(key)] = value.strip() if isinstance(value, str) else None
+    manual_files.update(parse_manual_files(data))
 
 # --------------------------
 # Runtime audio structures
 # --------------------------
-audios = {}  # index -> {"data": `np.array, "sr": int, "gain": float}
+audios = {}  # index -> {"data": `np.array, "sr": int, "gain": float, "source": int, "loudness": (LUFS, dBTP), "norm_gain": float}
 play_queue = queue.Queue()  # place requests here
-playing_sounds = []  # list of dicts: {"data":..., "pos":int, "gain":float}
-playing_lock = threading.Lock()
+playing_lock = threading.Lock()  # guards the mixer's voice table and sources
+sources = {}  # realpath -> mixer source id, shared by slots with the same file
+
+# mixed audio from the master callback for the slave to consume (lock-free SPSC)
+slave_ring = RingBuffer(slave_ring_frames, stream_channels)
+# slave device runs on its own clock, resample slightly to keep the ring at target fill
+slave_resampler = AdaptiveResampler(slave_ring, slave_target_frames, slave_blocksize)
 
-# small cache of last produced mixed chunks from master callback for slave to consume
-slave_buffer = deque(maxlen=256)  # holds np arrays of shape (frames,channels)
-slave_buffer_lock = threading.Lock()
+# preallocated mixer + voice table so the master callback doesn't allocate
+mixer = Mixer(stream_channels, blocksize, max_voices, voice_steal)
 
 # --------------------------
 # Playback utilities
 # --------------------------
-def play_sound(data, gain=1.0):
-    """Queue a sound to play (data is the numpy float32 stereo array)."""
-    play_queue.put({'data': data, 'gain': gain})
+def register_sound(data):
+    """Hand a loaded numpy float32 stereo array to the mixer, returns its source id."""
+    with playing_lock:
+        return mixer.add_source(data)
+
+def replace_sound(source, data):
+    """Swap the audio of a registered sound, e.g. after its file was edited."""
+    with playing_lock:
+        mixer.replace_source(source, data)
+
+def play_sound(source, gain=1.0):
+    """Queue a sound to play (source is the id from register_sound)."""
+    play_queue.put({'source': source, 'gain': gain})
+
+def play_slot(idx):
+    """Queue the sound in slot `idx` with its gain and loudness normalization."""
+    entry = audios[idx]
+    play_sound(entry["source"], entry["gain"] * entry["norm_gain"])
+
+def set_loudness_target(target):
+    """Re-normalize every loaded sound to `target` LUFS (no re-transcode, just new gains)."""
+    global loudness_target
+    loudness_target = target
+    for entry in audios.values():
+        if entry:
+            entry["norm_gain"] = normalize_gain(entry["loudness"], loudness_target, true_peak_limit)
 
 def num_pad_handler(num_pad_num):
     if not keyboard.is_pressed(83):
@@ -215,11 +174,11 @@ def num_pad_handler(num_pad_num):
 
         if idx == 33:
             number = random.randint(0, 9)
-            play_sound(audios[200 + number]["data"], audios[200 + number]["gain"])
+            play_slot(200 + number)
             print(f"playing {200 + number}")
         else:
             if audios.get(idx):
-                play_sound(audios[idx]["data"], audios[idx]["gain"])
+                play_slot(idx)
                 print(f"playing {idx}")
             else:
                 print(f"num_pad_{idx} is None.")
@@ -231,9 +190,8 @@ def on_key(event):
         if event.scan_code == numpad_stop_code:
             print("Stopping all sounds immediately.")
             with playing_lock:
-                playing_sounds.clear()
-            with slave_buffer_lock:
-                slave_buffer.clear()
+                mixer.stop_all()
+            slave_ring.clear()
             # let callbacks output silence naturally
             return
 
@@ -247,7 +205,7 @@ def master_callback(outdata, frames, time_info, status):
     """
     This is called by sounddevice for the primary output device.
     It mixes the currently-playing sounds into 'outdata' and advances positions.
-    It also stores a copy into slave_buffer for the secondary device to play.
+    It also writes the mix into slave_ring for the secondary device to play.
     """
     global master_gain
     if status:
@@ -255,91 +213,38 @@ def master_callback(outdata, frames, time_info, status):
         # print("Master status:", status)
         pass
 
-    # attempt to pull new play requests (non-blocking)
-    try:
-        while True:
-            req = play_queue.get_nowait()
-            with playing_lock:
-                playing_sounds.append({'data': req['data'], 'pos': 0, 'gain': req.get('gain', 1.0)})
-    except queue.Empty:
-        pass
-
-    # create output buffer
-    out = np.zeros((frames, stream_channels), dtype='float32')
-
     with playing_lock:
-        finished_indices = []
-        for i, s in enumerate(playing_sounds):
-            data = s['data']
-            pos = s['pos']
-            gain = s['gain'] * master_gain
-
-            # slice requested frames
-            chunk = data[pos:pos + frames]
-            chunk_len = chunk.shape[0]
-
-            if chunk_len == 0:
-                finished_indices.append(i)
-                continue
-
-            if chunk_len < frames:
-                # pad the remainder with zeros
-                pad = np.zeros((frames - chunk_len, stream_channels), dtype='float32')
-                chunk = np.vstack([chunk, pad])
-                finished_indices.append(i)
-
-            # mix (additive)
-            out[:chunk.shape[0]] += chunk * gain
-            # advance position by actual samples consumed
-            s['pos'] += chunk_len
-
-        # remove finished entries (in reverse order)
-        for idx in reversed(finished_indices):
-            del playing_sounds[idx]
+        # attempt to pull new play requests (non-blocking)
+        try:
+            while True:
+                req = play_queue.get_nowait()
+                mixer.play(req['source'], req.get('gain', 1.0))
+        except queue.Empty:
+            pass
 
-    # final clipping to avoid distortion
-    np.clip(out, -1.0, 1.0, out=out)
+        out = mixer.mix(frames, master_gain)
 
     out = process_effect(out)
     # write to outdata (this is the buffer the sounddevice will output)
     outdata[:] = out
 
-    # also push a copy for the slave to consume
-    with slave_buffer_lock:
-        # keep small copies, don't grow memory
-        slave_buffer.append(out.copy())
+    # also feed the slave (copied into the ring, no per-block arrays)
+    slave_ring.write(out)
 
 # --------------------------
 # The slave callback (secondary device)
 # --------------------------
 def slave_callback(outdata, frames, time_info, status):
     """
-    Secondary device callback. It consumes the mixed chunks produced by master callback.
+    Secondary device callback. It consumes the mixed audio produced by master callback.
     If empty, it outputs silence (prevents blocking).
     """
     if status:
         # print("Slave status:", status)
         pass
 
-    with slave_buffer_lock:
-        if len(slave_buffer) > 0:
-            chunk = slave_buffer.popleft()
-            # If frames differ (unlikely), handle it:
-            if chunk.shape[0] == frames:
-                outdata[:] = chunk
-            elif chunk.shape[0] > frames:
-                outdata[:] = chunk[:frames]
-                # If there's leftover, push the remainder back front
-                remainder = chunk[frames:]
-                slave_buffer.appendleft(remainder)
-            else:
-                # chunk shorter than frames -> pad
-                pad = np.zeros((frames - chunk.shape[0], stream_channels), dtype='float32')
-                out = np.vstack([chunk, pad])
-                outdata[:] = out
-        else:
-            # no mixed chunk ready -> silence
-            outdata[:] = np.zeros((frames, stream_channels), dtype='float32')
+    # reads exactly `frames`, any block size works; pads with silence when empty
+    slave_resampler.read_into(outdata, frames)
 
 # -------------------------
 # Audio Engine
@@ -376,7 +281,7 @@ def create_streams():
             channels=stream_channels,
             device=dev2,
             dtype='float32',
-            blocksize=blocksize,
+            blocksize=slave_blocksize,
             callback=slave_callback
         )
     except Exception as e:
@@ -440,10 +345,9 @@ def stop_audio_engine():
         print("Slave stop error:", e)
 
     with playing_lock:
-        playing_sounds.clear()
+        mixer.stop_all()
 
-    with slave_buffer_lock:
-        slave_buffer.clear()
+    slave_ring.clear()
 
     try:
         play_queue.queue.clear()
@@ -483,12 +387,33 @@ def gain_control_loop():
                     print(f"No sound at index {idx}")
             except Exception as e:
                 print(f"Error setting gain: {e}")
+        elif cmd.startswith("loudness "):
+            try:
+                set_loudness_target(float(cmd.split()[1]))
+                print(f"Loudness target set to {loudness_target} LUFS")
+            except ValueError:
+                print("Invalid loudness value.")
+        elif cmd == "drift":
+            print(f"Slave drift: {slave_resampler.drift_ppm:+.1f} ppm "
+                  f"(correction {slave_resampler.ratio_ppm:+.1f} ppm, "
+                  f"fill {slave_resampler.fill:.0f}/{slave_target_frames} frames, "
+                  f"underruns {slave_resampler.underruns}, resyncs {slave_resampler.resyncs}, "
+                  f"dropped {slave_ring.overflows} frames)")
         elif cmd.startswith("reload "):
             mode = cmd.split()[1]
             
             reload(mode)
 
         elif cmd.startswith("effect"):
+            if cmd.split()[1] == "ir":
+                parts = cmd.split(maxsplit=2)
+                if len(parts) < 3:
+                    print("Usage: effect ir <file>")
+                    continue
+                effects.CONVOLUTION_IR = parts[2]
+                print(f"Impulse response set to {parts[2]}, used from the next 'effect convolution'")
+                continue
+
             if cmd.split()[1] == "param":
                 if len(cmd.split()) < 4:
                     print("Error! To set a parameter you need at least four terms!")
@@ -519,74 +444,118 @@ def gain_control_loop():
 
             names = [n.strip() for n in arg.split(",") if n.strip()]
 
-            fns = []
-            for n in names:
-                fn = EFFECTS.get(n)
-                if not fn:
-                    print(f"Unknown effect: {n}")
-                    print("Available:", ", ".join(EFFECTS.keys()))
-                    fns = []
-                    break
-                fns.append(fn)
-
-            if fns:
-                set_effect(fns)
+            try:
+                chain = EffectChain.from_names(names, stream_channels)
+            except KeyError as e:
+                print(e.args[0])
+                print("Available:", ", ".join(EFFECTS.keys()))
+                continue
+
+            if chain:
+                set_effect(chain)
                 print("Effect chain:", " -> ".join(names))
                 
         else:
-            print("Commands: master <value>, gain <index> <value>")
+            print("Commands: master <value>, gain <index> <value>, loudness <LUFS>, drift")
 
 # --------------------------
 # Audio reload helper
 # --------------------------
-def reload_audio_files():
+def load_slots(slots, changed=()):
     """
-    Loads/resamples/normalizes all audio files from manual_files into `audios`.
-    Handles slots 200-209 and 0-69.
+    Loads/resamples/normalizes the files of `slots` from manual_files into
+    `audios`. Cache misses are transcoded in parallel and a file mapped to
+    several slots is only loaded once. Realpaths in `changed` were edited
+    on disk, their already registered sounds get the new audio.
     """
-    # Reload 200–209
-    for i in range(10):
-        name = manual_files.get(i + 200)
-
-        if not name:
-            print(f"missing file for slot {i + 200}: {name}")
+    files = {}
+    for slot in slots:
+        name = manual_files.get(slot)
+        file = os.path.join(SOUND_DIR, name) if name else None
+
+        if not file or not os.path.exists(file):
+            audios[slot] = None
+            print(f"File for {slot} is missing: {file}")
             continue
 
-        file = os.path.join(SOUND_DIR, name)
+        files[slot] = file
 
-        if not os.path.exists(file):
-            print(f"missing file for slot {i + 200}: {file}")
+    # every loaded slot's cache entry stays, its npy file may be mapped
+    in_use = {entry["key"] for entry in audios.values() if entry}
+    loaded = warm_cache(files.values(), stream_sr=stream_sr,
+                        cache_path=os.path.join(SOUND_DIR, CACHE_DIR),
+                        cache_format=args.cache_format, keep=in_use)
+
+    changed = set(changed)
+    for slot, file in files.items():
+        key = os.path.realpath(file)
+        if key not in loaded:
+            audios[slot] = None
             continue
 
-        data, sr = load_audio_cached(file)
-        audios[i + 200] = {"data": data, "sr": sr, "gain": 1.0}
-        print(f"Reloaded num_pad_{i + 200}: {file}")
+        data, sr, loudness, cache_key = loaded[key]
+        if key not in sources:
+            sources[key] = register_sound(data)
+        elif key in changed:
+            replace_sound(sources[key], data)
+            changed.discard(key)
 
+        # slots 0-69 keep their gain across reloads
+        prev = (audios.get(slot) or {}) if slot < 200 else {}
+        audios[slot] = {
+            "data": data,
+            "sr": sr,
+            "gain": prev.get("gain", 1.0),
+            "source": sources[key],
+            "key": cache_key,
+            "loudness": loudness,
+            "norm_gain": normalize_gain(loudness, loudness_target, true_peak_limit),
+        }
+        print(f"Loaded num_pad_{slot}: {file}")
 
-   # Reload 0–69
-    for i in range(70):
-        name = manual_files.get(i)
+def reload_audio_files():
+    """Reloads every slot (200-209 and 0-69), see load_slots()."""
+    # old source ids are invalid after a reload
+    with playing_lock:
+        mixer.clear_sources()
+    sources.clear()
+    load_slots(SLOTS)
 
+# --------------------------
+# File watching
+# --------------------------
+def on_files_changed(paths):
+    """
+    Watcher callback. Reloads only the slots whose file changed on disk or
+    whose mapping changed in sounds.json, so editing one clip costs one
+    transcode instead of a full reload.
+    """
+    paths = {os.path.normpath(p) for p in paths}
+    slots = set()
+
+    if "sounds.json" in paths:
+        with open("sounds.json", "r", encoding="utf-8") as f:
+            new_files = parse_manual_files(json.load(f))
+        slots |= {slot for slot in SLOTS if new_files.get(slot) != manual_files.get(slot)}
+        manual_files.clear()
+        manual_files.update(new_files)
+
+    changed = set()
+    for slot in SLOTS:
+        name = manual_files.get(slot)
         if not name:
-            audios[i] = None
-            print(f"File for {i} is missing.")
             continue
+        file = os.path.normpath(os.path.join(SOUND_DIR, name))
+        # a bare folder means the watcher lost track of it, treat all its files as changed
+        if file in paths or os.path.dirname(file) in paths:
+            slots.add(slot)
+            changed.add(os.path.realpath(file))
 
-        file = os.path.join(SOUND_DIR, name)
-
-        if not os.path.exists(file):
-            audios[i] = None
-            print(f"File for {i} is missing: {file}")
-            continue
-
-        data, sr = load_audio_cached(file)
-        audios[i] = {
-            "data": data,
-            "sr": sr,
-            "gain": audios.get(i, {}).get("gain", 1.0),
-        }
-        print(f"Reloaded num_pad_{i}: {file}")
+    if slots:
+        print(f"[WATCH] Updating slots {sorted(slots)}")
+        load_slots(sorted(slots), changed)
 
+watcher = Watcher(on_files_changed)
 
 # --------------------------
 # Reloaders
@@ -596,10 +565,9 @@ def reload_soft():
 
     # Stop playback
     with playing_lock:
-        playing_sounds.clear()
+        mixer.stop_all()
 
-    with slave_buffer_lock:
-        slave_buffer.clear()
+    slave_ring.clear()
 
     # Reload JSON
     manual_files.clear()
@@ -667,26 +635,16 @@ def main():
     assert CACHE_DIR != ""
     assert CACHE_PATH not in ["", f"{SOUND_DIR}", f"{CACHE_DIR}"], f"Cache Path is a dangerous path! ({CACHE_PATH})"
 
-    # Preload a selection of sounds (200-209)
-    for i in range(10):
-        file = manual_files.get(i + 200)
-        if not file or not os.path.exists(os.path.join(SOUND_DIR, file)):
-            print(f"missing file for slot {i + 200}: {file}")
-            continue
-        data, sr = load_audio_cached(os.path.join(SOUND_DIR, file))
-        audios[i + 200] = {"data": data, "sr": sr, "gain": 1.0}
-        print(f"Loaded num_pad_{i + 200}: {file}")
-
-    # Preload normal slots 0-69
-    for i in range(70):
-        file = manual_files.get(i)
-        if file and os.path.exists(os.path.join(SOUND_DIR, file)):
-            data, sr = load_audio_cached(os.path.join(SOUND_DIR, file))
-            audios[i] = {"data": data, "sr": sr, "gain": 1.0}
-            print(f"Loaded num_pad_{i}: {file}")
-        else:
-            audios[i] = None
-            print(f"File for {i} missing.")
+    # Preload slots 200-209 and 0-69
+    reload_audio_files()
+
+    # Pick up edits to sounds.json and the sound files as they happen
+    watcher.watch("sounds.json")
+    watcher.watch(SOUND_DIR)
+    watcher.start()
+
+    # Compile the effect kernels before the callbacks can run them
+    effects.warmup(blocksize, (stream_channels,))
 
     # Start the audio engine (device selection + streams + threads)
     start_audio_engine()
@@ -1,7 +1,7 @@
 import sounddevice as sd
 from keymods import capslock_on
 import threading
-from effects import EFFECTS, EFFECT_PARAMS
+from effects import EFFECTS, EFFECT_PARAMS, LiveChain
 
 toggler = False
 
@@ -22,21 +22,13 @@ gain1 = 1
 gain2 = 1
 
 # ---------------- Effect System ----------------
-EFFECT_ENABLED = False
-CURRENT_EFFECT = None
-effect_lock = threading.Lock()
+live_effects = LiveChain()
 
-def set_effect(fn):
-    global CURRENT_EFFECT, EFFECT_ENABLED
-    with effect_lock:
-        CURRENT_EFFECT = fn
-        EFFECT_ENABLED = fn is not None
+def set_effect(chain):
+    live_effects.set(chain)
 
 def process_effect(chunk):
-    with effect_lock:
-        if not EFFECT_ENABLED or CURRENT_EFFECT is None:
-            return chunk
-        return CURRENT_EFFECT(chunk)
+    return live_effects.process(chunk)
 
 # Open output streams
 stream1 = sd.OutputStream(
@@ -0,0 +1,80 @@
+import threading
+from collections import deque
+
+# --------------------------
+# Prefetched upcoming tracks
+# --------------------------
+class TrackQueue:
+    """
+    The next few tracks of a player, already opened and decoding.
+
+    `pick(last)` chooses the track that plays after `last` (the previous
+    upcoming entry, or None for the playing track) and returns an entry
+    dict with at least "path", or None if there is nothing to play.
+    `load(entry)` opens it, storing a StreamDecoder under "stream".
+
+    A worker thread keeps `depth` entries loaded, so taking the next track
+    with pop() never waits on a decoder start and can happen on the audio
+    path. Each entry only buffers its decoder's ring, so memory is bounded
+    by `depth`. reset() drops everything after the play order changed
+    (shuffle toggled, another track picked by hand, playlist reloaded).
+    """
+
+    def __init__(self, pick, load, depth=2):
+        self.pick = pick
+        self.load = load
+        self.depth = depth
+        self._entries = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._generation = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while True:
+                with self._lock:
+                    if len(self._entries) >= self.depth:
+                        break
+                    generation = self._generation
+                    last = self._entries[-1] if self._entries else None
+
+                try:
+                    entry = self.pick(last)
+                    if entry is None:
+                        break
+                    self.load(entry)
+                except Exception as e:
+                    print(f"[PREFETCH] {e}")
+                    break
+
+                with self._lock:
+                    if generation == self._generation:
+                        self._entries.append(entry)
+                        continue
+                # order changed while loading, this pick is stale
+                entry["stream"].close()
+
+    def pop(self):
+        """Take the next loaded entry, or None if none is ready yet."""
+        with self._lock:
+            entry = self._entries.popleft() if self._entries else None
+        self._wake.set()
+        return entry
+
+    def peek(self):
+        with self._lock:
+            return self._entries[0] if self._entries else None
+
+    def reset(self):
+        """Forget all upcoming entries and pick them again."""
+        with self._lock:
+            self._generation += 1
+            stale = list(self._entries)
+            self._entries.clear()
+        for entry in stale:
+            entry["stream"].close()
+        self._wake.set()
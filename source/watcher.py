@@ -0,0 +1,296 @@
+import os
+import sys
+import time
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+
+# --------------------------
+# inotify (Linux)
+# --------------------------
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+class _Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._rm = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._wds = {}  # wd -> directory
+
+    def add(self, folder):
+        wd = self._add(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Can't watch {folder}")
+        self._wds[wd] = folder
+
+    def remove(self, folder):
+        for wd, watched in list(self._wds.items()):
+            if watched == folder:
+                self._rm(self.fd, wd)
+                del self._wds[wd]
+
+    def remove_all(self):
+        for wd in list(self._wds):
+            self._rm(self.fd, wd)
+        self._wds.clear()
+
+    def poll(self, folders, timeout):
+        """Changed paths within `timeout` seconds."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, report every watched folder as a whole ("folder/")
+                changed.update(os.path.join(folder, "") for folder in folders)
+                continue
+            folder = self._wds.get(wd)
+            if folder is not None and name:
+                changed.add(os.path.join(folder, name))
+        return changed
+
+# --------------------------
+# Polling fallback
+# --------------------------
+RESCAN = 30.0  # seconds between full rescans when polling, catches edits in place
+
+class _Polling:
+    """
+    Stats each folder every poll and only lists and stats its files when
+    the folder itself changed (a file added, removed or renamed over it).
+    Edits in place don't touch the folder, so every file is also re-checked
+    every `rescan` seconds.
+    """
+
+    def __init__(self, interval, rescan=RESCAN):
+        self.interval = interval
+        self.rescan = rescan
+        self._snapshots = {}  # directory -> {name: (mtime, size)}
+        self._folder_mtimes = {}  # directory -> its mtime when the snapshot was taken
+        self._last_rescan = time.monotonic()
+
+    @staticmethod
+    def _folder_mtime(folder):
+        try:
+            return os.stat(folder).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _snapshot(folder, names):
+        snap = {}
+        try:
+            entries = os.listdir(folder) if names is None else names
+        except OSError:
+            return snap
+        for name in entries:
+            try:
+                st = os.stat(os.path.join(folder, name))
+            except OSError:
+                continue
+            snap[name] = (st.st_mtime, st.st_size)
+        return snap
+
+    def add(self, folder, names):
+        old = self._snapshots.get(folder)
+        self._folder_mtimes[folder] = self._folder_mtime(folder)
+        new = self._snapshot(folder, names)
+        if old is not None:
+            # already watched: keep what the last poll saw, so changes since
+            # then are still reported by the next one
+            new.update(old)
+            self._folder_mtimes[folder] = None
+        self._snapshots[folder] = new
+
+    def remove(self, folder):
+        self._snapshots.pop(folder, None)
+        self._folder_mtimes.pop(folder, None)
+
+    def remove_all(self):
+        self._snapshots.clear()
+        self._folder_mtimes.clear()
+
+    def poll(self, folders, timeout):
+        time.sleep(min(timeout, self.interval))
+        now = time.monotonic()
+        full = now - self._last_rescan >= self.rescan
+        if full:
+            self._last_rescan = now
+
+        changed = set()
+        for folder, names in folders.items():
+            mtime = self._folder_mtime(folder)
+            # filesystems with coarse timestamps can change twice within one
+            # mtime tick, so a folder modified in the last 2 s is always rescanned
+            recent = mtime is not None and time.time_ns() - mtime < 2_000_000_000
+            if not full and not recent and mtime == self._folder_mtimes.get(folder):
+                continue
+            self._folder_mtimes[folder] = mtime
+            old = self._snapshots.get(folder, {})
+            new = self._snapshot(folder, names)
+            for name in old.keys() | new.keys():
+                if old.get(name) != new.get(name):
+                    changed.add(os.path.join(folder, name))
+            self._snapshots[folder] = new
+        return changed
+
+# --------------------------
+# Watcher
+# --------------------------
+class Watcher:
+    """
+    Calls `callback(paths)` from a background thread with the set of files
+    that were added, removed or changed in the watched folders.
+
+    Uses inotify on Linux and falls back to polling every `interval`
+    seconds elsewhere (or when inotify isn't available). Events are
+    batched until nothing changed for `debounce` seconds, so a file being
+    written in several steps or a burst of copies arrives as one call.
+
+    watch() takes a folder (every file in it) or a file (just that file,
+    watched through its folder so editors that save by renaming are seen).
+    If the callback returns paths, they replace what's watched (see
+    watch_only()); it must not call clear() itself, that drops events that
+    arrived while it ran.
+    """
+
+    def __init__(self, callback, debounce=0.5, interval=2.0, polling=False):
+        self.callback = callback
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._folders = {}  # folder -> set of names, or None for all
+        self._pending = set()
+        self._last_event = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._backend = None
+        if not polling and sys.platform.startswith("linux"):
+            try:
+                self._backend = _Inotify()
+            except (OSError, AttributeError) as e:
+                print(f"[WATCH] inotify unavailable ({e}), polling instead")
+        if self._backend is None:
+            self._backend = _Polling(interval)
+        self.kind = "inotify" if isinstance(self._backend, _Inotify) else "polling"
+
+    def watch(self, path):
+        with self._lock:
+            self._watch(path)
+
+    def watch_only(self, paths):
+        """
+        Watch exactly `paths` from now on, in one step. Folders that stay
+        watched keep their watch, and pending events for paths that are
+        still watched are kept.
+        """
+        with self._lock:
+            old, self._folders = self._folders, {}
+            for path in paths:
+                self._watch(path, old)
+            for folder in old.keys() - self._folders.keys():
+                self._backend.remove(folder)
+            self._pending = {p for p in self._pending if self._wanted(p)}
+
+    def _watch(self, path, watched=()):
+        """watch() with the lock held. Folders in `watched` already have a backend watch."""
+        # reported paths are normalized, e.g. "music/" -> "music"
+        path = os.path.normpath(path)
+        if os.path.isdir(path):
+            folder, name = path, None
+        else:
+            folder, name = os.path.split(path)
+            folder = folder or "."
+        if not os.path.isdir(folder):
+            print(f"[WATCH] Not watching {path}, folder missing")
+            return
+
+        known = folder in self._folders
+        if name is None:
+            self._folders[folder] = None
+        elif not known:
+            self._folders[folder] = {name}
+        elif self._folders[folder] is not None:
+            self._folders[folder].add(name)
+        names = self._folders[folder]
+
+        if isinstance(self._backend, _Inotify):
+            if not known and folder not in watched:
+                self._backend.add(folder)
+        else:
+            self._backend.add(folder, names)
+
+    def clear(self):
+        """Stop watching everything (the thread keeps running)."""
+        with self._lock:
+            self._folders.clear()
+            self._pending.clear()
+            self._backend.remove_all()
+
+    def _wanted(self, path):
+        folder, name = os.path.split(path)
+        if folder not in self._folders:
+            return False
+        names = self._folders[folder]
+        return names is None or name in names or not name
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                folders = dict(self._folders)
+            timeout = self.debounce if self._pending else 1.0
+            changed = self._backend.poll(folders, timeout)
+
+            with self._lock:
+                changed = {p for p in changed if self._wanted(p)}
+                now = time.monotonic()
+                if changed:
+                    self._pending |= changed
+                    self._last_event = now
+                    continue
+                if not self._pending or now - self._last_event < self.debounce:
+                    continue
+                batch, self._pending = self._pending, set()
+
+            try:
+                paths = self.callback(batch)
+            except Exception as e:
+                print(f"[WATCH] Update failed: {e}")
+                continue
+            if paths is not None:
+                self.watch_only(paths)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
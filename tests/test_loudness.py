@@ -0,0 +1,62 @@
+import tracemalloc
+import numpy as np
+import soundfile as sf
+from loudness import LoudnessMeter, integrated_loudness, measure, measure_file, true_peak
+
+SR = 48000
+
+def _signal(seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SR)
+    t = np.arange(n) / SR
+    # loud and quiet passages, so both gates do something
+    env = np.where((t % 4) < 2, 0.5, 0.02)
+    mono = env * np.sin(2 * np.pi * 440 * t) + 0.01 * rng.standard_normal(n)
+    return np.column_stack([mono, 0.8 * mono]).astype(np.float32)
+
+def test_streamed_matches_whole_array():
+    data = _signal(10.3)
+    meter = LoudnessMeter(SR, 2)
+    for start in range(0, len(data), 7001):
+        meter.feed(data[start:start + 7001])
+    integrated, peak = meter.finish()
+    assert abs(integrated - integrated_loudness(data, SR)) < 1e-6
+    assert abs(peak - true_peak(data)) < 1e-3
+
+def test_short_and_silent():
+    data = _signal(0.2)
+    meter = LoudnessMeter(SR, 2)
+    meter.feed(data)
+    assert abs(meter.finish()[0] - integrated_loudness(data, SR)) < 1e-6
+
+    meter = LoudnessMeter(SR, 2)
+    meter.feed(np.zeros((SR, 2), dtype=np.float32))
+    assert meter.finish() == (float("-inf"), float("-inf"))
+
+def test_measure_file_matches_measure(tmp_path):
+    path = str(tmp_path / "clip.wav")
+    data = _signal(6.0)
+    sf.write(path, data, SR, subtype="FLOAT")
+    integrated, peak = measure_file(path, SR)
+    expected = measure(data, SR)
+    assert abs(integrated - expected[0]) < 1e-6
+    assert abs(peak - expected[1]) < 1e-3
+
+def test_long_file_bounded_memory(tmp_path):
+    path = str(tmp_path / "long.wav")
+    minutes = 3
+    with sf.SoundFile(path, "w", SR, 2, subtype="PCM_16") as f:
+        for seed in range(minutes * 6):
+            f.write(_signal(10.0, seed))
+
+    tracemalloc.start()
+    try:
+        integrated, _ = measure_file(path, SR)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert np.isfinite(integrated)
+    # the whole track as float32 alone would be ~66 MB
+    whole = minutes * 60 * SR * 2 * 4
+    assert peak_bytes < 16 * 1024 ** 2 < whole
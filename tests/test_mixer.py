@@ -0,0 +1,45 @@
+import numpy as np
+from numba.core.registry import CPUDispatcher
+from numba.typed import typedlist
+import mixer as mixer_module
+from mixer import Mixer
+
+SR = 48000
+BLOCKSIZE = 1024
+
+def _compiled():
+    """Signatures compiled so far for the mix kernel and the typed List's own methods."""
+    kernels = {"_mix_voices": mixer_module._mix_voices}
+    kernels.update((name, fn) for name, fn in vars(typedlist).items() if isinstance(fn, CPUDispatcher))
+    return {name: len(fn.signatures) for name, fn in kernels.items()}
+
+def test_play_and_mix_compile_nothing():
+    mixer = Mixer(2, BLOCKSIZE, 8)
+    source = mixer.add_source(np.zeros((SR, 2), dtype=np.float32))
+    before = _compiled()
+    mixer.play(source)
+    mixer.mix(BLOCKSIZE)
+    assert _compiled() == before
+
+def test_replace_source_compiles_nothing():
+    mixer = Mixer(2, BLOCKSIZE, 8)
+    source = mixer.add_source(np.zeros((SR, 2), dtype=np.float32))
+    before = _compiled()
+    mixer.replace_source(source, np.zeros((SR // 2, 2), dtype=np.float32))
+    mixer.play(source)
+    assert _compiled() == before
+
+def test_play_uses_the_replaced_length():
+    mixer = Mixer(1, BLOCKSIZE, 4)
+    source = mixer.add_source(np.ones((10, 1), dtype=np.float32))
+    mixer.replace_source(source, np.ones((3, 1), dtype=np.float32))
+    mixer.play(source)
+    out = mixer.mix(8)
+    assert out[:3, 0].tolist() == [1.0, 1.0, 1.0]
+    assert not out[3:].any()
+    assert mixer.voice_count() == 0
+
+def test_stale_source_is_dropped():
+    mixer = Mixer(2, BLOCKSIZE, 4)
+    assert mixer.play(0) == -1
+    assert mixer.dropped == 1